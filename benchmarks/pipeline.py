@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Dump, compress and restore pipeline benchmark
+
+Generates synthetic schemas in a local MySQL server, then backs them up and
+restores them through BackupManager for every combination of dump mode,
+codec and job count asked for. Each run happens in a fresh interpreter with
+its own HOME, so its wall time, CPU time (including mysqldump, mysql and the
+compressors) and peak RSS are measured on their own. Results are printed one
+line per run and appended as JSON lines to --output.
+
+    python benchmarks/pipeline.py --password secret [--tables 8] [--rows 200000]
+        [--schemas 2] [--modes mysqldump,native,shell] [--codecs gzip,zstd,lz4]
+        [--jobs 1,4] [--no-restore] [--output results.jsonl]
+
+The "shell" mode times a plain `mysqldump | compressor > file` pipeline as a
+baseline. Schemas are named cybexdump_bench_<n> and are reused by later runs
+with the same --tables and --rows; restores go to cybexdump_bench_<n>_restore.
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_ROOT)
+
+import mysql.connector  # noqa: E402
+from cybexdump.compression import codec_extension, compress_command  # noqa: E402
+
+SCHEMA_PREFIX = "cybexdump_bench_"
+# Rows inserted by the first statement; every later one doubles the table
+SEED_ROWS = 1000
+
+TABLE_DEFINITION = """
+CREATE TABLE {table} (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    account_id INT NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    amount DECIMAL(12,2) NOT NULL,
+    created DATETIME NOT NULL,
+    note VARCHAR(255) NOT NULL,
+    payload VARCHAR(512) NOT NULL,
+    PRIMARY KEY (id),
+    KEY account_created (account_id, created)
+) ENGINE=InnoDB
+"""
+
+# `note` repeats a few words and compresses well, `payload` is hex and doesn't
+SEED_INSERT = """
+INSERT INTO {table} (account_id, status, amount, created, note, payload)
+SELECT FLOOR(RAND({seed}) * 100000),
+       ELT(1 + FLOOR(RAND() * 4), 'new', 'paid', 'shipped', 'refunded'),
+       ROUND(RAND() * 10000, 2),
+       '2024-01-01' + INTERVAL FLOOR(RAND() * 31536000) SECOND,
+       CONCAT('order for account ', FLOOR(RAND() * 100000), ' placed via ',
+              ELT(1 + FLOOR(RAND() * 3), 'web', 'mobile', 'api')),
+       SHA2(RAND(), 512)
+FROM information_schema.COLUMNS LIMIT {rows}
+"""
+
+DOUBLE_INSERT = """
+INSERT INTO {table} (account_id, status, amount, created, note, payload)
+SELECT FLOOR(RAND({seed}) * 100000), status, amount, created + INTERVAL 1 DAY, note, SHA2(RAND(), 512)
+FROM {table} LIMIT {rows}
+"""
+
+# Runs inside the measured interpreter: one backup or restore through BackupManager
+RUNNER = (
+    "import json, sys\n"
+    "from cybexdump.backup_manager import BackupManager\n"
+    "task = json.loads(sys.argv[1])\n"
+    "manager = BackupManager()\n"
+    "if task['operation'] == 'backup':\n"
+    "    output = manager.perform_backups(jobs=task['jobs'], compression=task['compression'])\n"
+    "else:\n"
+    "    output = [manager.restore_from_backup(path, database=schema, jobs=task['jobs'], database_id=1)\n"
+    "              for path, schema in task['restores']]\n"
+    "with open(task['result_file'], 'w') as f:\n"
+    "    json.dump(output, f, default=str)\n"
+)
+
+
+def connect(options, database=None):
+    return mysql.connector.connect(host=options.host, port=options.port, user=options.user,
+                                   password=options.password, database=database, autocommit=True)
+
+
+def generate(options):
+    """Create the synthetic schemas unless they already hold the requested rows"""
+    conn = connect(options)
+    cursor = conn.cursor()
+    schemas = []
+    for number in range(1, options.schemas + 1):
+        schema = f"{SCHEMA_PREFIX}{number}"
+        schemas.append(schema)
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME LIKE 't\\_%'",
+            (schema,)
+        )
+        if cursor.fetchone()[0] == options.tables:
+            cursor.execute(f"SELECT COUNT(*) FROM `{schema}`.`t_{options.tables}`")
+            if cursor.fetchone()[0] == options.rows:
+                continue
+
+        started = time.perf_counter()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{schema}`")
+        cursor.execute(f"CREATE DATABASE `{schema}`")
+        for index in range(1, options.tables + 1):
+            table = f"`{schema}`.`t_{index}`"
+            cursor.execute(TABLE_DEFINITION.format(table=table))
+            rows = min(SEED_ROWS, options.rows)
+            seed = number * 1000 + index
+            cursor.execute(SEED_INSERT.format(table=table, seed=seed, rows=rows))
+            while rows < options.rows:
+                cursor.execute(DOUBLE_INSERT.format(table=table, seed=seed + rows, rows=options.rows - rows))
+                rows += cursor.rowcount
+        print(f"generated {schema}: {options.tables} tables x {options.rows} rows "
+              f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    cursor.execute("ANALYZE TABLE " + ", ".join(
+        f"`{schema}`.`t_{index}`" for schema in schemas for index in range(1, options.tables + 1)
+    ))
+    cursor.fetchall()
+    cursor.execute(
+        "SELECT COALESCE(SUM(DATA_LENGTH + INDEX_LENGTH), 0) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA IN (" + ", ".join(["%s"] * len(schemas)) + ")",
+        schemas
+    )
+    schema_bytes = int(cursor.fetchone()[0])
+    cursor.close()
+    conn.close()
+    return schemas, schema_bytes
+
+
+def write_config(home, options, schemas, mode, codec, jobs):
+    """A cybexdump configuration for one run, in its own HOME"""
+    config_dir = os.path.join(home, ".cybexdump")
+    os.makedirs(config_dir, exist_ok=True)
+    config = {
+        "backup_location": os.path.join(home, "backups"),
+        "metrics": {"run_log": False},
+        "databases": [{
+            "id": 1,
+            "type": "mysql",
+            "host": options.host,
+            "port": options.port,
+            "username": options.user,
+            "password": options.password,
+            "databases": schemas,
+            "dump_mode": mode,
+            "threads": jobs,
+            "jobs": jobs,
+            "compression": {"codec": codec},
+            "schedule": {"frequency": "daily", "time": "00:00", "retention_days": 3650}
+        }]
+    }
+    with open(os.path.join(config_dir, "config.json"), 'w') as f:
+        json.dump(config, f)
+
+
+def measure(cmd, env=None):
+    """Run a command, returning (exit status, wall seconds, user CPU, system CPU, peak RSS in MB)
+
+    The CPU times include every process the command waited for; peak RSS is
+    that of the largest of them. Linux counts the pages a child shares with
+    this process before exec, so RSS has a floor of this script's own size.
+    """
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=PACKAGE_ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - started
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+    return proc.returncode, seconds, usage.ru_utime, usage.ru_stime, usage.ru_maxrss / 1024
+
+
+def disk_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def run_manager(home, task):
+    """Run one backup or restore through BackupManager in a fresh interpreter"""
+    task = dict(task, result_file=os.path.join(home, "result.json"))
+    env = dict(os.environ, HOME=home, PYTHONPATH=PACKAGE_ROOT)
+    measured = measure([sys.executable, "-c", RUNNER, json.dumps(task)], env)
+    output = None
+    if os.path.exists(task["result_file"]):
+        with open(task["result_file"]) as f:
+            output = json.load(f)
+        os.unlink(task["result_file"])
+    return measured, output
+
+
+def quote(cmd):
+    return " ".join(shlex.quote(arg) for arg in cmd)
+
+
+def run_shell(home, options, schemas, codec):
+    """Baseline: `mysqldump | compressor > file` per schema, one after the other"""
+    os.makedirs(os.path.join(home, "backups"), exist_ok=True)
+    dump = ["mysqldump", f"-h{options.host}", f"-P{options.port}", f"-u{options.user}",
+            f"-p{options.password}", "--single-transaction", "--quick", "--routines", "--triggers", "--events"]
+    script = " && ".join(
+        f"{quote(dump + [schema])} | {quote(compress_command(codec))} > "
+        f"{shlex.quote(os.path.join(home, 'backups', schema + '.sql' + codec_extension(codec)))}"
+        for schema in schemas
+    )
+    return measure(["bash", "-o", "pipefail", "-c", script])
+
+
+def record(options, schema_bytes, operation, mode, codec, jobs, measured, stored):
+    status, seconds, user, system, rss = measured
+    return {
+        "benchmark": "pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "operation": operation,
+        "mode": mode,
+        "codec": codec,
+        "jobs": jobs,
+        "schemas": options.schemas,
+        "tables": options.tables,
+        "rows": options.rows,
+        "status": "success" if status == 0 else "failed",
+        "seconds": round(seconds, 3),
+        "schema_bytes": schema_bytes,
+        "disk_bytes": stored,
+        "throughput_mb_s": round(schema_bytes / 1024 / 1024 / max(seconds, 0.001), 2),
+        "cpu_user_s": round(user, 3),
+        "cpu_system_s": round(system, 3),
+        "peak_rss_mb": round(rss, 1)
+    }
+
+
+def drop_restored(options, schemas):
+    conn = connect(options)
+    cursor = conn.cursor()
+    for schema in schemas:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{schema}_restore`")
+    cursor.close()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default=os.environ.get("MYSQL_PWD", ""),
+                        help="Password (default: $MYSQL_PWD)")
+    parser.add_argument("--schemas", type=int, default=1, help="Synthetic schemas (default: 1)")
+    parser.add_argument("--tables", type=int, default=8, help="Tables per schema (default: 8)")
+    parser.add_argument("--rows", type=int, default=200000, help="Rows per table (default: 200000)")
+    parser.add_argument("--modes", default="mysqldump,native,shell",
+                        help="Comma separated dump modes (default: mysqldump,native,shell)")
+    parser.add_argument("--codecs", default="gzip,zstd,lz4", help="Comma separated codecs (default: gzip,zstd,lz4)")
+    parser.add_argument("--jobs", default="1,4",
+                        help="Comma separated job counts: native threads and per-host schema jobs (default: 1,4)")
+    parser.add_argument("--no-restore", action="store_true", help="Only benchmark backups")
+    parser.add_argument("--output", help="Append results as JSON lines to this file")
+    options = parser.parse_args()
+
+    schemas, schema_bytes = generate(options)
+    print(f"{len(schemas)} schemas, {schema_bytes / 1024 / 1024:.1f} MB of data and indexes", file=sys.stderr)
+
+    results = []
+
+    def add(result):
+        results.append(result)
+        print(f"{result['operation']:<8} {result['mode']:<10} {result['codec']:<5} jobs={result['jobs']:<3} "
+              f"{result['seconds']:8.1f}s {result['throughput_mb_s']:8.1f} MB/s "
+              f"cpu {result['cpu_user_s'] + result['cpu_system_s']:7.1f}s "
+              f"rss {result['peak_rss_mb']:7.1f} MB "
+              f"disk {result['disk_bytes'] / 1024 / 1024:8.1f} MB  {result['status']}")
+
+    for mode in options.modes.split(","):
+        for codec in options.codecs.split(","):
+            # The shell baseline runs one dump at a time, so job counts don't apply
+            for jobs in [1] if mode == "shell" else [int(jobs) for jobs in options.jobs.split(",")]:
+                home = tempfile.mkdtemp(prefix="cybexdump-bench-")
+                try:
+                    write_config(home, options, schemas, mode, codec, jobs)
+                    if mode == "shell":
+                        measured, backups = run_shell(home, options, schemas, codec), None
+                    else:
+                        measured, backups = run_manager(home, {"operation": "backup", "jobs": jobs,
+                                                               "compression": {"codec": codec}})
+                    add(record(options, schema_bytes, "backup", mode, codec, jobs, measured,
+                               disk_bytes(os.path.join(home, "backups"))))
+
+                    if backups and not options.no_restore and all(item["status"] == "success" for item in backups):
+                        restores = [(item["file"], item["schema"] + "_restore") for item in backups]
+                        measured, restored = run_manager(home, {"operation": "restore", "jobs": jobs,
+                                                                "restores": restores})
+                        if not restored or not all(restored):
+                            measured = (1,) + measured[1:]
+                        add(record(options, schema_bytes, "restore", mode, codec, jobs, measured, 0))
+                        drop_restored(options, schemas)
+                finally:
+                    shutil.rmtree(home, ignore_errors=True)
+
+    if options.output:
+        with open(options.output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return 1 if any(result["status"] != "success" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+CLI startup benchmark
+
+Starts the CLI in a fresh interpreter for a few cheap commands, reports the
+median wall time against a budget and checks that none of them imports the
+heavy dependencies only real work needs. Exits non-zero when either fails.
+
+    python benchmarks/startup.py [--runs 15] [--budget-ms 100]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ["--help"],
+    ["--version"],
+    ["backup", "--help"],
+    ["restore", "--help"]
+]
+
+# Modules a command must not import before it actually needs them
+HEAVY_MODULES = ["mysql.connector", "rich", "crontab", "smtplib", "sqlite3"]
+
+LAUNCHER = "from cybexdump.cli import main; main()"
+IMPORT_CHECK = (
+    "import sys; sys.argv = ['cybexdump'] + sys.argv[1:]\n"
+    "from cybexdump.cli import cli\n"
+    "try:\n"
+    "    cli(standalone_mode=False)\n"
+    "finally:\n"
+    "    print(' '.join(sorted(sys.modules)), file=sys.stderr)\n"
+)
+
+
+def time_command(args, runs):
+    """Median wall time of starting the CLI with `args`, in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", LAUNCHER, *args], cwd=PACKAGE_ROOT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def heavy_imports(args):
+    """Heavy modules loaded while running the CLI with `args`"""
+    result = subprocess.run([sys.executable, "-c", IMPORT_CHECK, *args], cwd=PACKAGE_ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    modules = set(result.stderr.decode().split())
+    return [name for name in HEAVY_MODULES if name in modules]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15, help="Runs per command (default: 15)")
+    parser.add_argument("--budget-ms", type=float, default=100.0,
+                        help="Maximum median startup time per command (default: 100)")
+    options = parser.parse_args()
+
+    started = time.perf_counter()
+    for _ in range(options.runs):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+    interpreter = (time.perf_counter() - started) * 1000 / options.runs
+    print(f"{'bare interpreter':<20} {interpreter:7.1f} ms")
+
+    failed = False
+    for args in COMMANDS:
+        median = time_command(args, options.runs)
+        heavy = heavy_imports(args)
+        status = "ok"
+        if median > options.budget_ms:
+            status = f"over budget ({options.budget_ms:.0f} ms)"
+            failed = True
+        if heavy:
+            status = f"imports {', '.join(heavy)}"
+            failed = True
+        print(f"{' '.join(args):<20} {median:7.1f} ms  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,29 @@
 # Initialize package
-from .cli import cli
-from .config_manager import ConfigManager
-from .database_manager import DatabaseManager
-from .backup_manager import BackupManager
-from .scheduler import BackupScheduler
-from .notification_manager import NotificationManager
-from .migration_manager import MigrationManager
+#
+# Names are imported on first access, so `import cybexdump` (and every CLI
+# start) stays cheap; see cli.py.
+import importlib
 
-__all__ = [
-    'cli',
-    'ConfigManager',
-    'DatabaseManager',
-    'BackupManager',
-    'BackupScheduler',
-    'NotificationManager',
-    'MigrationManager'
-]
+_EXPORTS = {
+    'cli': '.cli',
+    'ConfigManager': '.config_manager',
+    'DatabaseManager': '.database_manager',
+    'BackupManager': '.backup_manager',
+    'BackupScheduler': '.scheduler',
+    'NotificationManager': '.notification_manager',
+    'MigrationManager': '.migration_manager'
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
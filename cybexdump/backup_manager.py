@@ -1,159 +1,1339 @@
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 import os
 import json
+import shutil
 from pathlib import Path
 import mysql.connector
 from rich.console import Console
-from rich.prompt import Confirm
+from rich.prompt import Confirm, Prompt
+from rich.table import Table
 from .config_manager import ConfigManager
+from .native_dump import CHECKPOINT_FILE, MANIFEST_FILE, NativeDumper, NativeDumpError, quote_identifier
+from .native_restore import NativeRestorer, NativeRestoreError
+from .binlog_manager import (
+    STATE_FILE, BinlogManager, BinlogError, parse_dump_position, source_data_option
+)
+from .repository import REPOSITORY_FORMAT, BackupRepository, RepositoryError
+from .catalog_manager import CatalogManager
+from .connection_manager import ConnectionManager
+from .engines import EngineError, get_engine
+from .notification_manager import NotificationManager
+from .metrics import RunMetrics
+from .throttle import Throttle
+from .verification import BackupVerifier
+from .storage import StorageError, backup_storage, open_output, storage_targets
+from .compression import (
+    CHUNK_SIZE, DEFAULT_CODEC, CompressedWriter, CompressionError, HashingWriter, codec_extension,
+    codec_for_file, copy_stream, decompress_command
+)
+from .dump_index import IndexedWriter, SectionFilter, read_sections
+from .encryption import (
+    CIPHER, EncryptionError, current_key_id, encrypting, encryption_enabled, encryption_settings, open_input
+)
+from .fleet import PLAN_THREADS, ProcessTimeout, VolumePlacer, fleet_settings, probe
+from .replica import ReplicaError, ReplicaSelector
+from .retention import RetentionPolicy
+from .table_filter import TableFilter
 
 console = Console()
 
+METADATA_SUFFIX = ".meta.json"
+BINLOG_DIR = "binlogs"
+# mysqldump writes the binlog coordinates within its first few kilobytes
+DUMP_HEADER_LIMIT = 4 * 1024 * 1024
+# Expired backups deleted at once; deletes are mostly waiting on storage targets
+RETENTION_JOBS = 8
+
 class BackupManager:
     def __init__(self):
         self.config_manager = ConfigManager()
+        self.catalog = CatalogManager()
+        # Placement of config directories on the fleet's volumes, by volume list
+        self._placers = {}
         
-    def perform_backup(self, database_id, output_file=None):
+    def perform_backup(self, database_id, output_file=None, jobs=None, global_jobs=None, compression=None):
         """Perform backup for a specific database configuration"""
+        return self.perform_backups([database_id], output_file, jobs, global_jobs, compression)
+        
+    def perform_backups(self, database_ids=None, output_file=None, jobs=None, global_jobs=None,
+                        compression=None, resume=False, notifications=None, tables=None, content=None,
+                        timeouts=None):
+        """Back up one or more database configurations through a bounded worker pool
+
+        Every schema becomes its own task. Tasks are started largest first, with
+        at most `jobs` running per host and at most `global_jobs` overall.
+        `compression` overrides the per-config codec, level and threads, and
+        `tables` ({"include": [...], "exclude": [...]}) and `content` the
+        table filters and content of MySQL configs. `timeouts`
+        ({"connect_timeout": ..., "dump_timeout": ...}) overrides the
+        timeouts of every config and of the "fleet" section.
+        With `resume`, native backups continue the last failed dump of a schema.
+        Results are reported through `notifications` when given, which the
+        caller then flushes, e.g. once per scheduler cycle.
+        """
         config = self.config_manager.load_config()
-        db_config = None
+        db_configs = config.get("databases", [])
         
-        # Find the database config with matching ID
-        for db in config.get("databases", []):
-            if db.get("id") == database_id:
-                db_config = db
-                break
+        if database_ids is not None:
+            db_configs = []
+            for database_id in dict.fromkeys(database_ids):
+                db_config = self.config_manager.get_database_config(database_id)
+                if db_config:
+                    db_configs.append(db_config)
+                else:
+                    console.print(f"[red]No database configuration found with ID {database_id}[/red]")
                 
-        if not db_config:
-            console.print(f"[red]No database configuration found with ID {database_id}[/red]")
-            return
+        if not db_configs:
+            return []
             
-        if not output_file:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            output_file = Path(f"cybexdump_backup_{timestamp}.sql")
-            
-        if db_config["type"] == "mysql":
-            return self._backup_mysql(db_config, output_file)
+        repository = BackupRepository(config.get("backup_location") or ".")
+        try:
+            targets = storage_targets(config)
+        except StorageError as e:
+            console.print(f"[red]{str(e)}[/red]")
+            return []
+        if any(encryption_enabled(encryption_settings(config, db_config)) for db_config in db_configs):
+            try:
+                # Unlock the keystore once, before any dump starts
+                current_key_id()
+            except EncryptionError as e:
+                console.print(f"[red]{str(e)}[/red]")
+                return []
+                
+        run = RunMetrics("backup")
+        # Replicas whose SQL thread is stopped for this run, as (selector, server config); the scheduler
+        # runs several of these calls at once on one BackupManager
+        paused = []
+        try:
+            with run.stage("plan"):
+                tasks, storages = self._plan_backups(config, db_configs, output_file, compression, repository,
+                                                     targets, resume, tables, content, timeouts, paused)
+                
+            global_jobs = global_jobs or config.get("max_jobs") or os.cpu_count() or 1
+            throttles = {id(task["throttle"]): task["throttle"] for task in tasks}.values()
+            for throttle in throttles:
+                throttle.start()
+            started = time.monotonic()
+            try:
+                with run.stage("backup"):
+                    results = self._run_backup_tasks(tasks, jobs, global_jobs)
+            finally:
+                for throttle in throttles:
+                    throttle.stop()
+        finally:
+            self._resume_replicas(paused)
+        self._print_summary(results)
+        self._print_fleet_summary(results, time.monotonic() - started)
+        with run.stage("catalog"):
+            for result in results:
+                if result["status"] == "success":
+                    self.catalog.record_backup(dict(result, schema_name=result["schema"], path=result["file"]))
+        own_notifications = notifications is None
+        with run.stage("notify"):
+            notifications = notifications or NotificationManager()
+            for result in results:
+                notifications.send_backup_notification(
+                    result["status"] == "success", f"{result['schema']} on {result['host']}", result["error"]
+                )
+                
+        with run.stage("retention"):
+            snapshots = 0
+            for db_config in db_configs:
+                if not output_file and db_config["id"] in storages:
+                    snapshots += self._cleanup_old_backups(db_config, storages[db_config["id"]])
+                    if db_config["type"] == "mysql":
+                        self._cleanup_old_binlogs(self._backup_dir(config, db_config), db_config["id"])
+                        
+            # Only removed snapshots leave chunks behind; scanning the store otherwise is wasted
+            if snapshots:
+                self._collect_garbage(repository)
+        if own_notifications:
+            # Delivery ran in the background during retention; wait for what is left
+            with run.stage("notify"):
+                notifications.flush()
             
-    def _backup_mysql(self, db_config, output_file):
-        """Perform MySQL backup"""
-        output_file = Path(output_file)
-        output_file.parent.mkdir(parents=True, exist_ok=True)
+        for result in results:
+            run.add_result(result)
+        run.finish(config=config)
+        return results
         
-        databases = db_config["databases"]
-        if databases == "all":
+    def _plan_backups(self, config, db_configs, output_file, compression, repository, targets, resume=False,
+                      tables=None, content=None, timeouts=None, paused=None):
+        """Backup tasks of every database config, and the storage of each config by id
+        
+        Configs are planned in parallel, and a server that doesn't accept a
+        connection within its connect timeout is given up on straight away,
+        so one unreachable host never holds up the others. Replicas paused
+        for consistent dumps are appended to `paused`.
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        storages = {}
+        
+        def plan(db_config):
+            settings = dict(db_config.get("compression", {}), **(compression or {}))
+            # Tasks see the timeouts and encryption settings through their config
+            db_config = dict(db_config, encryption=encryption_settings(config, db_config),
+                             **fleet_settings(config, db_config))
+            if encryption_enabled(db_config["encryption"]):
+                if db_config["type"] == "postgresql":
+                    console.print(f"[yellow]Configuration {db_config['id']}: pg_dump writes its files itself, "
+                                  f"PostgreSQL backups are not encrypted[/yellow]")
+                    db_config["encryption"] = {}
+                elif db_config.get("repository", {}).get("enabled"):
+                    console.print(f"[yellow]Configuration {db_config['id']}: repository backups are "
+                                  f"deduplicated, not encrypted[/yellow]")
+            db_config.update({key: value for key, value in (timeouts or {}).items() if value})
             try:
-                conn = mysql.connector.connect(
-                    host=db_config["host"],
-                    user=db_config["username"],
-                    password=db_config["password"],
-                    port=db_config["port"]
+                storage = storages[db_config["id"]] = backup_storage(
+                    config, db_config, targets, self._backup_dir(config, db_config, output_file)
                 )
-                cursor = conn.cursor()
-                cursor.execute("SHOW DATABASES")
-                databases = [db[0] for db in cursor.fetchall()
-                           if db[0] not in ['information_schema', 'performance_schema', 'mysql', 'sys']]
-                cursor.close()
-                conn.close()
-            except Exception as e:
-                console.print(f"[red]Error connecting to MySQL: {str(e)}[/red]")
-                return
+            except StorageError as e:
+                console.print(f"[red]Configuration {db_config['id']}: {str(e)}[/red]")
+                return []
+            throttle = Throttle(db_config)
+            if db_config["type"] == "mysql" and db_config.get("replicas"):
+                db_config, problem = self._backup_source(db_config, paused)
+                if problem:
+                    console.print(f"[red]Configuration {db_config['id']}: {problem}[/red]")
+                    return [dict(self._failed_task(db_config, settings, problem), storage=storage, throttle=throttle)]
+            unreachable = probe(db_config["host"], db_config["port"], db_config["connect_timeout"])
+            if unreachable:
+                console.print(f"[red]Configuration {db_config['id']}: {unreachable}[/red]")
+                return [dict(self._failed_task(db_config, settings, unreachable), storage=storage, throttle=throttle)]
                 
-        for db in databases:
-            backup_file = output_file
+            backup_dir = self._backup_dir(config, db_config, output_file, place=True)
+            if Path(backup_dir).resolve() != storage.root:
+                # The config was just placed on a volume
+                storage = storages[db_config["id"]] = backup_storage(config, db_config, targets, backup_dir)
+            if throttle.compression_threads:
+                settings["threads"] = throttle.compression_threads
+            if db_config["type"] == "mysql":
+                planned = self._plan_mysql_backup(
+                    db_config, backup_dir, output_file, timestamp, settings,
+                    repository if db_config.get("repository", {}).get("enabled") else None, resume,
+                    TableFilter.from_config(db_config, tables), content or db_config.get("content", "full")
+                )
+            else:
+                planned = self._plan_engine_backup(db_config, backup_dir, timestamp, settings)
+            for task in planned:
+                task.update(storage=storage, throttle=throttle)
+                if placer and not task.get("error"):
+                    placer.reserve(backup_dir, task["size"])
+            return planned
             
-            cmd = [
-                "mysqldump",
-                f"-h{db_config['host']}",
-                f"-P{db_config['port']}",
-                f"-u{db_config['username']}",
-                f"-p{db_config['password']}",
-                "--single-transaction",
-                "--quick",
-                "--routines",
-                "--triggers",
-                "--events",
-                db,
-                f"> {str(backup_file)}"
-            ]
+        placer = self._placer(config)
+        tasks = []
+        with ThreadPoolExecutor(max_workers=max(1, min(len(db_configs), PLAN_THREADS))) as executor:
+            for planned in executor.map(plan, db_configs):
+                tasks.extend(planned)
+        return tasks, storages
+        
+    def _backup_source(self, db_config, paused):
+        """Config of the server to back up a MySQL config from, and why there is none
+
+        A replica is used when one qualifies, else the primary unless the
+        "replicas" section sets "fallback" to false. A replica paused for a
+        consistent dump is appended to `paused`.
+        """
+        selector = ReplicaSelector(db_config)
+        server_config, lag, problems = selector.choose()
+        for name, problem in problems.items():
+            console.print(f"[yellow]Configuration {db_config['id']}: not using replica {name}: {problem}[/yellow]")
+        if server_config is None:
+            if not selector.settings.get("fallback", True):
+                return db_config, "no replica qualifies for the backup"
+            console.print(f"[yellow]Configuration {db_config['id']}: no replica qualifies, "
+                          f"backing up from the primary[/yellow]")
+            return db_config, None
             
+        name = f"{server_config['host']}:{server_config['port']}"
+        console.print(f"[green]Configuration {db_config['id']}: backing up from replica {name} "
+                      f"({lag}s behind)[/green]")
+        if selector.settings.get("consistent"):
             try:
-                subprocess.run(" ".join(cmd), shell=True, check=True)
-                console.print(f"[green]Successfully backed up {db} to {backup_file}[/green]")
+                # Dumps record where the replica stopped instead of asking mysqldump to stop it per schema
+                server_config["source_binlog"] = selector.pause(server_config)
+            except ReplicaError as e:
+                return server_config, f"could not stop replication on {name}: {str(e)}"
+            paused.append((selector, server_config))
+        return server_config, None
+        
+    def _resume_replicas(self, paused):
+        """Start replication again on the replicas paused for one run"""
+        while paused:
+            selector, server_config = paused.pop()
+            try:
+                selector.resume(server_config)
+            except ReplicaError as e:
+                console.print(f"[red]Could not restart replication on {server_config['host']}:"
+                              f"{server_config['port']}, run START REPLICA SQL_THREAD there: {str(e)}[/red]")
+                              
+    def _failed_task(self, db_config, compression, error):
+        """Task standing in for a config that could not be planned, so it is reported like a failed backup"""
+        return {
+            "db_config": db_config,
+            "host": (db_config["host"], db_config["port"]),
+            "schema": "-",
+            "size": 0,
+            "mode": None,
+            "compression": dict(compression, codec=compression.get("codec", DEFAULT_CODEC)),
+            "error": error
+        }
+        
+    def _placer(self, config):
+        volumes = config.get("fleet", {}).get("volumes")
+        if not volumes:
+            return None
+        key = tuple(volumes)
+        if key not in self._placers:
+            self._placers[key] = VolumePlacer(volumes)
+        return self._placers[key]
+        
+    def _backup_dir(self, config, db_config, output_file=None, place=False):
+        """Directory that holds the backups of one database configuration
+        
+        With fleet volumes, only a new backup (`place`) puts a config that is
+        on no volume yet on one; restores, retention and binlogs just look.
+        """
+        if output_file:
+            return Path(output_file).parent
+        placer = self._placer(config)
+        if placer:
+            return placer.directory(db_config, place)
+        return Path(config.get("backup_location") or ".") / str(db_config["id"])
+        
+    def _partial_backups(self, backup_dir, db):
+        """Native backup directories of a schema left behind by failed dumps, newest first"""
+        backup_dir = Path(backup_dir)
+        if not backup_dir.is_dir():
+            return []
+        prefix = f"cybexdump_backup_{db}_"
+        partial = [path for path in backup_dir.iterdir()
+                   if path.name.startswith(prefix) and len(path.name) == len(prefix) + 15
+                   and (path / CHECKPOINT_FILE).exists() and not (path / MANIFEST_FILE).exists()]
+        return sorted(partial, reverse=True)
+        
+    def _plan_mysql_backup(self, db_config, backup_dir, output_file, timestamp, compression, repository=None,
+                           resume=False, table_filter=None, content="full"):
+        """Build one backup task per schema, sized from information_schema
+
+        Schemas none of whose tables pass `table_filter` are left out.
+        """
+        connections = ConnectionManager(db_config)
+        try:
+            databases = db_config["databases"]
+            if databases == "all":
+                databases = connections.list_databases()
+            sizes = connections.schema_sizes()
+        except Exception as e:
+            console.print(f"[red]Error connecting to MySQL: {str(e)}[/red]")
+            return [self._failed_task(db_config, compression, f"Error connecting to MySQL: {str(e)}")]
+            
+        codec = compression.get("codec", DEFAULT_CODEC)
+        try:
+            extension = codec_extension(codec)
+        except CompressionError as e:
+            console.print(f"[red]{str(e)}[/red]")
+            return []
+            
+        mode = db_config.get("dump_mode", "mysqldump")
+        tasks = []
+        for db in databases:
+            size = sizes.get(db, 0)
+            selected = None
+            ignored = []
+            if table_filter:
+                metadata = connections.table_metadata(db)
+                chosen = [table for table in metadata if table_filter.matches(db, table["name"])]
+                if not chosen:
+                    console.print(f"[yellow]Skipping {db}: no table matches the table filters[/yellow]")
+                    continue
+                selected = [table["name"] for table in chosen]
+                ignored = sorted({table["name"] for table in metadata} - set(selected))
+                size = sum(table["data_bytes"] + table["index_bytes"] for table in chosen)
+                
+            if output_file:
+                output_file = Path(output_file)
+                if output_file.suffix == extension:
+                    output_file = output_file.with_suffix('')
+                if len(databases) == 1:
+                    backup_file = output_file
+                else:
+                    backup_file = output_file.with_name(f"{output_file.stem}_{db}{output_file.suffix or '.sql'}")
+            else:
+                backup_file = backup_dir / f"cybexdump_backup_{db}_{timestamp}.sql"
                 
-                # Compress the backup
-                compress_cmd = f"gzip {str(backup_file)}"
-                subprocess.run(compress_cmd, shell=True, check=True)
+            if repository and mode != "native":
+                # Repository backups are a manifest of deduplicated chunks
+                backup_file = repository.manifest_path(db_config["id"], f"cybexdump_backup_{db}_{timestamp}")
+            elif mode == "native":
+                # Native backups are a directory of per-table files plus a manifest
+                backup_file = backup_file.with_suffix('')
+            else:
+                backup_file = Path(f"{backup_file}{extension}")
                 
-            except subprocess.CalledProcessError as e:
+            resumed = False
+            if resume and mode == "native":
+                partial = [backup_file] if output_file else self._partial_backups(backup_dir, db)
+                if partial and (partial[0] / CHECKPOINT_FILE).exists():
+                    backup_file = partial[0]
+                    resumed = True
+                    
+            tasks.append({
+                "db_config": db_config,
+                "host": (db_config["host"], db_config["port"]),
+                "schema": db,
+                "size": size,
+                "mode": mode,
+                "repository": repository if mode != "native" else None,
+                "output_file": backup_file,
+                "compression": dict(compression, codec=codec),
+                "resume": resumed,
+                "tables": selected,
+                "ignore_tables": ignored,
+                "content": content
+            })
+        return tasks
+        
+    def _plan_engine_backup(self, db_config, backup_dir, timestamp, compression):
+        """Build one backup task per database of a PostgreSQL or MongoDB server"""
+        try:
+            engine = get_engine(db_config)
+            sizes = engine.schema_sizes()
+        except (EngineError, OSError) as e:
+            console.print(f"[red]Error connecting to {db_config['type']}: {str(e)}[/red]")
+            return [self._failed_task(db_config, compression, f"Error connecting to {db_config['type']}: {str(e)}")]
+            
+        databases = db_config["databases"]
+        if databases == "all":
+            databases = sorted(sizes)
+        compression = dict(compression, codec=compression.get("codec", DEFAULT_CODEC))
+        return [{
+            "db_config": db_config,
+            "host": (db_config["host"], db_config["port"]),
+            "schema": db,
+            "size": sizes.get(db, 0),
+            "mode": engine.backup_format,
+            "engine": engine,
+            "output_file": engine.backup_path(backup_dir, f"cybexdump_backup_{db}_{timestamp}",
+                                              compression["codec"]),
+            "compression": compression
+        } for db in databases]
+        
+    def _run_backup_tasks(self, tasks, jobs, global_jobs):
+        """Run backup tasks largest first under per-host and global limits
+
+        Tasks are only handed to the pool once their host has a free slot, so a
+        slow schema holds a single slot and never blocks work for other hosts.
+        """
+        pending = sorted(tasks, key=lambda task: task["size"], reverse=True)
+        running = {}
+        host_running = {}
+        results = []
+        
+        with ThreadPoolExecutor(max_workers=global_jobs) as executor:
+            while pending or running:
+                for task in list(pending):
+                    if len(running) >= global_jobs:
+                        break
+                    host_jobs = jobs or task["db_config"].get("jobs") or 1
+                    if host_running.get(task["host"], 0) >= host_jobs:
+                        continue
+                    pending.remove(task)
+                    host_running[task["host"]] = host_running.get(task["host"], 0) + 1
+                    running[executor.submit(self._backup_task, task)] = task
+                    
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    host_running[task["host"]] -= 1
+                    results.append(future.result())
+                    
+        return results
+        
+    def _new_result(self, task):
+        """Empty per-schema result, filled in as the backup runs"""
+        db_config = task["db_config"]
+        return {
+            "database_id": db_config.get("id"),
+            "host": f"{db_config['host']}:{db_config['port']}",
+            "schema": task["schema"],
+            "file": None,
+            "format": task["mode"] if task.get("engine") or task.get("mode") == "native" else
+                      "repository" if task.get("repository") else "file",
+            "codec": task["compression"]["codec"],
+            "content": task.get("content", "full"),
+            # Only a filter that left tables out makes a partial backup
+            "tables": task.get("tables") if task.get("ignore_tables") else None,
+            "binlog": None,
+            "created": datetime.now().isoformat(),
+            "finished": None,
+            "status": "failed",
+            "bytes": 0,
+            "raw_bytes": 0,
+            "checksum": None,
+            "seconds": 0.0,
+            "stages": {},
+            "error": None
+        }
+        
+    def _backup_task(self, task):
+        if task.get("error"):
+            result = self._new_result(task)
+            result.update(error=task["error"], finished=result["created"])
+            return result
+        if task.get("engine"):
+            return self._backup_engine_database(task)
+        return self._backup_mysql_schema(task)
+        
+    def _backup_engine_database(self, task):
+        """Back up one PostgreSQL or MongoDB database through its engine"""
+        db = task["schema"]
+        backup_file = Path(task["output_file"])
+        backup_file.parent.mkdir(parents=True, exist_ok=True)
+        result = self._new_result(task)
+        
+        started = time.monotonic()
+        try:
+            stored, raw, checksums = task["engine"].backup(db, backup_file, task["compression"],
+                                                           task.get("storage"), task.get("throttle"))
+            metadata = {
+                "schema": db,
+                "created": result["created"],
+                "codec": task["compression"]["codec"],
+                "format": task["mode"],
+                "checksums": checksums
+            }
+            if encryption_enabled(task["engine"].encryption):
+                metadata["encryption"] = {"cipher": CIPHER, "key_id": current_key_id()}
+            self._write_metadata(backup_file, metadata, task.get("storage"))
+            result.update(status="success", file=str(backup_file), bytes=stored, raw_bytes=raw or 0,
+                          checksum=checksums.get(backup_file.name))
+            console.print(f"[green]Successfully backed up {db} to {backup_file}{self._copies(task)}[/green]")
+        except (EngineError, CompressionError, StorageError, EncryptionError, OSError) as e:
+            result["error"] = str(e)
+            self._remove_backup(backup_file, task.get("storage"))
+            console.print(f"[red]Error backing up {db}: {str(e)}[/red]")
+        result["seconds"] = time.monotonic() - started
+        result["finished"] = datetime.now().isoformat()
+        return result
+        
+    def _backup_mysql_schema(self, task):
+        """Dump a single MySQL schema, compressing the dump as it streams"""
+        if task.get("mode") == "native":
+            return self._backup_mysql_native(task)
+            
+        db_config = task["db_config"]
+        db = task["schema"]
+        backup_file = Path(task["output_file"])
+        backup_file.parent.mkdir(parents=True, exist_ok=True)
+        result = self._new_result(task)
+        
+        cmd = [
+            "mysqldump",
+            f"-h{db_config['host']}",
+            f"-P{db_config['port']}",
+            f"-u{db_config['username']}",
+            f"-p{db_config['password']}",
+            "--single-transaction",
+            "--quick",
+            "--routines",
+            "--triggers",
+            "--events",
+            db
+        ]
+        if db_config.get("connect_timeout"):
+            cmd.insert(-1, f"--connect-timeout={db_config['connect_timeout']}")
+        if db_config.get("incremental", {}).get("enabled") and not db_config.get("source_binlog"):
+            # On a replica these are the coordinates of its source, whose binlogs are archived
+            cmd.insert(-1, source_data_option(bool(db_config.get("replica_of"))))
+        if task.get("repository"):
+            # One row per line keeps chunk boundaries stable when rows are inserted
+            cmd.insert(-1, "--skip-extended-insert")
+        content = task.get("content", "full")
+        if content == "schema":
+            cmd.insert(-1, "--no-data")
+        elif content == "data":
+            cmd = [arg for arg in cmd if arg not in ("--routines", "--triggers", "--events")]
+            cmd[-1:-1] = ["--no-create-info", "--skip-triggers"]
+        cmd[-1:-1] = [f"--ignore-table={db}.{table}" for table in task.get("ignore_tables", [])]
+            
+        compression = task["compression"]
+        throttle = task.get("throttle") or Throttle(db_config)
+        metadata = {"schema": db, "created": datetime.now().isoformat(), "codec": compression["codec"],
+                    "content": content}
+        if task.get("tables") is not None:
+            metadata["tables"] = task["tables"]
+        started = time.monotonic()
+        try:
+            dump = subprocess.Popen(throttle.command(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Reading mysqldump's output slowly makes it, and the server, slow down too
+            source = throttle.reader(dump.stdout)
+            # A dump running past its timeout is killed and fails
+            with ProcessTimeout(dump, db_config.get("dump_timeout")) as timeout:
+                try:
+                    if task.get("repository"):
+                        with task["repository"].writer(
+                            db_config["id"],
+                            backup_file.stem,
+                            compression.get("level"),
+                            compression.get("threads")
+                        ) as writer:
+                            binlog = (self._copy_dump(source, writer, result["stages"])
+                                      or db_config.get("source_binlog"))
+                            writer.metadata.update(metadata, codec="zlib", binlog=binlog)
+                            result["codec"] = "zlib"
+                    else:
+                        with open_output(backup_file, task.get("storage")) as f:
+                            digest = HashingWriter(throttle.writer(f))
+                            # With "table_index", compressed table by table so single tables restore
+                            # without reading the rest; else as one compressor stream
+                            indexed = db_config.get("table_index", False)
+                            writer_class = IndexedWriter if indexed else CompressedWriter
+                            with encrypting(digest, db_config.get("encryption")) as sealed, writer_class(
+                                sealed,
+                                compression["codec"],
+                                compression.get("level"),
+                                compression.get("threads"),
+                                throttle.prefix
+                            ) as writer:
+                                binlog = (self._copy_dump(source, writer, result["stages"])
+                                          or db_config.get("source_binlog"))
+                        result["checksum"] = digest.hexdigest()
+                        if indexed:
+                            metadata["index"] = writer.sections
+                        if sealed is not digest:
+                            metadata["encryption"] = {"cipher": CIPHER, "key_id": sealed.key_id}
+                finally:
+                    dump.stdout.close()
+                    stderr = dump.stderr.read()
+                    dump.wait()
+            if timeout.expired:
+                raise subprocess.CalledProcessError(dump.returncode, "mysqldump",
+                                                    stderr=f"timed out after {timeout.seconds}s".encode())
+            if dump.returncode != 0:
+                raise subprocess.CalledProcessError(dump.returncode, "mysqldump", stderr=stderr)
+                
+            if task.get("repository"):
+                console.print(f"[green]Successfully backed up {db} to {backup_file}[/green]")
+            else:
+                self._write_metadata(backup_file, dict(metadata, binlog=binlog,
+                                                       checksums={backup_file.name: result["checksum"]}),
+                                     task.get("storage"))
+                console.print(f"[green]Successfully backed up {db} to {backup_file}{self._copies(task)}[/green]")
+            result.update(status="success", file=str(backup_file), binlog=binlog,
+                          bytes=writer.compressed_bytes, raw_bytes=writer.raw_bytes)
+        except (subprocess.CalledProcessError, CompressionError, RepositoryError, StorageError, EncryptionError,
+                OSError) as e:
+            if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+                result["error"] = e.stderr.decode(errors="replace").strip()
+            else:
+                result["error"] = str(e)
+            if task.get("repository"):
+                if backup_file.exists():
+                    backup_file.unlink()
+            else:
+                self._remove_backup(backup_file, task.get("storage"))
+            console.print(f"[red]Error backing up {db}: {result['error']}[/red]")
+        result["seconds"] = time.monotonic() - started
+        result["finished"] = datetime.now().isoformat()
+        return result
+        
+    def _copy_dump(self, source, writer, stages):
+        """Copy a mysqldump stream into the writer, returning the binlog coordinates in its header
+
+        `stages` gets the seconds spent waiting for mysqldump ("read") and for
+        the compressor and uploads to take the data ("write"), which shows
+        which side limits the backup.
+        """
+        header = b""
+        binlog = None
+        read = written = 0.0
+        while True:
+            started = time.monotonic()
+            data = source.read(CHUNK_SIZE)
+            read += time.monotonic() - started
+            if not data:
+                break
+            started = time.monotonic()
+            writer.write(data)
+            written += time.monotonic() - started
+            if binlog is None and len(header) < DUMP_HEADER_LIMIT:
+                header += data
+                binlog = parse_dump_position(header)
+        stages.update(read=round(read, 3), write=round(written, 3))
+        return binlog
+        
+    def _write_metadata(self, backup_file, metadata, storage=None):
+        """Store backup metadata next to a single-file backup"""
+        metadata_file = Path(f"{backup_file}{METADATA_SUFFIX}")
+        with open(metadata_file, 'w') as f:
+            json.dump(metadata, f, indent=4)
+        if storage:
+            storage.upload(metadata_file)
+            
+    def _copies(self, task):
+        """Names of the storage targets a task's backup was copied to, for messages"""
+        storage = task.get("storage")
+        if not storage or not storage.targets:
+            return ""
+        return " and " + ", ".join(target.name for target in storage.targets)
+        
+
+    def read_metadata(self, backup_path):
+        """Metadata of a backup: the manifest of a native or repository backup, else its sidecar file"""
+        backup_path = Path(backup_path)
+        if backup_path.is_dir() and (backup_path / MANIFEST_FILE).exists():
+            metadata_file = backup_path / MANIFEST_FILE
+        elif backup_path.suffix == ".json":
+            metadata_file = backup_path
+        else:
+            metadata_file = Path(f"{backup_path}{METADATA_SUFFIX}")
+        if not metadata_file.exists():
+            return {}
+        with open(metadata_file) as f:
+            return json.load(f)
+            
+    def _latest_binlog_position(self, database_id):
+        """Binlog coordinates recorded by the newest full backup"""
+        for entry in self.catalog.list_backups(database_id, complete=True):
+            if entry["binlog_file"]:
+                return {"file": entry["binlog_file"], "position": entry["binlog_position"],
+                        "gtid_set": entry["gtid_set"]}
+        return None
+        
+    def archive_binlogs(self, database_ids=None):
+        """Incremental backup: archive binlogs written since the last run
+
+        Returns the number of configurations archived successfully.
+        """
+        config = self.config_manager.load_config()
+        run = RunMetrics("binlogs")
+        archived = 0
+        failed = False
+        for db_config in config.get("databases", []):
+            if database_ids is not None and db_config.get("id") not in database_ids:
+                continue
+            if db_config["type"] != "mysql" or not db_config.get("incremental", {}).get("enabled"):
+                continue
+                
+            backup_dir = self._backup_dir(config, db_config)
+            if self._placer(config) and not backup_dir.is_dir():
+                # Binlogs go next to the full backups, and no backup has chosen a volume yet
+                console.print(f"[yellow]Configuration {db_config['id']} has no full backup on any volume yet, "
+                              f"not archiving its binlogs[/yellow]")
+                continue
+            binlog = self._latest_binlog_position(db_config["id"])
+            try:
+                with run.stage("archive"):
+                    files = BinlogManager(db_config, backup_dir / BINLOG_DIR).archive(
+                        binlog["file"] if binlog else None
+                    )
+                archived += 1
+                console.print(f"[green]Archived binlogs {files[0]}..{files[-1]} for "
+                              f"{db_config['host']}:{db_config['port']}[/green]")
+            except (BinlogError, mysql.connector.Error, OSError) as e:
+                failed = True
+                console.print(f"[red]Error archiving binlogs for {db_config['host']}: {str(e)}[/red]")
+        run.finish("failed" if failed else "success", config)
+        return archived
+        
+    def _backup_mysql_native(self, task):
+        """Dump a single MySQL schema with the table-level parallel engine"""
+        db_config = task["db_config"]
+        db = task["schema"]
+        backup_dir = Path(task["output_file"])
+        result = self._new_result(task)
+        
+        started = time.monotonic()
+        try:
+            dumper = NativeDumper(db_config, db, backup_dir, compression=task["compression"],
+                                  storage=task.get("storage"), throttle=task.get("throttle"),
+                                  tables=task.get("tables"), content=task.get("content"))
+            manifest = dumper.run(task.get("resume", False))
+            result.update(status="success", file=str(backup_dir), binlog=manifest["binlog"],
+                          bytes=dumper.compressed_bytes, raw_bytes=dumper.raw_bytes)
+            console.print(f"[green]Successfully backed up {db} ({len(manifest['tables'])} tables) "
+                          f"to {backup_dir}{self._copies(task)}[/green]")
+            # Older failed dumps of the schema can no longer be resumed from
+            for partial in self._partial_backups(backup_dir.parent, db):
+                self._remove_backup(partial, task.get("storage"))
+        except (mysql.connector.Error, NativeDumpError, CompressionError, StorageError, EncryptionError,
+                subprocess.CalledProcessError, OSError) as e:
+            result["error"] = str(e)
+            if (backup_dir / CHECKPOINT_FILE).exists():
+                console.print(f"[red]Error backing up {db}: {str(e)}[/red]")
+                console.print(f"[yellow]Kept the finished chunks in {backup_dir}; "
+                              f"run the backup again with --resume to continue[/yellow]")
+            else:
+                self._remove_backup(backup_dir, task.get("storage"))
                 console.print(f"[red]Error backing up {db}: {str(e)}[/red]")
+        result["seconds"] = time.monotonic() - started
+        result["finished"] = datetime.now().isoformat()
+        return result
+        
+    def _print_summary(self, results):
+        """Print a single per-database summary for a backup run"""
+        if not results:
+            return
+            
+        table = Table(title="Backup summary")
+        table.add_column("ID")
+        table.add_column("Host")
+        table.add_column("Database")
+        table.add_column("Status")
+        table.add_column("Size", justify="right")
+        table.add_column("Ratio", justify="right")
+        table.add_column("Time", justify="right")
+        
+        for result in sorted(results, key=lambda r: (str(r["database_id"]), r["schema"])):
+            status = "[green]ok[/green]" if result["status"] == "success" else f"[red]{result['error']}[/red]"
+            table.add_row(
+                str(result["database_id"]),
+                result["host"],
+                result["schema"],
+                status,
+                f"{result['bytes'] / 1024 / 1024:.1f} MB",
+                f"{result['raw_bytes'] / result['bytes']:.1f}x" if result["bytes"] and result["raw_bytes"] else "-",
+                f"{result['seconds']:.1f}s"
+            )
+        console.print(table)
+        
+    def _print_fleet_summary(self, results, elapsed):
+        """Print one line per server when a run backed up more than one, with the first problem of each"""
+        hosts = {}
+        for result in results:
+            hosts.setdefault(result["host"], []).append(result)
+        if len(hosts) < 2:
+            return
+            
+        table = Table(title="Fleet summary")
+        table.add_column("Host")
+        table.add_column("Schemas", justify="right")
+        table.add_column("OK", justify="right")
+        table.add_column("Failed", justify="right")
+        table.add_column("Size", justify="right")
+        table.add_column("Time", justify="right")
+        table.add_column("Problem")
+        
+        healthy = 0
+        for host, host_results in sorted(hosts.items()):
+            failed = [result for result in host_results if result["status"] != "success"]
+            healthy += not failed
+            table.add_row(
+                host,
+                str(len(host_results)),
+                str(len(host_results) - len(failed)),
+                f"[red]{len(failed)}[/red]" if failed else "0",
+                f"{sum(result['bytes'] for result in host_results) / 1024 / 1024:.1f} MB",
+                f"{sum(result['seconds'] for result in host_results):.1f}s",
+                f"[red]{failed[0]['error']}[/red]" if failed else ""
+            )
+        console.print(table)
+        colour = "green" if healthy == len(hosts) else "yellow"
+        console.print(f"[{colour}]{healthy} of {len(hosts)} hosts backed up completely "
+                      f"in {elapsed:.1f}s[/{colour}]")
+        
+    def apply_retention(self, database_ids=None, dry_run=False, jobs=None):
+        """Apply the retention policy of each database config outside a backup run
+        
+        With `dry_run`, every cataloged backup is listed with the rules that
+        keep it or as to be removed, and nothing is deleted.
+        """
+        config = self.config_manager.load_config()
+        try:
+            targets = storage_targets(config)
+        except StorageError as e:
+            console.print(f"[red]{str(e)}[/red]")
+            return
+            
+        for db_config in config.get("databases", []):
+            if database_ids and db_config["id"] not in database_ids:
+                continue
+            try:
+                storage = backup_storage(config, db_config, targets, self._backup_dir(config, db_config))
+            except StorageError as e:
+                console.print(f"[red]Configuration {db_config['id']}: {str(e)}[/red]")
+                continue
+            self._cleanup_old_backups(db_config, storage, dry_run, jobs)
+            if not dry_run and db_config["type"] == "mysql":
+                self._cleanup_old_binlogs(self._backup_dir(config, db_config), db_config["id"])
                 
-        self._cleanup_old_backups(backup_dir, db_config["schedule"]["retention_days"])
+        if not dry_run:
+            # Also frees chunks of snapshots that were still in their grace period at the last run
+            self._collect_garbage(BackupRepository(config.get("backup_location") or "."))
+            
+    def _collect_garbage(self, repository):
+        """Delete the repository chunks no backup references any more"""
+        try:
+            chunks, freed = repository.gc()
+        except (RepositoryError, OSError) as e:
+            console.print(f"[red]Could not remove unreferenced repository chunks: {str(e)}[/red]")
+            return
+        if chunks:
+            console.print(f"[yellow]Removed {chunks} unreferenced chunks ({freed / 1024 / 1024:.1f} MB)[/yellow]")
+            
+    def _cleanup_old_backups(self, db_config, storage=None, dry_run=False, jobs=None):
+        """Remove the backups of a config its retention policy no longer keeps, as recorded in the catalog
         
-    def _cleanup_old_backups(self, backup_dir, retention_days):
-        """Remove backups older than retention period"""
-        current_time = datetime.now()
-        for backup_file in backup_dir.glob("*.sql.gz"):
-            file_time = datetime.fromtimestamp(backup_file.stat().st_mtime)
-            if (current_time - file_time).days > retention_days:
-                backup_file.unlink()
-                console.print(f"[yellow]Removed old backup: {backup_file}[/yellow]")
+        The policy is evaluated in one pass over the config's catalog entries,
+        and expired backups are deleted `jobs` at a time. Returns how many of
+        the removed backups were repository snapshots.
+        """
+        policy = RetentionPolicy.from_config(db_config)
+        kept, expired = policy.apply(self.catalog.list_backups(db_config["id"]))
+        if dry_run:
+            self._print_retention(db_config, policy, kept, expired)
+            return 0
+        if not expired:
+            return 0
+            
+        removed = []
+        with ThreadPoolExecutor(max_workers=jobs or RETENTION_JOBS) as executor:
+            futures = {executor.submit(self._remove_backup, entry["path"], storage): entry for entry in expired}
+            for future in futures:
+                entry = futures[future]
+                try:
+                    future.result()
+                except OSError as e:
+                    console.print(f"[red]Could not remove old backup {entry['path']}: {str(e)}[/red]")
+                    continue
+                removed.append(entry)
+                console.print(f"[yellow]Removed old backup: {entry['path']}[/yellow]")
+        self.catalog.delete([entry["id"] for entry in removed])
+        return sum(1 for entry in removed if entry["format"] == "repository")
+        
+    def _print_retention(self, db_config, policy, kept, expired):
+        """Print what the retention policy of a config keeps and removes"""
+        table = Table(title=f"Retention of configuration {db_config['id']} (keep {policy.describe()})")
+        table.add_column("Schema")
+        table.add_column("Created")
+        table.add_column("Size", justify="right")
+        table.add_column("Action")
+        
+        for entry in sorted(kept + expired, key=lambda entry: (entry["schema_name"], entry["created"]), reverse=True):
+            if "kept_by" in entry:
+                action = f"[green]keep[/green] ({', '.join(entry['kept_by'])})"
+            else:
+                action = "[red]remove[/red]"
+            table.add_row(
+                entry["schema_name"],
+                entry["created"][:19].replace("T", " "),
+                f"{entry['bytes'] / 1024 / 1024:.1f} MB" if entry["bytes"] is not None else "-",
+                action
+            )
+        console.print(table)
+        size = sum(entry["bytes"] or 0 for entry in expired)
+        console.print(f"{len(expired)} of {len(kept) + len(expired)} backups would be removed, "
+                      f"freeing {size / 1024 / 1024:.1f} MB")
+        
+    def _remove_backup(self, path, storage=None):
+        """Delete a backup of any format from disk and from the storage targets"""
+        path = Path(path)
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+        metadata_file = Path(f"{path}{METADATA_SUFFIX}")
+        if metadata_file.exists():
+            metadata_file.unlink()
+        if storage:
+            try:
+                storage.delete(path)
+                storage.delete(metadata_file)
+            except StorageError as e:
+                console.print(f"[yellow]Could not remove copies of {path}: {str(e)}[/yellow]")
                 
-    def restore_from_backup(self, backup_file):
-        """Restore database from backup file"""
-        backup_file = Path(backup_file)
+
+    def _cleanup_old_binlogs(self, backup_dir, database_id):
+        """Remove archived binlogs older than the oldest remaining full backup needs"""
+        binlog_dir = backup_dir / BINLOG_DIR
+        if not binlog_dir.exists():
+            return
+        needed = [entry["binlog_file"] for entry in self.catalog.list_backups(database_id, complete=True)
+                  if entry["binlog_file"]]
+        if not needed:
+            return
+        oldest = min(needed)
+        for binlog_file in binlog_dir.iterdir():
+            if binlog_file.name != STATE_FILE and binlog_file.name < oldest:
+                binlog_file.unlink()
+                
+    def rebuild_catalog(self):
+        """Index backups already on disk, e.g. those taken before the catalog existed"""
+        config = self.config_manager.load_config()
+        repository = BackupRepository(config.get("backup_location") or ".")
+        indexed = 0
+        for db_config in config.get("databases", []):
+            backup_dir = self._backup_dir(config, db_config)
+            paths = [path for path in backup_dir.glob("cybexdump_backup_*")
+                     if not path.name.endswith(METADATA_SUFFIX)]
+            for path in paths + repository.manifests(db_config["id"]):
+                metadata = self.read_metadata(path)
+                if not metadata or self.catalog.find(path):
+                    continue
+                if path.is_dir():
+                    backup_format = "native" if (path / MANIFEST_FILE).exists() else metadata.get("format")
+                    size = sum(f.stat().st_size for f in path.iterdir())
+                elif metadata.get("format") == REPOSITORY_FORMAT:
+                    backup_format, size = "repository", None
+                else:
+                    backup_format, size = metadata.get("format", "file"), path.stat().st_size
+                # A mysqldump backup lists its tables only when filtered, a native one always
+                tables = metadata.get("tables")
+                if path.is_dir() and not metadata.get("ignored"):
+                    tables = None
+                self.catalog.record_backup({
+                    "database_id": db_config["id"],
+                    "host": f"{db_config['host']}:{db_config['port']}",
+                    "schema_name": metadata["schema"],
+                    "format": backup_format,
+                    "path": str(path),
+                    "created": metadata["created"],
+                    "raw_bytes": metadata.get("size"),
+                    "bytes": size,
+                    "codec": metadata.get("codec"),
+                    "checksum": metadata.get("checksums", {}).get(path.name),
+                    "binlog": metadata.get("binlog"),
+                    "content": metadata.get("content"),
+                    "tables": list(tables) if tables is not None else None
+                })
+                indexed += 1
+        return indexed
         
-        if not backup_file.exists():
-            console.print(f"[red]Backup file not found: {backup_file}[/red]")
+    def verify_backups(self, paths=None, schema=None, database_id=None, latest=False, jobs=None,
+                       quick=False, sample=None):
+        """Check backups for corruption and, with `sample`, test-restore some of their tables
+
+        Without `paths`, every cataloged backup is checked, or only the newest
+        of each schema with `latest`. Sampled restores go to the scratch MySQL
+        server set under "verify" in the configuration. Returns True if every
+        backup passed.
+        """
+        config = self.config_manager.load_config()
+        verify_config = config.get("verify", {})
+        sample = verify_config.get("sample", 0) if sample is None else sample
+        if sample and not verify_config.get("scratch"):
+            console.print("[red]Sampled restores need a scratch MySQL server under \"verify\" "
+                          "in the configuration[/red]")
             return False
             
-        # Check if it's a gzipped file
-        is_gzipped = backup_file.suffix == '.gz'
+        if paths:
+            backups = [Path(path) for path in paths]
+        else:
+            entries = self.catalog.list_backups(database_id, schema)
+            if latest:
+                newest = {}
+                for entry in entries:
+                    newest.setdefault((entry["database_id"], entry["schema_name"]), entry)
+                entries = list(newest.values())
+            backups = [Path(entry["path"]) for entry in entries]
+        if not backups:
+            console.print("[yellow]No backups to verify[/yellow]")
+            return True
+            
+        run = RunMetrics("verify")
+        verifier = BackupVerifier(jobs or verify_config.get("jobs") or os.cpu_count(), quick, sample,
+                                  verify_config.get("scratch"))
+        with run.stage("verify"):
+            results = verifier.verify([(path, self.read_metadata(path) if path.exists() else {})
+                                       for path in backups])
+            
+        table = Table(title="Backup verification")
+        table.add_column("Backup")
+        table.add_column("Files", justify="right")
+        table.add_column("Sampled")
+        table.add_column("Status")
+        table.add_column("Time", justify="right")
+        for result in results:
+            status = "[green]ok[/green]" if result["status"] == "success" else "[red]" + "; ".join(result["errors"]) + "[/red]"
+            if result["warnings"]:
+                status += " [yellow]" + "; ".join(result["warnings"]) + "[/yellow]"
+            table.add_row(
+                result["path"],
+                str(result["files"]),
+                ", ".join(result["sampled"]) or "-",
+                status,
+                f"{result['seconds']:.1f}s"
+            )
+        console.print(table)
         
+        for result in results:
+            run.add_result(result)
+        run.finish(config=config)
+        return all(result["status"] == "success" for result in results)
+        
+    def restore_from_backup(self, backup_file=None, database=None, jobs=None, until=None,
+                            latest=None, database_id=None, resume=False, tables=None):
+        """Restore database from backup file
+
+        `backup_file` is either a single dump file or a native backup directory,
+        which is loaded over `jobs` connections in parallel. `database` names the
+        schema to restore into. With `until`, archived binlogs are replayed on
+        top of the backup up to that point in time. With `latest`, the newest
+        cataloged backup of that schema is restored to the configuration that
+        took it. With `resume`, a failed restore of a native backup continues
+        where it stopped. `tables` restores only the tables matching those
+        patterns, e.g. ["shop.orders"]; mysqldump backups with a table index
+        are then read only where those tables are.
+        """
+        run = RunMetrics("restore")
+        started = time.monotonic()
+        restored = self._restore(run, backup_file, database, jobs, until, latest, database_id, resume, tables)
+        run.add_result({
+            "database_id": run.labels.get("database_id"),
+            "schema": run.labels.get("schema"),
+            "status": "success" if restored else "failed",
+            "seconds": round(time.monotonic() - started, 3)
+        })
+        run.finish()
+        return restored
+        
+    def _restore(self, run, backup_file, database, jobs, until, latest, database_id, resume=False, tables=None):
+        """restore_from_backup(), timing its stages in `run`"""
         config = self.config_manager.load_config()
         if not config.get("databases"):
             console.print("[red]No database configurations found[/red]")
             return False
+        if tables and until:
+            console.print("[red]Binlogs can only be replayed onto a whole schema, not with --table[/red]")
+            return False
+        table_filter = TableFilter(tables)
             
-        # Ask user which database to restore to
-        console.print("\nAvailable database configurations:")
-        for i, db in enumerate(config["databases"], 1):
-            console.print(f"{i}. {db['type']} - {db['host']}:{db['port']}")
+        if latest:
+            entry = self.catalog.latest(latest, database_id)
+            if not entry:
+                console.print(f"[red]No full backup of {latest} found in the catalog[/red]")
+                return False
+            backup_file = entry["path"]
+            database_id = entry["database_id"]
+            console.print(f"Restoring {backup_file} (taken {entry['created']})")
             
-        try:
-            choice = int(Prompt.ask("Select database configuration number")) - 1
-            db_config = config["databases"][choice]
-        except (ValueError, IndexError):
-            console.print("[red]Invalid selection[/red]")
+        backup_file = Path(backup_file)
+        
+        if not backup_file.exists():
+            with run.stage("download"):
+                fetched = self._fetch_backup(config, backup_file, database_id)
+            if not fetched:
+                console.print(f"[red]Backup file not found: {backup_file}[/red]")
+                return False
+            
+        codec = codec_for_file(backup_file)
+        
+        if database_id is None:
+            entry = self.catalog.find(backup_file)
+            database_id = entry["database_id"] if entry else None
+            
+        db_config = self.config_manager.get_database_config(database_id)
+        if not db_config:
+            # Ask user which database to restore to
+            console.print("\nAvailable database configurations:")
+            for i, db in enumerate(config["databases"], 1):
+                console.print(f"{i}. {db['type']} - {db['host']}:{db['port']}")
+                
+            try:
+                choice = int(Prompt.ask("Select database configuration number")) - 1
+                db_config = config["databases"][choice]
+            except (ValueError, IndexError):
+                console.print("[red]Invalid selection[/red]")
+                return False
+            
+        metadata = self.read_metadata(backup_file)
+        if until and not metadata.get("binlog"):
+            console.print("[red]Backup has no recorded binlog position, cannot restore to a point in time[/red]")
             return False
             
-        if db_config["type"] == "mysql":
+        # Single-schema dumps carry no USE statement, default to the schema they came from
+        database = database or metadata.get("schema")
+        run.labels.update(database_id=db_config.get("id"), schema=database)
+        
+        if db_config["type"] != "mysql":
+            if until:
+                console.print(f"[red]Point-in-time restore is not supported for {db_config['type']}[/red]")
+                return False
+            if not database:
+                console.print("[red]Name the database to restore into with --database[/red]")
+                return False
             try:
-                # If file is gzipped, decompress it first
-                if is_gzipped:
-                    temp_file = backup_file.with_suffix('')
-                    subprocess.run(f"gzip -dk {backup_file}", shell=True, check=True)
-                    backup_file = temp_file
-                
-                cmd = [
-                    "mysql",
-                    f"-h{db_config['host']}",
-                    f"-P{db_config['port']}",
-                    f"-u{db_config['username']}",
-                    f"-p{db_config['password']}",
-                    f"< {str(backup_file)}"
-                ]
-                
-                subprocess.run(" ".join(cmd), shell=True, check=True)
-                console.print("[green]Database restored successfully![/green]")
+                with run.stage("load"):
+                    get_engine(db_config).restore(backup_file, database, jobs, metadata.get("schema"), table_filter)
+            except (EngineError, CompressionError, OSError) as e:
+                console.print(f"[red]Error restoring database: {str(e)}[/red]")
+                return False
+            console.print("[green]Database restored successfully![/green]")
+            return True
+            
+        if db_config["type"] == "mysql" and backup_file.is_dir():
+            selected = None
+            if table_filter:
+                selected = [name for name in metadata.get("tables", {})
+                            if table_filter.matches(metadata.get("schema"), name)]
+                if not selected:
+                    console.print("[red]No table in the backup matches the table filters[/red]")
+                    return False
+            try:
+                with run.stage("load"):
+                    NativeRestorer(db_config, backup_file, jobs, database, resume, selected).run()
+            except (mysql.connector.Error, NativeRestoreError, CompressionError, EncryptionError,
+                    subprocess.CalledProcessError, OSError) as e:
+                console.print(f"[red]Error restoring database: {str(e)}[/red]")
+                console.print("[yellow]Run the restore again with --resume to continue where it stopped[/yellow]")
+                return False
+            return self._replay_binlogs(config, db_config, metadata, until, database, run)
+            
+        if db_config["type"] == "mysql":
+            cmd = [
+                "mysql",
+                f"-h{db_config['host']}",
+                f"-P{db_config['port']}",
+                f"-u{db_config['username']}",
+                f"-p{db_config['password']}"
+            ]
+            if database:
+                cmd.append(database)
                 
-                # Clean up temporary file if we decompressed
-                if is_gzipped:
-                    backup_file.unlink()
+            try:
+                if database:
+                    with ConnectionManager(db_config).connection() as conn:
+                        cursor = conn.cursor()
+                        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {quote_identifier(database)}")
+                        cursor.close()
                     
-                return True
+                # Stream compressed backups straight into the client, no temp file
+                if table_filter:
+                    with run.stage("load"):
+                        restored = self._restore_tables(config, backup_file, metadata, table_filter, cmd)
+                    if not restored:
+                        console.print("[red]No table in the backup matches the table filters[/red]")
+                        return False
+                    console.print(f"Restored {len(restored)} tables: {', '.join(restored)}")
+                elif metadata.get("format") == REPOSITORY_FORMAT:
+                    with run.stage("load"):
+                        self._restore_from_repository(config, metadata, cmd)
+                else:
+                    with run.stage("load"), open_input(backup_file) as f:
+                        if codec:
+                            decompress = subprocess.Popen(decompress_command(codec), stdin=f,
+                                                          stdout=subprocess.PIPE)
+                            try:
+                                subprocess.run(cmd, stdin=decompress.stdout, check=True)
+                            finally:
+                                decompress.stdout.close()
+                                decompress.wait()
+                            if decompress.returncode != 0:
+                                raise subprocess.CalledProcessError(decompress.returncode, decompress.args)
+                        else:
+                            subprocess.run(cmd, stdin=f, check=True)
+                        
+                console.print("[green]Database restored successfully![/green]")
                 
-            except subprocess.CalledProcessError as e:
+            except (subprocess.CalledProcessError, CompressionError, RepositoryError, EncryptionError,
+                    mysql.connector.Error, OSError) as e:
                 console.print(f"[red]Error restoring database: {str(e)}[/red]")
                 return False
+            return self._replay_binlogs(config, db_config, metadata, until, database, run)
+            
+    def _fetch_backup(self, config, backup_file, database_id=None):
+        """Download a cataloged backup missing on local disk from a storage target"""
+        if database_id is None:
+            entry = self.catalog.find(backup_file)
+            database_id = entry["database_id"] if entry else None
+        db_config = self.config_manager.get_database_config(database_id)
+        if not db_config:
+            return False
+        try:
+            storage = backup_storage(config, db_config, backup_dir=self._backup_dir(config, db_config))
+            source = storage.fetch(backup_file)
+            if source:
+                storage.fetch(Path(f"{backup_file}{METADATA_SUFFIX}"))
+        except StorageError as e:
+            console.print(f"[red]Error downloading {backup_file}: {str(e)}[/red]")
+            return False
+        if source:
+            console.print(f"Downloaded {backup_file} from {source}")
+        return bool(source)
+        
+    def _restore_tables(self, config, backup_file, metadata, table_filter, cmd):
+        """Load the tables `table_filter` selects from a mysqldump backup, returning their names
+
+        The dump's header and footer are loaded with them, as they set up and
+        restore the session. With a table index only the parts of the file
+        holding those tables are decompressed; older backups and repository
+        backups are read to the end and filtered on the way.
+        """
+        schema = metadata.get("schema")
+        index = metadata.get("index")
+        if index:
+            sections = [section for section in index if section["type"] in ("header", "footer")
+                        or section["type"] == "table" and table_filter.matches(schema, section["name"])]
+            tables = list(dict.fromkeys(section["name"] for section in sections if section["type"] == "table"))
+            if not tables:
+                return []
+        else:
+            console.print(f"[yellow]{backup_file} has no table index, reading the whole dump[/yellow]")
+            
+        loader = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        decompress = None
+        try:
+            if index:
+                for data in read_sections(backup_file, codec_for_file(backup_file), sections):
+                    loader.stdin.write(data)
+            else:
+                writer = SectionFilter(loader.stdin, schema, table_filter)
+                if metadata.get("format") == REPOSITORY_FORMAT:
+                    repository = BackupRepository(config.get("backup_location") or ".")
+                    for chunk in repository.read_chunks(metadata):
+                        writer.write(chunk)
+                else:
+                    with open_input(backup_file) as f:
+                        codec = codec_for_file(backup_file)
+                        if codec:
+                            decompress = subprocess.Popen(decompress_command(codec), stdin=f, stdout=subprocess.PIPE)
+                            copy_stream(decompress.stdout, writer)
+                        else:
+                            copy_stream(f, writer)
+                writer.close()
+                tables = sorted(writer.tables)
+        finally:
+            if decompress:
+                decompress.stdout.close()
+                decompress.wait()
+            loader.stdin.close()
+            loader.wait()
+        if decompress and decompress.returncode != 0:
+            raise subprocess.CalledProcessError(decompress.returncode, decompress.args)
+        if loader.returncode != 0:
+            raise subprocess.CalledProcessError(loader.returncode, "mysql")
+        return tables
+        
+    def _restore_from_repository(self, config, manifest, cmd):
+        """Stream the chunks of a repository backup into the mysql client"""
+        repository = BackupRepository(config.get("backup_location") or ".")
+        loader = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            for chunk in repository.read_chunks(manifest):
+                loader.stdin.write(chunk)
+        finally:
+            loader.stdin.close()
+            loader.wait()
+        if loader.returncode != 0:
+            raise subprocess.CalledProcessError(loader.returncode, "mysql")
+            
+    def _replay_binlogs(self, config, db_config, metadata, until, database, run):
+        """Roll a restored backup forward to `until` from the binlog archive"""
+        # The restore changed the server's schemas and tables
+        ConnectionManager(db_config).invalidate()
+        if not until:
+            return True
+        try:
+            with run.stage("replay"):
+                BinlogManager(db_config, self._backup_dir(config, db_config) / BINLOG_DIR).replay(
+                    metadata["binlog"], until, metadata.get("schema"), database
+                )
+            return True
+        except (BinlogError, OSError) as e:
+            console.print(f"[red]Error replaying binlogs: {str(e)}[/red]")
+            return False
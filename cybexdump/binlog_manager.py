@@ -0,0 +1,201 @@
+import json
+import re
+import subprocess
+import threading
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+import mysql.connector
+from rich.console import Console
+from .connection_manager import ConnectionManager
+
+console = Console()
+
+STATE_FILE = "state.json"
+
+_DUMP_POSITION = re.compile(
+    rb"(?:MASTER|SOURCE)_LOG_FILE='([^']+)',\s*(?:MASTER|SOURCE)_LOG_POS=(\d+)"
+)
+_DUMP_GTID = re.compile(rb"GTID_PURGED=(?:/\*!80000 '\+'\*/ )?'([^']*)'")
+
+
+class BinlogError(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def source_data_option(replica=False):
+    """mysqldump option that writes the binlog coordinates into the dump header
+
+    With `replica`, the coordinates are those of the replica's source.
+    """
+    try:
+        help_text = subprocess.run(["mysqldump", "--help"], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL).stdout
+    except OSError:
+        help_text = b""
+    if b"--source-data" in help_text:
+        return "--dump-replica=2" if replica else "--source-data=2"
+    return "--dump-slave=2" if replica else "--master-data=2"
+
+
+def parse_dump_position(header):
+    """Binlog coordinates from the commented CHANGE MASTER/REPLICATION SOURCE line of a dump"""
+    match = _DUMP_POSITION.search(header)
+    if not match:
+        return None
+    gtid = _DUMP_GTID.search(header)
+    return {
+        "file": match.group(1).decode(),
+        "position": int(match.group(2)),
+        "gtid_set": gtid.group(1).decode().replace("\\n", "") if gtid else None
+    }
+
+
+def read_server_position(cursor):
+    """Current binlog coordinates and GTID set, None if binary logging is off"""
+    try:
+        cursor.execute("SHOW BINARY LOG STATUS")
+    except mysql.connector.Error:
+        # Before MySQL 8.2
+        cursor.execute("SHOW MASTER STATUS")
+    row = cursor.fetchone()
+    cursor.fetchall()
+    if not row:
+        return None
+    gtid_set = row[4].replace("\n", "") if len(row) > 4 and row[4] else None
+    return {"file": row[0], "position": int(row[1]), "gtid_set": gtid_set}
+
+
+class BinlogManager:
+    """Archives binary logs of one MySQL server and replays them for point-in-time restore
+
+    Binlogs are pulled with `mysqlbinlog --read-from-remote-server --raw` into
+    `archive_dir`, one local file per server binlog. Each run resumes from the
+    last file it saw, which is re-fetched because it may have grown since.
+    """
+
+    def __init__(self, db_config, archive_dir):
+        self.db_config = db_config
+        self.archive_dir = Path(archive_dir)
+        self.state_file = self.archive_dir / STATE_FILE
+
+    def _client_args(self):
+        return [
+            f"--host={self.db_config['host']}",
+            f"--port={self.db_config['port']}",
+            f"--user={self.db_config['username']}",
+            f"--password={self.db_config['password']}"
+        ]
+
+    def _load_state(self):
+        if not self.state_file.exists():
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        with open(self.state_file, 'w') as f:
+            json.dump(state, f, indent=4)
+
+    def _server_binlogs(self):
+        with ConnectionManager(self.db_config).connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SHOW BINARY LOGS")
+            binlogs = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return binlogs
+
+    def archive(self, start_file=None):
+        """Stream new binlog segments into the archive, returning the files fetched
+
+        `start_file` is used when nothing has been archived yet, normally the
+        binlog recorded by the latest full backup.
+        """
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        state = self._load_state()
+        binlogs = self._server_binlogs()
+        if not binlogs:
+            raise BinlogError("Binary logging is not enabled on the server")
+
+        start = state.get("last_file") or start_file or binlogs[0]
+        if start not in binlogs:
+            console.print(f"[yellow]Binlog {start} is no longer on the server, archive has a gap "
+                          f"until {binlogs[0]}[/yellow]")
+            start = binlogs[0]
+
+        cmd = [
+            "mysqlbinlog",
+            "--read-from-remote-server",
+            "--raw",
+            *self._client_args(),
+            f"--result-file={self.archive_dir}/",
+            start,
+            "--to-last-log"
+        ]
+        result = subprocess.run(cmd, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise BinlogError(result.stderr.decode(errors="replace").strip())
+
+        fetched = binlogs[binlogs.index(start):]
+        state.update(last_file=fetched[-1], archived_at=datetime.now().isoformat())
+        self._save_state(state)
+        return fetched
+
+    def archived_files(self, start_file):
+        """Archived binlogs from `start_file` onwards, in server order"""
+        files = sorted(path for path in self.archive_dir.iterdir()
+                       if path.name != STATE_FILE and path.name >= start_file)
+        if not files or files[0].name != start_file:
+            raise BinlogError(f"Binlog {start_file} is not in the archive {self.archive_dir}")
+        return files
+
+    def replay(self, position, until=None, schema=None, target_schema=None):
+        """Apply archived binlog events from `position` up to the `until` timestamp
+
+        `until` is a local-time "YYYY-MM-DD HH:MM:SS" string; without it every
+        archived event is replayed. Events are limited to `schema` and renamed
+        into `target_schema` when the backup was restored under another name.
+        """
+        files = self.archived_files(position["file"])
+        decode = [
+            "mysqlbinlog",
+            f"--start-position={position['position']}",
+            *[str(path) for path in files]
+        ]
+        if until:
+            decode.insert(1, f"--stop-datetime={until}")
+        if position.get("gtid_set"):
+            # The restored server already has these GTIDs, apply events as new transactions
+            decode.insert(1, "--skip-gtids")
+        if schema:
+            # mysqlbinlog applies --database after --rewrite-db
+            decode.insert(1, f"--database={target_schema or schema}")
+            if target_schema and target_schema != schema:
+                decode.insert(1, f"--rewrite-db={schema}->{target_schema}")
+
+        load = [
+            "mysql",
+            f"-h{self.db_config['host']}",
+            f"-P{self.db_config['port']}",
+            f"-u{self.db_config['username']}",
+            f"-p{self.db_config['password']}"
+        ]
+        events = subprocess.Popen(decode, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Read mysqlbinlog's warnings while the loader runs, or a full stderr pipe would block both
+        stderr = []
+        drain = threading.Thread(target=lambda: stderr.append(events.stderr.read()), daemon=True)
+        drain.start()
+        try:
+            loaded = subprocess.run(load, stdin=events.stdout, stderr=subprocess.PIPE)
+        finally:
+            events.stdout.close()
+            drain.join()
+            events.wait()
+        if events.returncode != 0:
+            raise BinlogError(b"".join(stderr).decode(errors="replace").strip())
+        if loaded.returncode != 0:
+            raise BinlogError(loaded.stderr.decode(errors="replace").strip())
+        console.print(f"[green]Replayed {len(files)} binlog file(s) from "
+                      f"{position['file']}:{position['position']}"
+                      f"{' until ' + until if until else ''}[/green]")
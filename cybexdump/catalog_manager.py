@@ -0,0 +1,145 @@
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from .config_manager import ConfigManager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    database_id INTEGER NOT NULL,
+    host TEXT,
+    schema_name TEXT NOT NULL,
+    format TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    created TEXT NOT NULL,
+    finished TEXT,
+    seconds REAL,
+    raw_bytes INTEGER,
+    bytes INTEGER,
+    checksum TEXT,
+    codec TEXT,
+    binlog_file TEXT,
+    binlog_position INTEGER,
+    gtid_set TEXT,
+    content TEXT,
+    tables TEXT
+);
+CREATE INDEX IF NOT EXISTS backups_lookup ON backups (database_id, schema_name, created);
+CREATE INDEX IF NOT EXISTS backups_schema ON backups (schema_name, created);
+"""
+
+COLUMNS = (
+    "database_id", "host", "schema_name", "format", "path", "created", "finished",
+    "seconds", "raw_bytes", "bytes", "checksum", "codec", "binlog_file",
+    "binlog_position", "gtid_set", "content", "tables"
+)
+
+# Columns added after the first release, with their type, for catalogs created before them
+ADDED_COLUMNS = {"content": "TEXT", "tables": "TEXT"}
+
+# Backups of every table of a schema, with rows and definitions; `content` is NULL in older catalogs
+COMPLETE = "COALESCE(content, 'full') = 'full' AND tables IS NULL"
+
+
+def is_complete(entry):
+    """Whether a catalog entry is a whole schema, not a schema-only, data-only or table-filtered dump"""
+    return (entry.get("content") or "full") == "full" and entry.get("tables") is None
+
+
+def _entry(row):
+    entry = dict(row)
+    if entry.get("tables") is not None:
+        entry["tables"] = json.loads(entry["tables"])
+    return entry
+
+
+class CatalogManager:
+    """Index of every backup taken, kept in SQLite under ~/.cybexdump
+
+    Listing, retention and restore lookups query this index instead of
+    globbing and stat()ing the backup directories.
+    """
+
+    def __init__(self, catalog_file=None):
+        config_manager = ConfigManager()
+        self.catalog_file = Path(catalog_file or config_manager.config_dir / "catalog.db")
+
+    def _connect(self):
+        self.catalog_file.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.catalog_file), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(backups)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE backups ADD COLUMN {column} {column_type}")
+        return conn
+
+    def record_backup(self, entry):
+        """Add or replace a backup; `entry` uses the column names above
+
+        `tables` is the list of tables a table-filtered backup holds, None
+        when it holds all of them.
+        """
+        binlog = entry.get("binlog") or {}
+        tables = entry.get("tables")
+        row = dict(entry, binlog_file=binlog.get("file"), binlog_position=binlog.get("position"),
+                   gtid_set=binlog.get("gtid_set"), content=entry.get("content") or "full",
+                   tables=json.dumps(tables) if tables is not None else None)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO backups ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                [row.get(column) for column in COLUMNS]
+            )
+        conn.close()
+
+    def list_backups(self, database_id=None, schema=None, before=None, limit=None, complete=False):
+        """Backups, newest first, optionally filtered
+
+        With `complete`, partial backups are left out: schema-only, data-only
+        and table-filtered dumps.
+        """
+        query = "SELECT * FROM backups WHERE 1 = 1"
+        params = []
+        if complete:
+            query += f" AND {COMPLETE}"
+        if database_id is not None:
+            query += " AND database_id = ?"
+            params.append(database_id)
+        if schema:
+            query += " AND schema_name = ?"
+            params.append(schema)
+        if before:
+            query += " AND created < ?"
+            params.append(before.isoformat() if isinstance(before, datetime) else before)
+        query += " ORDER BY created DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        conn = self._connect()
+        rows = [_entry(row) for row in conn.execute(query, params)]
+        conn.close()
+        return rows
+
+    def latest(self, schema=None, database_id=None, complete=True):
+        """Newest complete backup of a schema, or None; with `complete` False, the newest of any kind"""
+        rows = self.list_backups(database_id, schema, limit=1, complete=complete)
+        return rows[0] if rows else None
+
+    def find(self, path):
+        """Catalog entry for a backup path, or None"""
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM backups WHERE path = ?", (str(path),)).fetchone()
+        conn.close()
+        return _entry(row) if row else None
+
+    def delete(self, backup_ids):
+        """Forget backups by catalog id"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM backups WHERE id = ?", [(backup_id,) for backup_id in backup_ids])
+        conn.close()
@@ -1,17 +1,26 @@
 import click
-import json
-import os
-from pathlib import Path
-from rich.console import Console
-from rich.prompt import Prompt, Confirm
-from cybexdump.config_manager import ConfigManager
-from cybexdump.scheduler import BackupScheduler
-from cybexdump.database_manager import DatabaseManager
-from cybexdump.migration_manager import MigrationManager
-
-console = Console()
-config_manager = ConfigManager()
-migration_manager = MigrationManager()
+
+# Commands import what they use when they run: the scheduler starts this CLI
+# many times an hour, and `--help` or a single backup should not pay for
+# mysql.connector, crontab or rich unless they need them.
+
+class _LazyConsole:
+    """rich Console, created on first use"""
+    _console = None
+    
+    def __getattr__(self, name):
+        if _LazyConsole._console is None:
+            from rich.console import Console
+            _LazyConsole._console = Console()
+        return getattr(_LazyConsole._console, name)
+
+console = _LazyConsole()
+
+DEFAULT_PORTS = {"mysql": "3306", "postgresql": "5432", "mongodb": "27017"}
+
+def _migration_manager():
+    from cybexdump.migration_manager import MigrationManager
+    return MigrationManager()
 
 @click.group()
 @click.version_option(version='0.1.0')
@@ -22,6 +31,11 @@ def cli():
 @cli.command()
 def configure():
     """Initial configuration of CybexDump"""
+    from pathlib import Path
+    from rich.prompt import Prompt, Confirm
+    from cybexdump.config_manager import ConfigManager
+    from cybexdump.scheduler import BackupScheduler
+    
     console.print("[bold blue]Welcome to CybexDump Configuration![/bold blue]")
     
     # Create config directory if it doesn't exist
@@ -62,10 +76,11 @@ def configure():
     if Confirm.ask("Do you want to add a database now?"):
         db_config = _add_database()
         if db_config:
+            db_config["id"] = len(config["databases"]) + 1
             config["databases"].append(db_config)
     
     # Save Configuration
-    config_manager.save_config(config)
+    ConfigManager().save_config(config)
     
     # Setup Scheduler
     scheduler = BackupScheduler()
@@ -75,13 +90,17 @@ def configure():
 
 def _add_database():
     """Helper function to add database configuration"""
-    db_types = ["mysql", "postgresql", "mongodb"]
+    from rich.prompt import Prompt, Confirm
+    from cybexdump.cron_expression import CronExpression, CronExpressionError
+    from cybexdump.database_manager import DatabaseManager
+    
+    db_types = list(DEFAULT_PORTS)
     db_type = Prompt.ask("Select database type", choices=db_types)
     
     db_config = {
         "type": db_type,
         "host": Prompt.ask("Enter host"),
-        "port": int(Prompt.ask("Enter port", default="3306" if db_type == "mysql" else "5432")),
+        "port": int(Prompt.ask("Enter port", default=DEFAULT_PORTS[db_type])),
         "username": Prompt.ask("Enter username"),
         "password": Prompt.ask("Enter password", password=True),
         "databases": [],
@@ -106,66 +125,350 @@ def _add_database():
         available_dbs[int(i)-1] for i in choice.split(",")
     ]
     
+    if db_type == "mysql":
+        db_config["dump_mode"] = Prompt.ask(
+            "Select dump engine (native dumps tables in parallel)",
+            choices=["mysqldump", "native"],
+            default="mysqldump"
+        )
+        
     # Backup Schedule
     db_config["schedule"]["frequency"] = Prompt.ask(
         "Enter backup frequency",
-        choices=["hourly", "daily", "weekly"],
+        choices=["hourly", "daily", "weekly", "cron"],
         default="daily"
     )
     
-    db_config["schedule"]["time"] = Prompt.ask(
-        "Enter backup time (HH:MM)",
-        default="00:00"
-    )
+    if db_config["schedule"]["frequency"] == "cron":
+        while True:
+            expression = Prompt.ask("Enter cron expression", default="0 2 * * *")
+            try:
+                CronExpression(expression)
+                break
+            except CronExpressionError as e:
+                console.print(f"[red]{str(e)}[/red]")
+        db_config["schedule"]["cron"] = expression
+    else:
+        db_config["schedule"]["time"] = Prompt.ask(
+            "Enter backup time (HH:MM)",
+            default="00:00"
+        )
     
     db_config["schedule"]["retention_days"] = int(Prompt.ask(
         "Enter backup retention period in days",
         default="7"
     ))
     
+    if db_type == "mysql" and Confirm.ask("Archive binary logs hourly for point-in-time restore?", default=False):
+        db_config["incremental"] = {"enabled": True}
+    
     return db_config
 
 @cli.command()
 @click.option('--file', '-f', help='Output file path for backup (default: cybexdump_backup_YYYYMMDD_HHMMSS.json)')
 @click.option('--config-only', is_flag=True, help='Backup only configuration without database dumps')
-def backup(file, config_only):
+@click.option('--database-id', type=int, multiple=True, help='Only back up the given database configuration (repeatable)')
+@click.option('--jobs', '-j', type=int, help='Maximum concurrent schema dumps per host')
+@click.option('--global-jobs', type=int, help='Maximum concurrent schema dumps across all hosts')
+@click.option('--compression', type=click.Choice(['gzip', 'zstd', 'lz4']), help='Compression codec (default: from config, else gzip)')
+@click.option('--compression-level', type=int, help='Compression level for the selected codec')
+@click.option('--incremental', is_flag=True, help='Archive new binary logs instead of taking a full dump')
+@click.option('--resume', is_flag=True, help='Continue the last failed native dump of each schema')
+@click.option('--table', 'tables', multiple=True, metavar='PATTERN',
+              help='Only back up matching MySQL tables, as schema.table or table with wildcards (repeatable)')
+@click.option('--exclude-table', multiple=True, metavar='PATTERN', help='Leave out matching MySQL tables (repeatable)')
+@click.option('--schema-only', is_flag=True, help='Back up MySQL table definitions without their rows')
+@click.option('--data-only', is_flag=True, help='Back up MySQL rows without table definitions')
+@click.option('--connect-timeout', type=float, help='Seconds to wait for each server to accept a connection')
+@click.option('--dump-timeout', type=float, help='Seconds a schema dump may run before it is stopped')
+def backup(file, config_only, database_id, jobs, global_jobs, compression, compression_level, incremental, resume,
+           tables, exclude_table, schema_only, data_only, connect_timeout, dump_timeout):
     """Backup databases and/or configuration"""
+    from cybexdump.backup_manager import BackupManager
+    
+    if schema_only and data_only:
+        raise click.UsageError("--schema-only and --data-only exclude each other")
+        
     if config_only:
-        migration_manager.backup_configuration(file)
+        _migration_manager().backup_configuration(file)
+    elif incremental:
+        BackupManager().archive_binlogs(list(database_id) or None)
     else:
         backup_manager = BackupManager()
-        config = config_manager.load_config()
+        config = backup_manager.config_manager.load_config()
         
         if not config.get("databases"):
             console.print("[yellow]No databases configured for backup[/yellow]")
             return
             
-        for db_config in config["databases"]:
-            backup_manager.perform_backup(db_config["id"], output_file=file)
+        settings = {}
+        if compression:
+            settings["codec"] = compression
+        if compression_level:
+            settings["level"] = compression_level
+            
+        backup_manager.perform_backups(
+            list(database_id) or None,
+            output_file=file,
+            jobs=jobs,
+            global_jobs=global_jobs,
+            compression=settings,
+            resume=resume,
+            tables={"include": list(tables), "exclude": list(exclude_table)},
+            content="schema" if schema_only else "data" if data_only else None,
+            timeouts={"connect_timeout": connect_timeout, "dump_timeout": dump_timeout}
+        )
 
 @cli.command()
-@click.argument('file', type=click.Path(exists=True))
+@click.argument('file', type=click.Path(), required=False)
 @click.option('--config-only', is_flag=True, help='Restore only configuration without database restoration')
 @click.option('--force', is_flag=True, help='Force restore without confirmation')
-def restore(file, config_only, force):
+@click.option('--database', '-d', help='Schema to restore into (default: the schema recorded in the backup)')
+@click.option('--jobs', '-j', type=int, help='Parallel loader connections for per-table backups')
+@click.option('--until', help='Replay archived binlogs up to this local time (YYYY-MM-DD HH:MM:SS)')
+@click.option('--latest', metavar='SCHEMA', help='Restore the newest cataloged backup of SCHEMA')
+@click.option('--database-id', type=int, help='With --latest, only consider backups of this configuration')
+@click.option('--resume', is_flag=True, help='Continue a failed restore of a per-table backup')
+@click.option('--table', 'tables', multiple=True, metavar='PATTERN',
+              help='Only restore matching tables, as schema.table or table with wildcards (repeatable)')
+def restore(file, config_only, force, database, jobs, until, latest, database_id, resume, tables):
     """Restore databases and/or configuration from backup"""
+    from rich.prompt import Confirm
+    
+    if not file and not latest:
+        raise click.UsageError("Provide a backup FILE or --latest SCHEMA")
+    if config_only and not file:
+        raise click.UsageError("--config-only needs a configuration backup FILE")
+        
     if not force and not Confirm.ask("[bold yellow]This will overwrite existing configuration. Continue?[/bold yellow]"):
         console.print("Restore cancelled")
         return
         
     if config_only:
-        if migration_manager.restore_configuration(file):
+        from cybexdump.scheduler import BackupScheduler
+        if _migration_manager().restore_configuration(file):
             # Reconfigure scheduler after restore
             scheduler = BackupScheduler()
             scheduler.setup_default_schedule()
     else:
+        from cybexdump.backup_manager import BackupManager
         backup_manager = BackupManager()
-        backup_manager.restore_from_backup(file)
+        backup_manager.restore_from_backup(file, database=database, jobs=jobs, until=until,
+                                           latest=latest, database_id=database_id, resume=resume,
+                                           tables=list(tables) or None)
+
+@cli.command(name="list")
+@click.argument('schema', required=False)
+@click.option('--database-id', type=int, help='Only list backups of this configuration')
+@click.option('--limit', '-n', type=int, default=50, show_default=True, help='Maximum number of backups to show')
+@click.option('--rebuild', is_flag=True, help='Index backups already on disk before listing')
+def list_backups(schema, database_id, limit, rebuild):
+    """List cataloged backups, newest first (SCHEMA or 'all')"""
+    from rich.table import Table
+    from cybexdump.backup_manager import BackupManager
+    
+    backup_manager = BackupManager()
+    if rebuild:
+        console.print(f"Indexed {backup_manager.rebuild_catalog()} backups")
+        
+    entries = backup_manager.catalog.list_backups(
+        database_id, None if schema in (None, "all") else schema, limit=limit
+    )
+    if not entries:
+        console.print("[yellow]No backups found[/yellow]")
+        return
+        
+    table = Table(title="Backups")
+    table.add_column("ID")
+    table.add_column("Database")
+    table.add_column("Created")
+    table.add_column("Format")
+    table.add_column("Content")
+    table.add_column("Size", justify="right")
+    table.add_column("Binlog")
+    table.add_column("Path")
+    for entry in entries:
+        table.add_row(
+            str(entry["database_id"]),
+            entry["schema_name"],
+            entry["created"][:19].replace("T", " "),
+            f"{entry['format']}/{entry['codec']}",
+            (entry["content"] or "full") + (f", {len(entry['tables'])} tables" if entry["tables"] is not None else ""),
+            f"{(entry['bytes'] or 0) / 1024 / 1024:.1f} MB",
+            f"{entry['binlog_file']}:{entry['binlog_position']}" if entry["binlog_file"] else "-",
+            entry["path"]
+        )
+    console.print(table)
+
+@cli.command()
+@click.argument('paths', nargs=-1, type=click.Path())
+@click.option('--schema', help='Only verify cataloged backups of this schema')
+@click.option('--database-id', type=int, help='Only verify cataloged backups of this configuration')
+@click.option('--latest', is_flag=True, help='Only verify the newest backup of each schema')
+@click.option('--jobs', '-j', type=int, help='Files checked in parallel (default: CPU count)')
+@click.option('--quick', is_flag=True, help='Only compare checksums, without decompressing')
+@click.option('--sample', type=int, metavar='N', help='Test-restore N random tables of each per-table backup')
+def verify(paths, schema, database_id, latest, jobs, quick, sample):
+    """Check backups for corruption (PATHS, or every cataloged backup)"""
+    from cybexdump.backup_manager import BackupManager
+    
+    if not BackupManager().verify_backups(list(paths), schema, database_id, latest, jobs, quick, sample):
+        raise SystemExit(1)
+
+@cli.command()
+@click.option('--database-id', type=int, multiple=True, help='Only prune backups of the given configuration (repeatable)')
+@click.option('--dry-run', is_flag=True, help='Show which backups would be kept and removed without deleting any')
+@click.option('--jobs', '-j', type=int, help='Backups deleted in parallel (default: 8)')
+def prune(database_id, dry_run, jobs):
+    """Apply the retention policies outside a backup run"""
+    from cybexdump.backup_manager import BackupManager
+    
+    BackupManager().apply_retention(list(database_id) or None, dry_run, jobs)
+
+@cli.command()
+@click.option('--jobs', '-j', type=int, help='Maximum concurrent backups per host (default: 1)')
+@click.option('--global-jobs', type=int, help='Maximum concurrent backups overall (default: CPU count)')
+@click.option('--jitter', type=int, help='Delay each run by up to this many seconds, at most a quarter of its interval (default: 300)')
+@click.option('--no-catch-up', is_flag=True, help='Do not run backups missed while the daemon was down')
+def daemon(jobs, global_jobs, jitter, no_catch_up):
+    """Run scheduled backups from a single long-running process"""
+    from cybexdump.scheduler import BackupScheduler
+    
+    BackupScheduler().run_continuous(jobs, global_jobs, jitter, catch_up=not no_catch_up)
+
+@cli.command()
+@click.option('--jobs', '-j', type=int, help='Maximum concurrent backups per host (default: 1)')
+@click.option('--global-jobs', type=int, help='Maximum concurrent backups overall (default: CPU count)')
+def dispatch(jobs, global_jobs):
+    """Run every backup that is due now (called each minute by the supervisor entry)"""
+    from cybexdump.scheduler import BackupScheduler
+    
+    BackupScheduler().dispatch(jobs, global_jobs)
+
+@cli.command()
+@click.option('--supervisor/--per-config', default=None,
+              help='Install one crontab entry for all configs, or one per config (default: from config)')
+def schedule(supervisor):
+    """Rewrite the cybexdump crontab entries"""
+    from cybexdump.config_manager import ConfigManager
+    from cybexdump.scheduler import BackupScheduler
+    
+    if supervisor is not None:
+        config_manager = ConfigManager()
+        config = config_manager.load_config()
+        config.setdefault("daemon", {})["supervisor"] = supervisor
+        config_manager.save_config(config)
+    BackupScheduler().setup_default_schedule()
+    console.print("[green]Crontab updated[/green]")
+
+@cli.command()
+@click.option('--serve', is_flag=True, help='Serve the metrics over HTTP for Prometheus to scrape')
+@click.option('--port', type=int, default=9101, show_default=True, help='Port for --serve')
+@click.option('--bind', default='', help='Address for --serve (default: all interfaces)')
+@click.option('--runs', type=int, metavar='N', help='Show the N most recent runs from the run log instead')
+def metrics(serve, port, bind, runs):
+    """Print backup metrics in Prometheus text format"""
+    from cybexdump import metrics as run_metrics
+    
+    if runs:
+        from rich.table import Table
+        table = Table(title="Recent runs")
+        table.add_column("Finished")
+        table.add_column("Operation")
+        table.add_column("Status")
+        table.add_column("Time", justify="right")
+        table.add_column("Stages")
+        for entry in run_metrics.recent_runs(runs):
+            labels = " ".join(f"{key}={value}" for key, value in entry["labels"].items())
+            table.add_row(
+                entry["finished"][:19].replace("T", " "),
+                f"{entry['operation']} {labels}".strip(),
+                entry["status"],
+                f"{entry['seconds']:.1f}s",
+                ", ".join(f"{name} {seconds:.1f}s" for name, seconds in entry["stages"].items())
+            )
+        console.print(table)
+    elif serve:
+        console.print(f"[green]Serving metrics on http://{bind or '0.0.0.0'}:{port}/metrics[/green]")
+        run_metrics.serve(port, bind)
+    else:
+        click.echo(run_metrics.render(run_metrics.load_state()), nl=False)
+
+@cli.group()
+def keystore():
+    """Manage the encrypted keystore of credentials and backup keys"""
+    pass
+
+@keystore.command(name="init")
+def keystore_init():
+    """Create the keystore and move the configured passwords into it"""
+    import os
+    from rich.prompt import Prompt
+    from cybexdump.config_manager import ConfigManager
+    from cybexdump.keystore import PASSPHRASE_ENV
+    
+    config_manager = ConfigManager()
+    if config_manager.keystore.exists():
+        console.print(f"[yellow]{config_manager.keystore.path} already exists[/yellow]")
+        return
+    passphrase = os.environ.get(PASSPHRASE_ENV)
+    if not passphrase:
+        passphrase = Prompt.ask("New keystore passphrase", password=True)
+        if Prompt.ask("Repeat the passphrase", password=True) != passphrase:
+            console.print("[red]The passphrases differ[/red]")
+            raise SystemExit(1)
+    config = config_manager.load_config()
+    config_manager.keystore.create(passphrase)
+    if config:
+        # Saving moves the credentials from config.json into the keystore
+        config_manager.save_config(config)
+    console.print(f"[green]Keystore created at {config_manager.keystore.path}[/green]")
+    console.print("[yellow]Backups can only be restored with the backup key: store the output of "
+                  "'cybexdump keystore export-key' somewhere safe, away from the backups[/yellow]")
+
+@keystore.command(name="export-key")
+@click.option('--key-id', help='Export this key instead of the one new backups use')
+def keystore_export_key(key_id):
+    """Print a backup encryption key, base64 encoded, for disaster recovery"""
+    import base64
+    from cybexdump.keystore import Keystore
+    
+    key_id, key = Keystore().backup_key(key_id)
+    console.print(f"Key id: {key_id}", highlight=False)
+    click.echo(base64.b64encode(key).decode())
+
+@keystore.command(name="import-key")
+@click.argument('key')
+@click.option('--current', is_flag=True, help='Encrypt new backups with this key')
+def keystore_import_key(key, current):
+    """Add an exported backup key, to restore backups encrypted with it"""
+    import base64
+    import binascii
+    from cybexdump.keystore import Keystore
+    
+    try:
+        key = base64.b64decode(key, validate=True)
+    except binascii.Error:
+        key = b""
+    if len(key) != 32:
+        console.print("[red]Not a backup key: expected 32 bytes, base64 encoded[/red]")
+        raise SystemExit(1)
+    key_id = Keystore().add_backup_key(key, current)
+    console.print(f"[green]Backup key {key_id} imported[/green]")
+
+@keystore.command(name="rotate-key")
+def keystore_rotate_key():
+    """Encrypt new backups with a fresh key; older backups keep theirs"""
+    from cybexdump.keystore import Keystore
+    
+    key_id = Keystore().new_backup_key()
+    console.print(f"[green]New backups are encrypted with key {key_id}[/green]")
+    console.print("[yellow]Export the new key with 'cybexdump keystore export-key'[/yellow]")
 
 @cli.command()
 def clean():
     """Clean all configuration (with confirmation)"""
-    migration_manager.clean_configuration()
+    _migration_manager().clean_configuration()
 
 def main():
     """Main entry point for the CLI"""
@@ -0,0 +1,248 @@
+import hashlib
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_CODEC = "gzip"
+# Tail of a failed compressor's stderr kept in its error
+STDERR_BYTES = 4096
+
+# Each codec is driven through its command line tool. `binaries` lists the
+# candidates in order of preference, so gzip uses pigz when it is installed.
+CODECS = {
+    "gzip": {
+        "extension": ".gz",
+        "binaries": ["pigz", "gzip"],
+        "levels": (1, 9),
+        "default_level": 6
+    },
+    "zstd": {
+        "extension": ".zst",
+        "binaries": ["zstd"],
+        "levels": (1, 19),
+        "default_level": 3
+    },
+    "lz4": {
+        "extension": ".lz4",
+        "binaries": ["lz4"],
+        "levels": (1, 12),
+        "default_level": 1
+    }
+}
+
+
+class CompressionError(Exception):
+    pass
+
+
+def _find_binary(codec):
+    """Return the first available binary for a codec"""
+    if codec not in CODECS:
+        raise CompressionError(f"Unsupported compression codec: {codec}")
+    for binary in CODECS[codec]["binaries"]:
+        if shutil.which(binary):
+            return binary
+    raise CompressionError(f"No binary found for {codec} (tried {', '.join(CODECS[codec]['binaries'])})")
+
+
+def compress_command(codec=DEFAULT_CODEC, level=None, threads=None):
+    """Build the command that compresses stdin to stdout"""
+    binary = _find_binary(codec)
+    low, high = CODECS[codec]["levels"]
+    level = min(max(int(level or CODECS[codec]["default_level"]), low), high)
+
+    cmd = [binary, f"-{level}", "-c"]
+    if binary == "pigz" and threads:
+        cmd += ["-p", str(threads)]
+    elif codec == "zstd":
+        # -T0 lets zstd use one worker per core
+        cmd += ["-q", f"-T{threads or 0}"]
+    elif codec == "lz4":
+        cmd.append("-q")
+    return cmd
+
+
+def decompress_command(codec=DEFAULT_CODEC):
+    """Build the command that decompresses stdin (or a file argument) to stdout"""
+    binary = _find_binary(codec)
+    cmd = [binary, "-dc"]
+    if codec in ("zstd", "lz4"):
+        cmd.append("-q")
+    return cmd
+
+
+def codec_extension(codec=DEFAULT_CODEC):
+    """File extension used for a codec"""
+    if codec not in CODECS:
+        raise CompressionError(f"Unsupported compression codec: {codec}")
+    return CODECS[codec]["extension"]
+
+
+def codec_for_file(path):
+    """Guess the codec of a backup file from its extension, None if uncompressed"""
+    suffix = Path(path).suffix
+    for codec, spec in CODECS.items():
+        if spec["extension"] == suffix:
+            return codec
+    return None
+
+
+class CompressedWriter:
+    """File-like writer that streams data through a compressor process
+
+    Whatever is written goes to the compressor's stdin; its compressed stdout
+    is copied into `dest` by a background thread, so nothing uncompressed ever
+    reaches the disk. `command_prefix`, e.g. ["nice", "-n", "10"], is put in
+    front of the compressor command.
+
+    When the compressor or `dest` fails, writes only see a broken pipe; used
+    as a context manager, the writer raises the underlying error instead.
+    """
+
+    def __init__(self, dest, codec=DEFAULT_CODEC, level=None, threads=None, command_prefix=None):
+        self.dest = dest
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._error = None
+        # Exit status of a compressor that stopped before abort() killed it
+        self._died = None
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(
+            list(command_prefix or []) + compress_command(codec, level, threads),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr
+        )
+        self._drain = threading.Thread(target=self._copy_output, daemon=True)
+        self._drain.start()
+
+    def _copy_output(self):
+        try:
+            while True:
+                data = self._proc.stdout.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self.dest.write(data)
+                self.compressed_bytes += len(data)
+        except Exception as e:
+            self._error = e
+            # Nobody is reading the compressor any more, stop it so writers fail fast
+            self._proc.kill()
+
+    def write(self, data):
+        self._proc.stdin.write(data)
+        self.raw_bytes += len(data)
+        return len(data)
+
+    def close(self):
+        """Flush the compressor and wait for all output to be written"""
+        if self._proc.stdin.closed:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            # The compressor already exited; its status says why
+            pass
+        returncode = self._proc.wait()
+        self._drain.join()
+        try:
+            if self._error:
+                raise self._error
+            if returncode != 0:
+                raise self._exit_error(returncode)
+        finally:
+            self._stderr.close()
+
+    def _exit_error(self, returncode):
+        """CalledProcessError of the compressor, with the end of its stderr"""
+        self._stderr.seek(0)
+        stderr = self._stderr.read()[-STDERR_BYTES:].strip()
+        if not stderr:
+            stderr = f"{self._proc.args[0]} exited with status {returncode}".encode()
+        return subprocess.CalledProcessError(returncode, self._proc.args, stderr=stderr)
+
+    def abort(self):
+        """Stop the compressor without waiting for its output"""
+        closed = self._proc.stdin.closed
+        self._proc.kill()
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        returncode = self._proc.wait()
+        self._drain.join()
+        if not closed and returncode != -signal.SIGKILL:
+            # It had exited before being killed
+            self._died = returncode
+
+    def _failure(self):
+        """After abort(), the error of `dest` or of the compressor that broke the stream, else None"""
+        if self._error:
+            return self._error
+        if self._died:
+            return self._exit_error(self._died)
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        self.abort()
+        try:
+            # A write failing with a broken pipe is a symptom; report the cause
+            failure = self._failure() if isinstance(exc, OSError) else None
+        finally:
+            self._stderr.close()
+        if failure is not None:
+            raise failure from exc
+
+
+def copy_stream(source, dest, chunk_size=CHUNK_SIZE):
+    """Copy a binary stream into a writer, returning the number of bytes copied"""
+    total = 0
+    while True:
+        data = source.read(chunk_size)
+        if not data:
+            break
+        dest.write(data)
+        total += len(data)
+    return total
+
+
+class HashingWriter:
+    """File-like writer computing the SHA-256 of everything passed through to `dest`
+
+    Without a `dest`, the data is only hashed.
+    """
+
+    def __init__(self, dest=None):
+        self.dest = dest
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self._hash.update(data)
+        if self.dest is None:
+            return len(data)
+        return self.dest.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def file_checksum(path):
+    """SHA-256 of a file, as written by HashingWriter"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
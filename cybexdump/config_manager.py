@@ -1,27 +1,404 @@
 import json
+import os
+import re
+import threading
 from pathlib import Path
+from .compression import CODECS
+from .cron_expression import CronExpression, CronExpressionError
+from .keystore import Keystore, KeystoreError
+from .retention import TIERS
+from .storage import TARGETS
+from .table_filter import CONTENTS
+
+DATABASE_TYPES = ("mysql", "postgresql", "mongodb")
+DUMP_MODES = ("mysqldump", "native")
+FREQUENCIES = ("hourly", "daily", "weekly", "cron")
+NUMBER = (int, float)
+
+# Expected type of every known setting; a list holds the type of its items.
+# Settings not listed here are passed through unchecked.
+DATABASE_SCHEMA = {
+    "id": int,
+    "type": str,
+    "host": str,
+    "port": int,
+    "username": str,
+    "databases": (str, list),
+    "dump_mode": str,
+    "threads": int,
+    "jobs": int,
+    "chunk_rows": int,
+    "pool_size": int,
+    "metadata_ttl": NUMBER,
+    "connect_timeout": NUMBER,
+    "dump_timeout": NUMBER,
+    "volume": str,
+    "auth_source": str,
+    "storage": [str],
+    "compression": {"codec": str, "level": int, "threads": int},
+    "schedule": {"frequency": str, "time": str, "cron": str, "retention_days": int},
+    "retention": {"hourly": int, "daily": int, "weekly": int, "monthly": int},
+    "incremental": {"enabled": bool, "cron": str},
+    "repository": {"enabled": bool},
+    "tables": {"include": [str], "exclude": [str]},
+    "table_index": bool,
+    "replicas": {
+        "endpoints": [{"host": str, "port": int, "username": str}],
+        "max_lag": NUMBER,
+        "consistent": bool,
+        "fallback": bool
+    },
+    "content": str,
+    "encryption": {"enabled": bool, "threads": int},
+    "throttle": {
+        "read_mbps": NUMBER,
+        "write_mbps": NUMBER,
+        "compression_threads": int,
+        "nice": int,
+        "ionice_class": str,
+        "ionice_level": int,
+        "adaptive": {"threads_running": int, "interval": NUMBER, "min_read_mbps": NUMBER}
+    }
+}
+
+CONFIG_SCHEMA = {
+    "backup_location": str,
+    "max_jobs": int,
+    "databases": [DATABASE_SCHEMA],
+    "storage": [{"name": str, "type": str, "path": str, "part_size_mb": NUMBER, "upload_threads": int}],
+    "notification": {
+        "enabled": bool,
+        "email": str,
+        "smtp_server": str,
+        "smtp_port": int,
+        "smtp_username": str,
+        "smtp_starttls": bool,
+        "digest": bool,
+        "webhooks": [{"url": str, "format": str, "headers": dict, "timeout": NUMBER}]
+    },
+    "daemon": {"host_jobs": int, "max_jobs": int, "jitter_seconds": NUMBER, "supervisor": bool},
+    "metrics": {"run_log": bool, "textfile": str},
+    "fleet": {"connect_timeout": NUMBER, "dump_timeout": NUMBER, "volumes": [str]},
+    "encryption": {"enabled": bool, "threads": int},
+    "verify": {"jobs": int, "sample": int, "scratch": {"host": str, "port": int, "username": str}}
+}
+
+TIME_PATTERN = re.compile(r"^([01]?\d|2[0-3]):[0-5]\d$")
+KEYSTORE_FILE = "keystore.json"
+
+# Parsed config files of this process: path -> (file identity, config, database configs by id)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class ConfigError(Exception):
+    pass
+
+
+def _type_name(expected):
+    if expected == NUMBER:
+        return "a number"
+    names = {int: "an integer", str: "a string", bool: "true or false", list: "a list", dict: "an object"}
+    if isinstance(expected, tuple):
+        return " or ".join(names[t] for t in expected)
+    return names[expected]
+
+
+def _check_types(value, schema, path, errors):
+    """Append a message to `errors` for every value in `value` not of the type `schema` expects"""
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected an object")
+            return
+        for key, expected in schema.items():
+            if value.get(key) is not None:
+                _check_types(value[key], expected, f"{path}.{key}" if path else key, errors)
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected a list")
+            return
+        for i, item in enumerate(value):
+            _check_types(item, schema[0], f"{path}[{i}]", errors)
+    else:
+        # true and false are ints to Python, but not where the config expects a number
+        expected = schema if isinstance(schema, tuple) else (schema,)
+        if isinstance(value, bool) and bool not in expected or not isinstance(value, expected):
+            errors.append(f"{path}: expected {_type_name(schema)}")
+
+
+def _check_database(db_config, path, storage_names, errors):
+    for key in ("id", "type", "host", "port", "databases", "schedule"):
+        if key not in db_config:
+            errors.append(f"{path}.{key}: required")
+    if db_config.get("type") in ("mysql", "postgresql"):
+        for key in ("username", "password"):
+            if key not in db_config:
+                errors.append(f"{path}.{key}: required for {db_config['type']}")
+    if "type" in db_config and db_config["type"] not in DATABASE_TYPES:
+        errors.append(f"{path}.type: must be one of {', '.join(DATABASE_TYPES)}")
+    if db_config.get("dump_mode") and db_config["dump_mode"] not in DUMP_MODES:
+        errors.append(f"{path}.dump_mode: must be one of {', '.join(DUMP_MODES)}")
+    if db_config.get("content") and db_config["content"] not in CONTENTS:
+        errors.append(f"{path}.content: must be one of {', '.join(CONTENTS)}")
+    replicas = db_config.get("replicas")
+    if isinstance(replicas, dict):
+        if db_config.get("type") != "mysql":
+            errors.append(f"{path}.replicas: only MySQL configs can be backed up from replicas")
+        endpoints = replicas.get("endpoints")
+        for i, endpoint in enumerate(endpoints if isinstance(endpoints, list) else []):
+            if isinstance(endpoint, dict) and "host" not in endpoint:
+                errors.append(f"{path}.replicas.endpoints[{i}].host: required")
+    if isinstance(db_config.get("databases"), str) and db_config["databases"] != "all":
+        errors.append(f"{path}.databases: must be \"all\" or a list of names")
+
+    compression = db_config.get("compression")
+    if isinstance(compression, dict) and compression.get("codec") not in (None, *CODECS):
+        errors.append(f"{path}.compression.codec: must be one of {', '.join(CODECS)}")
+    if isinstance(db_config.get("storage"), list):
+        for name in db_config["storage"]:
+            if isinstance(name, str) and name not in storage_names:
+                errors.append(f"{path}.storage: unknown storage target '{name}'")
+
+    schedule = db_config.get("schedule")
+    if isinstance(schedule, dict):
+        retention = db_config.get("retention")
+        retention = retention if isinstance(retention, dict) else {}
+        if "retention_days" not in schedule and not retention:
+            errors.append(f"{path}.schedule.retention_days: required without a \"retention\" section")
+        elif not _positive(schedule.get("retention_days")) and not any(_positive(retention.get(tier))
+                                                                      for tier in TIERS):
+            # Such a policy would expire every backup, the one just taken included
+            errors.append(f"{path}.retention: keeps no backups; set schedule.retention_days or a tier above 0")
+        if schedule.get("frequency") and schedule["frequency"] not in FREQUENCIES:
+            errors.append(f"{path}.schedule.frequency: must be one of {', '.join(FREQUENCIES)}")
+        if isinstance(schedule.get("time"), str) and not TIME_PATTERN.match(schedule["time"]):
+            errors.append(f"{path}.schedule.time: expected HH:MM")
+    for section in ("schedule", "incremental"):
+        expression = db_config.get(section)
+        expression = expression.get("cron") if isinstance(expression, dict) else None
+        if isinstance(expression, str):
+            try:
+                CronExpression(expression)
+            except CronExpressionError as e:
+                errors.append(f"{path}.{section}.cron: {str(e)}")
+
+
+def _positive(value):
+    return isinstance(value, int) and value > 0
+
+
+def _dicts(items):
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+
+def _secret_fields(config):
+    """(settings, key, keystore name) of every credential set in a configuration"""
+    fields = []
+    for db_config in _dicts(config.get("databases")):
+        fields.append((db_config, "password", f"databases/{db_config.get('id')}/password"))
+        replicas = db_config.get("replicas")
+        for i, endpoint in enumerate(_dicts(replicas.get("endpoints") if isinstance(replicas, dict) else None)):
+            fields.append((endpoint, "password", f"databases/{db_config.get('id')}/replicas/{i}/password"))
+    for target in _dicts(config.get("storage")):
+        for key in ("password", "secret_key"):
+            fields.append((target, key, f"storage/{target.get('name')}/{key}"))
+    if isinstance(config.get("notification"), dict):
+        fields.append((config["notification"], "smtp_password", "notification/smtp_password"))
+    scratch = config.get("verify", {}).get("scratch") if isinstance(config.get("verify"), dict) else None
+    if isinstance(scratch, dict):
+        fields.append((scratch, "password", "verify/scratch/password"))
+    return [(settings, key, name) for settings, key, name in fields if settings.get(key) is not None]
+
+
+def _is_reference(value):
+    """Whether a credential is stored in the keystore, written as {"keystore": "<name>"}"""
+    return isinstance(value, dict) and "keystore" in value
+
+
+def validate_config(config):
+    """Problems with a configuration, as messages naming the setting, e.g. "databases[0].port: expected an integer" """
+    errors = []
+    _check_types(config, CONFIG_SCHEMA, "", errors)
+    if errors and not isinstance(config, dict):
+        return errors
+
+    storage_names = set()
+    targets = config.get("storage")
+    for i, target in enumerate(targets if isinstance(targets, list) else []):
+        if not isinstance(target, dict):
+            continue
+        if "name" not in target:
+            errors.append(f"storage[{i}].name: required")
+        elif target["name"] in storage_names:
+            errors.append(f"storage[{i}].name: duplicate target '{target['name']}'")
+        storage_names.add(target.get("name"))
+        if target.get("type") not in TARGETS:
+            errors.append(f"storage[{i}].type: must be one of {', '.join(TARGETS)}")
+
+    ids = set()
+    databases = config.get("databases") or []
+    for i, db_config in enumerate(databases if isinstance(databases, list) else []):
+        if not isinstance(db_config, dict):
+            continue
+        if db_config.get("id") in ids:
+            errors.append(f"databases[{i}].id: duplicate id {db_config['id']}")
+        ids.add(db_config.get("id"))
+        _check_database(db_config, f"databases[{i}]", storage_names, errors)
+
+    notification = config.get("notification")
+    if isinstance(notification, dict) and notification.get("enabled") and notification.get("email"):
+        for key in ("smtp_server", "smtp_username"):
+            if not notification.get(key):
+                errors.append(f"notification.{key}: required for email notifications")
+    webhooks = notification.get("webhooks") if isinstance(notification, dict) else None
+    for i, webhook in enumerate(webhooks if isinstance(webhooks, list) else []):
+        if isinstance(webhook, dict) and "url" not in webhook:
+            errors.append(f"notification.webhooks[{i}].url: required")
+    return errors
+
 
 class ConfigManager:
+    """The JSON configuration file, parsed and validated once per process
+    
+    load_config() returns the same parsed config until the file changes on
+    disk, so callers must treat it as read-only: change a copy, or change it
+    and save it straight away with save_config(), which replaces the file
+    atomically.
+    
+    Once a keystore exists, save_config() moves the passwords and secret
+    keys of the config into it and writes {"keystore": "<name>"} in their
+    place; load_config() puts them back in memory.
+    """
+    
     def __init__(self):
         self.config_dir = Path.home() / ".cybexdump"
         self.config_file = self.config_dir / "config.json"
+        self.keystore = Keystore(self.config_dir / KEYSTORE_FILE)
+        
+    def _resolve(self, config):
+        """Copy of a stored config with the credentials of the keystore in place of their references"""
+        config = json.loads(json.dumps(config))
+        try:
+            for settings, key, _ in _secret_fields(config):
+                if _is_reference(settings[key]):
+                    settings[key] = self.keystore.get(settings[key]["keystore"])
+        except KeystoreError as e:
+            raise ConfigError(str(e))
+        return config
+        
+    def _seal(self, config):
+        """Copy of a config to store, its credentials moved to the keystore if there is one"""
+        config = json.loads(json.dumps(config))
+        if not self.keystore.exists():
+            return config
+        try:
+            stored = self.keystore.secrets()
+            changed = {}
+            for settings, key, name in _secret_fields(config):
+                if not _is_reference(settings[key]):
+                    if stored.get(name) != settings[key]:
+                        changed[name] = settings[key]
+                    settings[key] = {"keystore": name}
+            if changed:
+                self.keystore.update(changed)
+        except KeystoreError as e:
+            raise ConfigError(str(e))
+        return config
+        
+    def _load(self):
+        """Cache entry of the config file, parsed again only when the file has changed"""
+        try:
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None, {}, {}
+        # save_config() replaces the file, so a new inode also means a new config
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        
+        with _cache_lock:
+            cached = _cache.get(self.config_file)
+            if cached and cached[0] == identity:
+                return cached
+                
+            with open(self.config_file) as f:
+                try:
+                    config = json.load(f)
+                except ValueError as e:
+                    raise ConfigError(f"{self.config_file} is not valid JSON: {str(e)}")
+            config = self._resolve(config)
+            errors = validate_config(config)
+            if errors:
+                raise ConfigError(f"Invalid configuration in {self.config_file}:\n  " + "\n  ".join(errors))
+            cached = _cache[self.config_file] = (identity, config, self._index(config))
+            return cached
+            
+    def _index(self, config):
+        return {db_config["id"]: db_config for db_config in config.get("databases", [])}
         
     def load_config(self):
         """Load configuration from JSON file"""
-        if not self.config_file.exists():
+        return self._load()[1]
+        
+    def load_stored_config(self):
+        """The config file as stored, credentials kept in the keystore left as references"""
+        try:
+            with open(self.config_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
             return {}
-            
-        with open(self.config_file) as f:
-            return json.load(f)
+        except ValueError as e:
+            raise ConfigError(f"{self.config_file} is not valid JSON: {str(e)}")
             
     def save_config(self, config):
-        """Save configuration to JSON file"""
-        self.config_dir.mkdir(exist_ok=True)
+        """Save configuration to JSON file
         
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=4)
+        The config is validated first and written to a temporary file that
+        then replaces the old one, so a crash never leaves a partial file.
+        """
+        errors = validate_config(config)
+        if errors:
+            # The caller may have changed the cached config before saving it
+            with _cache_lock:
+                _cache.pop(self.config_file, None)
+            raise ConfigError("Invalid configuration:\n  " + "\n  ".join(errors))
+        stored = self._seal(config)
             
+        self.config_dir.mkdir(exist_ok=True)
+        temp_file = self.config_file.with_name(f".{self.config_file.name}.{os.getpid()}.tmp")
+        try:
+            mode = self.config_file.stat().st_mode & 0o777
+        except FileNotFoundError:
+            # It holds database and SMTP passwords
+            mode = 0o600
+            
+        with _cache_lock:
+            try:
+                fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(stored, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_file, self.config_file)
+            finally:
+                if temp_file.exists():
+                    temp_file.unlink()
+                    
+            dir_fd = os.open(self.config_dir, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+                
+            stat = self.config_file.stat()
+            # Cache a copy made from the file, not the caller's dict, which it may still change
+            config = json.loads(json.dumps(config))
+            _cache[self.config_file] = ((stat.st_ino, stat.st_mtime_ns, stat.st_size), config,
+                                        self._index(config))
+                                        
     def get_database_configs(self):
         """Get all database configurations"""
         config = self.load_config()
         return config.get("databases", [])
+        
+    def get_database_config(self, database_id):
+        """Database configuration with the given id, None if there is none"""
+        return self._load()[2].get(database_id)
@@ -0,0 +1,202 @@
+import threading
+import time
+from contextlib import contextmanager
+import mysql.connector
+from .fleet import DEFAULT_CONNECT_TIMEOUT
+
+SYSTEM_SCHEMAS = ['information_schema', 'performance_schema', 'mysql', 'sys']
+
+# Idle connections kept open per server account, unless the config sets "pool_size"
+DEFAULT_MAX_IDLE = 8
+# Idle connections older than this are pinged before reuse
+PING_AFTER_SECONDS = 30
+# Schema lists and table metadata are reused for this long unless the config sets "metadata_ttl"
+DEFAULT_METADATA_TTL = 300
+
+_pools = {}
+_metadata = {}
+_registry_lock = threading.Lock()
+
+
+def _server_key(db_config):
+    return (db_config["host"], int(db_config["port"]), db_config["username"])
+
+
+class ConnectionPool:
+    """Idle MySQL connections of one server account, reused across managers and threads
+
+    Connections are handed out exclusively and reset with COM_RESET_CONNECTION
+    when they come back, so session settings, locks and open transactions
+    never leak from one user to the next.
+    """
+
+    def __init__(self, db_config, max_idle=DEFAULT_MAX_IDLE):
+        self.db_config = db_config
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _open(self):
+        with self._lock:
+            self.opened += 1
+        return mysql.connector.connect(
+            host=self.db_config["host"],
+            user=self.db_config["username"],
+            password=self.db_config["password"],
+            port=self.db_config["port"],
+            connection_timeout=self.db_config.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT
+        )
+
+    def acquire(self, database=None):
+        """Check out a connection, using `database` as its default schema"""
+        conn = None
+        while conn is None:
+            with self._lock:
+                idle = self._idle.pop() if self._idle else None
+            if idle is None:
+                conn = self._open()
+            elif time.monotonic() - idle[1] <= PING_AFTER_SECONDS or idle[0].is_connected():
+                conn = idle[0]
+            # Otherwise the connection hit wait_timeout on the server, try the next one
+        if database:
+            conn.database = database
+        return conn
+
+    def release(self, conn):
+        """Return a connection, closing it if it can't be reset or enough are idle"""
+        try:
+            conn.reset_session()
+        except mysql.connector.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self, database=None):
+        conn = self.acquire(database)
+        try:
+            yield conn
+        except Exception:
+            # The session may be mid-statement or mid-transaction, don't reuse it
+            conn.close()
+            raise
+        self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+def get_pool(db_config):
+    """Shared pool for the server account of a database config"""
+    key = _server_key(db_config)
+    with _registry_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_config, db_config.get("pool_size", DEFAULT_MAX_IDLE))
+        return _pools[key]
+
+
+def close_all():
+    """Close every idle pooled connection"""
+    with _registry_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+
+class ConnectionManager:
+    """Pooled connections and cached server metadata for one database config
+
+    All managers talking to the same server account share one pool and one
+    metadata cache, so a backup cycle over many schemas of a host lists its
+    schemas and tables once per `metadata_ttl` seconds instead of per schema.
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.pool = get_pool(db_config)
+        self.ttl = db_config.get("metadata_ttl", DEFAULT_METADATA_TTL)
+
+    def connection(self, database=None):
+        """Context manager checking out a pooled connection"""
+        return self.pool.connection(database)
+
+    def _cached(self, name, load):
+        key = (_server_key(self.db_config), name)
+        with _registry_lock:
+            entry = _metadata.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        value = load()
+        with _registry_lock:
+            _metadata[key] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self):
+        """Forget cached metadata of this server, e.g. after a restore"""
+        server = _server_key(self.db_config)
+        with _registry_lock:
+            for key in [key for key in _metadata if key[0] == server]:
+                del _metadata[key]
+
+    def list_databases(self, include_system=False):
+        """Schemas on the server"""
+        def load():
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SHOW DATABASES")
+                databases = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+            return databases
+
+        databases = self._cached("databases", load)
+        if include_system:
+            return list(databases)
+        return [db for db in databases if db not in SYSTEM_SCHEMAS]
+
+    def table_metadata(self, schema=None):
+        """Tables per schema as {schema: [{name, type, engine, rows, data_bytes, index_bytes}]}
+
+        Row counts and sizes are information_schema estimates, good for
+        planning and sanity checks but not exact.
+        """
+        def load():
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_TYPE, ENGINE, COALESCE(TABLE_ROWS, 0), "
+                    "COALESCE(DATA_LENGTH, 0), COALESCE(INDEX_LENGTH, 0) FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA NOT IN (%s, %s, %s, %s)",
+                    tuple(SYSTEM_SCHEMAS)
+                )
+                tables = {}
+                for row in cursor.fetchall():
+                    tables.setdefault(row[0], []).append({
+                        "name": row[1],
+                        "type": row[2],
+                        "engine": row[3],
+                        "rows": int(row[4]),
+                        "data_bytes": int(row[5]),
+                        "index_bytes": int(row[6])
+                    })
+                cursor.close()
+            return tables
+
+        tables = self._cached("tables", load)
+        if schema is not None:
+            return tables.get(schema, [])
+        return tables
+
+    def schema_sizes(self):
+        """Estimated on-disk size of every schema, in bytes"""
+        return {
+            schema: sum(table["data_bytes"] + table["index_bytes"] for table in tables)
+            for schema, tables in self.table_metadata().items()
+        }
@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+# (low, high) bounds of the five cron fields: minute, hour, day of month, month, day of week
+FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+MONTH_NAMES = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+DAY_NAMES = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+MACROS = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *"
+}
+
+# An expression that matches nothing within this many years never will (e.g. "0 0 30 2 *")
+SEARCH_YEARS = 5
+
+
+class CronExpressionError(ValueError):
+    pass
+
+
+def _value(text, low, high, names):
+    if names and text.lower() in names:
+        return names.index(text.lower()) + low
+    if not text.isdigit() or not low <= int(text) <= high:
+        raise CronExpressionError(f"Invalid value '{text}', expected {low}-{high}")
+    return int(text)
+
+
+def parse_field(text, low, high, names=None):
+    """Set of values matched by one cron field, e.g. "*/15", "1-5" or "mon,wed" """
+    values = set()
+    for part in text.split(","):
+        base, _, step = part.partition("/")
+        if step and (not step.isdigit() or int(step) == 0):
+            raise CronExpressionError(f"Invalid step in '{part}'")
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start, end = (_value(value, low, high, names) for value in base.split("-", 1))
+            if start > end:
+                raise CronExpressionError(f"Invalid range '{base}'")
+        else:
+            start = end = _value(base, low, high, names)
+            if step:
+                end = high
+        values.update(range(start, end + 1, int(step or 1)))
+    return values
+
+
+def schedule_expression(schedule_config):
+    """Cron expression of a database schedule: its "cron" entry or its frequency and time"""
+    if schedule_config.get("cron"):
+        return CronExpression(schedule_config["cron"])
+    hour, minute = map(int, schedule_config.get("time", "00:00").split(":"))
+    frequency = schedule_config.get("frequency", "daily")
+    if frequency == "hourly":
+        return CronExpression(f"{minute} * * * *")
+    if frequency == "weekly":
+        return CronExpression(f"{minute} {hour} * * 0")
+    return CronExpression(f"{minute} {hour} * * *")
+
+
+class CronExpression:
+    """Standard five-field cron expression with names, ranges, steps and @macros
+
+    As in cron, when both day of month and day of week are restricted a day
+    matching either one matches.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        fields = MACROS.get(self.expression.lower(), self.expression).split()
+        if len(fields) != 5:
+            raise CronExpressionError(f"'{expression}' does not have five fields")
+        self.minutes = parse_field(fields[0], *FIELDS[0])
+        self.hours = parse_field(fields[1], *FIELDS[1])
+        self.days = parse_field(fields[2], *FIELDS[2])
+        self.months = parse_field(fields[3], *FIELDS[3], MONTH_NAMES)
+        # 7 is Sunday as well as 0
+        self.weekdays = {day % 7 for day in parse_field(fields[4], *FIELDS[4], DAY_NAMES)}
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    def __str__(self):
+        return self.expression
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, moment):
+        return (moment.month in self.months and self._day_matches(moment)
+                and moment.hour in self.hours and moment.minute in self.minutes)
+
+    def next_run(self, moment):
+        """First matching minute after `moment`"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * SEARCH_YEARS)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                month = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (month + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise CronExpressionError(f"'{self.expression}' never matches")
+
+    def last_run(self, moment):
+        """Latest matching minute at or before `moment`"""
+        candidate = moment.replace(second=0, microsecond=0)
+        limit = moment - timedelta(days=366 * SEARCH_YEARS)
+        while candidate > limit:
+            if candidate.month not in self.months:
+                candidate = candidate.replace(day=1, hour=0, minute=0) - timedelta(minutes=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) - timedelta(minutes=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) - timedelta(minutes=1)
+            elif candidate.minute not in self.minutes:
+                candidate -= timedelta(minutes=1)
+            else:
+                return candidate
+        raise CronExpressionError(f"'{self.expression}' never matches")
@@ -1,5 +1,6 @@
-import mysql.connector
 from rich.console import Console
+from .connection_manager import ConnectionManager
+from .engines import EngineError, get_engine
 
 console = Console()
 
@@ -12,25 +13,16 @@ class DatabaseManager:
         """List all available databases"""
         if self.type == "mysql":
             return self._list_mysql_databases()
-        # Add support for other databases here
-        return []
+        try:
+            return get_engine(self.config).list_databases()
+        except (EngineError, OSError) as e:
+            console.print(f"[red]Error connecting to {self.type}: {str(e)}[/red]")
+            return []
         
     def _list_mysql_databases(self):
         """List MySQL databases"""
         try:
-            conn = mysql.connector.connect(
-                host=self.config["host"],
-                user=self.config["username"],
-                password=self.config["password"],
-                port=self.config["port"]
-            )
-            cursor = conn.cursor()
-            cursor.execute("SHOW DATABASES")
-            databases = [db[0] for db in cursor.fetchall() 
-                       if db[0] not in ['information_schema', 'performance_schema', 'mysql', 'sys']]
-            cursor.close()
-            conn.close()
-            return databases
+            return ConnectionManager(self.config).list_databases()
         except Exception as e:
             console.print(f"[red]Error connecting to MySQL: {str(e)}[/red]")
             return []
@@ -0,0 +1,250 @@
+import re
+import subprocess
+import threading
+from .compression import CHUNK_SIZE, CompressedWriter, CompressionError, decompress_command
+from .encryption import EncryptionError, read_range
+
+# A member is closed at the next section that starts once it holds this much
+# uncompressed data, so small tables share one compressor run and large dumps
+# start few compressors
+MEMBER_BYTES = 64 * 1024 * 1024
+# Longest line that can still be a section marker
+MAX_MARKER_LINE = 1024
+
+# mysqldump starts every part of a dump with a comment naming it, and ends
+# the dump by restoring the session variables its header changed
+_MARKER = re.compile(
+    rb"\n(?:--\n)?(?:-- (Table structure for table|Dumping data for table|Temporary view structure for view|"
+    rb"Final view structure for view|Dumping routines for database|Dumping events for database) "
+    rb"(?:`((?:[^`\n]|``)*)`|'([^'\n]*)')|"
+    rb"(/\*!40103 SET TIME_ZONE=@OLD_TIME_ZONE \*/;|/\*!40101 SET SQL_MODE=@OLD_SQL_MODE \*/;))\n"
+)
+_KINDS = {
+    b"Table structure for table": "table",
+    b"Dumping data for table": "table",
+    b"Temporary view structure for view": "view",
+    b"Final view structure for view": "view",
+    b"Dumping routines for database": "routines",
+    b"Dumping events for database": "events"
+}
+
+
+class SectionParser:
+    """Splits a mysqldump stream into sections: header, one per table, view, routines and events, footer
+
+    feed() returns the data it was given as (section, bytes) pieces, where a
+    section is (number, kind, name) and the number grows with every new one.
+    The last line is held back until the next feed() or close(), in case it
+    is the start of a marker.
+    """
+
+    def __init__(self):
+        self.section = (0, "header", None)
+        self._pending = b""
+
+    def _section_of(self, match):
+        if match.group(4):
+            return "footer", None
+        if match.group(2) is not None:
+            name = match.group(2).replace(b"``", b"`")
+        else:
+            name = match.group(3)
+        return _KINDS[match.group(1)], name.decode("utf-8", "replace")
+
+    def feed(self, data):
+        data = self._pending + data
+        pieces = []
+        start = 0
+        for match in _MARKER.finditer(data):
+            kind, name = self._section_of(match)
+            # The data of a table continues its section, as the second footer line continues the footer
+            if (kind, name) == self.section[1:]:
+                continue
+            pieces.append((self.section, data[start:match.start() + 1]))
+            start = match.start() + 1
+            self.section = (self.section[0] + 1, kind, name)
+        cut = data.rfind(b"\n", start)
+        if cut < 0 or len(data) - cut > MAX_MARKER_LINE:
+            cut = len(data)
+        pieces.append((self.section, data[start:cut]))
+        self._pending = data[cut:]
+        return pieces
+
+    def close(self):
+        pending, self._pending = self._pending, b""
+        return [(self.section, pending)]
+
+
+class IndexedWriter:
+    """CompressedWriter for mysqldump output that records where every table is in the file
+
+    The dump is compressed as a series of independent members, each a
+    complete gzip, zstd or lz4 stream, so the file still decompresses as a
+    whole like any other. `sections` lists every section of the dump with the
+    offset and length of its member in the file, and its start and size in
+    the member's uncompressed data, which is all read_sections() needs to
+    extract one table without reading the rest.
+    """
+
+    def __init__(self, dest, codec, level=None, threads=None, command_prefix=None, member_bytes=MEMBER_BYTES):
+        self.dest = dest
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+        self.command_prefix = command_prefix
+        self.member_bytes = member_bytes
+        self.sections = []
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._parser = SectionParser()
+        self._number = None
+        self._member = None
+        self._member_raw = 0
+        self._member_sections = []
+
+    def write(self, data):
+        for section, piece in self._parser.feed(data):
+            self._write_piece(section, piece)
+        self.raw_bytes += len(data)
+        return len(data)
+
+    def _write_piece(self, section, piece):
+        number, kind, name = section
+        if number != self._number:
+            if self._member_raw >= self.member_bytes:
+                self._close_member()
+            self._number = number
+            entry = {"type": kind, "name": name, "start": self._member_raw, "size": 0}
+            self.sections.append(entry)
+            self._member_sections.append(entry)
+        if not piece:
+            return
+        if self._member is None:
+            self._member = CompressedWriter(self.dest, self.codec, self.level, self.threads, self.command_prefix)
+        self._member.write(piece)
+        self._member_raw += len(piece)
+        self.sections[-1]["size"] += len(piece)
+
+    def _close_member(self):
+        if self._member is None:
+            return
+        self._member.close()
+        for entry in self._member_sections:
+            entry.update(offset=self.compressed_bytes, length=self._member.compressed_bytes)
+        self.compressed_bytes += self._member.compressed_bytes
+        self._member = None
+        self._member_raw = 0
+        self._member_sections = []
+
+    def close(self):
+        for section, piece in self._parser.close():
+            self._write_piece(section, piece)
+        self._close_member()
+        self.sections = [entry for entry in self.sections if entry["size"]]
+
+    def abort(self):
+        if self._member is not None:
+            self._member.abort()
+            self._member = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._member is not None:
+            member, self._member = self._member, None
+            # Raises the error of the compressor or destination if that is what broke the write
+            member.__exit__(exc_type, exc, tb)
+
+
+def _feed(path, offset, length, stdin, errors):
+    """Copy `length` bytes of a file from `offset`, decrypted if it is encrypted, into a decompressor"""
+    try:
+        for data in read_range(path, offset, length):
+            stdin.write(data)
+    except (BrokenPipeError, ValueError):
+        # The reader had what it needed and stopped the decompressor
+        pass
+    except EncryptionError as e:
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def read_sections(path, codec, sections):
+    """Uncompressed data of `sections` of an IndexedWriter file, in file order
+
+    Only the members holding them are read, and each only up to the end of
+    the last section needed from it. Offsets are those of the compressed
+    stream, so for an encrypted file only the chunks holding a member are
+    decrypted.
+    """
+    members = {}
+    for entry in sections:
+        members.setdefault((entry["offset"], entry["length"]), []).append(entry)
+    for (offset, length), entries in sorted(members.items()):
+        entries.sort(key=lambda entry: entry["start"])
+        end = max(entry["start"] + entry["size"] for entry in entries)
+        decompress = subprocess.Popen(decompress_command(codec), stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        errors = []
+        feeder = threading.Thread(target=_feed, args=(path, offset, length, decompress.stdin, errors), daemon=True)
+        feeder.start()
+        position = 0
+        try:
+            while position < end:
+                data = decompress.stdout.read(min(CHUNK_SIZE, end - position))
+                if not data:
+                    break
+                for entry in entries:
+                    low = max(entry["start"], position)
+                    high = min(entry["start"] + entry["size"], position + len(data))
+                    if low < high:
+                        yield data[low - position:high - position]
+                position += len(data)
+        finally:
+            finished = position >= end
+            decompress.kill()
+            decompress.stdout.close()
+            decompress.wait()
+            feeder.join()
+        if errors:
+            raise errors[0]
+        if not finished:
+            raise CompressionError(f"Decompressing {path} failed at offset {offset}")
+
+
+class SectionFilter:
+    """Writer passing on only the header, footer and selected tables of a mysqldump stream
+
+    For dumps without an index, which have to be read from the start. The
+    names of the tables written are collected in `tables`.
+    """
+
+    def __init__(self, dest, schema, table_filter):
+        self.dest = dest
+        self.schema = schema
+        self.table_filter = table_filter
+        self.tables = set()
+        self._parser = SectionParser()
+
+    def _write_pieces(self, pieces):
+        for (_, kind, name), piece in pieces:
+            if kind == "table" and self.table_filter.matches(self.schema, name):
+                self.tables.add(name)
+            elif kind not in ("header", "footer"):
+                continue
+            if piece:
+                self.dest.write(piece)
+
+    def write(self, data):
+        self._write_pieces(self._parser.feed(data))
+        return len(data)
+
+    def close(self):
+        self._write_pieces(self._parser.close())
@@ -0,0 +1,291 @@
+import collections
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# An encrypted file starts with MAGIC, the id of the backup key and a salt
+MAGIC = b"CYBXENC1"
+HEADER_SIZE = len(MAGIC) + 8 + 16
+# Plaintext per chunk; every chunk is sealed on its own, with a 16 byte tag
+CHUNK_SIZE = 1024 * 1024
+TAG_SIZE = 16
+DEFAULT_THREADS = 4
+# Recorded in the metadata of encrypted backups
+CIPHER = "aes-256-gcm"
+
+
+class EncryptionError(Exception):
+    pass
+
+
+def _aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise EncryptionError("Encryption needs cryptography, install it with: pip install cybexdump[crypto]")
+    return AESGCM
+
+
+def key_id_of(key):
+    """Short id of a backup key, recorded in every file it encrypts"""
+    return hashlib.sha256(b"cybexdump backup key" + key).hexdigest()[:16]
+
+
+def _file_cipher(key, salt):
+    """AES-256-GCM with the key of one file, derived from the backup key and the file's salt"""
+    AESGCM = _aesgcm()
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    file_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b"cybexdump backup file").derive(key)
+    return AESGCM(file_key)
+
+
+def _nonce(index, final):
+    # The last chunk is sealed as such, so a file cut at a chunk boundary fails to decrypt
+    return index.to_bytes(11, "big") + (b"\x01" if final else b"\x00")
+
+
+def _backup_key(key_id=None):
+    from .keystore import Keystore, KeystoreError
+    try:
+        return Keystore().backup_key(key_id)
+    except KeystoreError as e:
+        raise EncryptionError(str(e))
+
+
+def current_key_id():
+    """Id of the key new backups are encrypted with; unlocks the keystore if it isn't yet"""
+    return _backup_key()[0]
+
+
+def encryption_settings(config, db_config):
+    """The "encryption" section of a database config over the one of the whole configuration"""
+    return dict(config.get("encryption") or {}, **(db_config.get("encryption") or {}))
+
+
+def encryption_enabled(settings):
+    return bool(settings and settings.get("enabled"))
+
+
+class EncryptingWriter:
+    """File-like writer sealing everything written into `dest` as AES-256-GCM chunks
+
+    Chunks are encrypted by `threads` threads at once and written in order,
+    so encryption keeps up with the compressor. Each chunk is authenticated
+    with its position and the file header, so chunks can't be reordered,
+    dropped or moved between files unnoticed.
+    """
+
+    def __init__(self, dest, threads=None, key=None):
+        key_id, key = (key_id_of(key), key) if key else _backup_key()
+        salt = os.urandom(16)
+        self.header = MAGIC + bytes.fromhex(key_id) + salt
+        self.key_id = key_id
+        self.dest = dest
+        self.threads = max(1, int(threads or DEFAULT_THREADS))
+        self._cipher = _file_cipher(key, salt)
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._index = 0
+        self._closed = False
+        self.dest.write(self.header)
+
+    def _seal(self, chunk, final):
+        future = self._executor.submit(self._cipher.encrypt, _nonce(self._index, final), chunk, self.header)
+        self._pending.append(future)
+        self._index += 1
+        # Bounded read-ahead: at most two chunks per thread in flight
+        while len(self._pending) > 2 * self.threads or (final and self._pending):
+            self.dest.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) > CHUNK_SIZE:
+            # The last chunk is only known at close(), so a full buffer waits for one more byte
+            full = (len(self._buffer) - 1) // CHUNK_SIZE
+            with memoryview(self._buffer) as view:
+                for i in range(full):
+                    self._seal(bytes(view[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]), False)
+                rest = bytearray(view[full * CHUNK_SIZE:])
+            self._buffer = rest
+        return len(data)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._seal(bytes(self._buffer), True)
+        finally:
+            self._executor.shutdown()
+
+    def abort(self):
+        self._closed = True
+        self._pending.clear()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+@contextmanager
+def encrypting(dest, settings):
+    """Writer encrypting into `dest` when the "encryption" `settings` enable it, else `dest` itself"""
+    if not encryption_enabled(settings):
+        yield dest
+        return
+    with EncryptingWriter(dest, settings.get("threads")) as writer:
+        yield writer
+
+
+def _read_header(f, name):
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or not header.startswith(MAGIC):
+        raise EncryptionError(f"{name} is not an encrypted backup")
+    key_id = header[len(MAGIC):len(MAGIC) + 8].hex()
+    _, key = _backup_key(key_id)
+    return header, _file_cipher(key, header[-16:])
+
+
+def _open_chunk(cipher, header, index, chunk, final, name):
+    try:
+        return cipher.decrypt(_nonce(index, final), chunk, header)
+    except Exception:
+        raise EncryptionError(f"{name} is damaged or truncated (chunk {index} failed authentication)")
+
+
+class DecryptingReader:
+    """File-like reader returning the plaintext of an encrypted backup read from `source`
+
+    Chunks are read ahead and decrypted by `threads` threads at once.
+    """
+
+    def __init__(self, source, threads=None, name="backup"):
+        self.source = source
+        self.name = name
+        self.threads = max(1, int(threads or DEFAULT_THREADS))
+        self.header, self._cipher = _read_header(source, name)
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._pending = collections.deque()
+        self._index = 0
+        self._next = source.read(CHUNK_SIZE + TAG_SIZE)
+        self._buffer = b""
+
+    def _fill(self):
+        while self._next and len(self._pending) < 2 * self.threads:
+            chunk, self._next = self._next, self.source.read(CHUNK_SIZE + TAG_SIZE)
+            self._pending.append(self._executor.submit(
+                _open_chunk, self._cipher, self.header, self._index, chunk, not self._next, self.name
+            ))
+            self._index += 1
+
+    def read(self, size=-1):
+        while not self._buffer or size < 0:
+            self._fill()
+            if not self._pending:
+                break
+            self._buffer += self._pending.popleft().result()
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._pending.clear()
+        self._executor.shutdown()
+
+
+def is_encrypted(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IsADirectoryError, FileNotFoundError):
+        return False
+
+
+@contextmanager
+def open_input(path, threads=None):
+    """Open a backup file for reading, decrypting it on the fly if it is encrypted
+
+    The file object yielded is a real file descriptor, so it can be passed
+    as stdin to a decompressor or client. For an encrypted file it is a pipe
+    that a background thread fills with the plaintext.
+    """
+    if not is_encrypted(path):
+        with open(path, 'rb') as f:
+            yield f
+        return
+
+    with open(path, 'rb') as f:
+        reader = DecryptingReader(f, threads, str(path))
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def feed():
+            try:
+                with os.fdopen(write_fd, 'wb') as pipe:
+                    while True:
+                        data = reader.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        pipe.write(data)
+            except BrokenPipeError:
+                # The reader stopped early; whatever it reports is the error
+                pass
+            except EncryptionError as e:
+                errors.append(e)
+            finally:
+                reader.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        pipe = os.fdopen(read_fd, 'rb')
+        try:
+            yield pipe
+        finally:
+            pipe.close()
+            feeder.join()
+            # A damaged file is the cause of whatever the consumer ran into
+            if errors:
+                raise errors[0]
+
+
+def read_range(path, offset, length):
+    """Plaintext bytes `offset` to `offset + length` of a backup file, encrypted or not, in pieces
+
+    Only the chunks holding the range are read and decrypted.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(offset)
+            while length > 0:
+                data = f.read(min(CHUNK_SIZE, length))
+                if not data:
+                    return
+                length -= len(data)
+                yield data
+            return
+
+        f.seek(0)
+        header, cipher = _read_header(f, str(path))
+        chunks = -(-(os.fstat(f.fileno()).st_size - HEADER_SIZE) // (CHUNK_SIZE + TAG_SIZE))
+        index = offset // CHUNK_SIZE
+        skip = offset - index * CHUNK_SIZE
+        f.seek(HEADER_SIZE + index * (CHUNK_SIZE + TAG_SIZE))
+        while length > 0 and index < chunks:
+            chunk = _open_chunk(cipher, header, index, f.read(CHUNK_SIZE + TAG_SIZE), index == chunks - 1, str(path))
+            data = chunk[skip:skip + length]
+            length -= len(data)
+            skip = 0
+            index += 1
+            yield data
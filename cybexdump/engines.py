@@ -0,0 +1,316 @@
+import os
+import re
+import subprocess
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote
+from .compression import (
+    CHUNK_SIZE, CODECS, CompressedWriter, HashingWriter, codec_extension, codec_for_file,
+    decompress_command, file_checksum
+)
+from .encryption import EncryptionError, encrypting, open_input
+from .fleet import ProcessTimeout
+from .storage import open_output
+
+DEFAULT_THREADS = 4
+
+
+class EngineError(Exception):
+    pass
+
+
+class BackupEngine:
+    """Backup and restore for one database server type
+
+    BackupManager plans one task per database and hands each to `backup()`,
+    then records the result in the catalog and applies retention and
+    notifications the same way for every engine. MySQL has its own code paths
+    in BackupManager; other server types plug in by subclassing this and
+    registering in ENGINES.
+    """
+
+    name = None
+    # Recorded as the backup's format in the catalog
+    backup_format = None
+    system_databases = ()
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.threads = max(1, int(db_config.get("threads") or DEFAULT_THREADS))
+        # Set by BackupManager from the config and its "fleet" and "encryption" sections
+        self.connect_timeout = db_config.get("connect_timeout")
+        self.dump_timeout = db_config.get("dump_timeout")
+        self.encryption = db_config.get("encryption")
+
+    def _run(self, cmd, env=None, timeout=None):
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise EngineError(f"{cmd[0]} timed out after {timeout}s")
+        if result.returncode != 0:
+            raise EngineError(result.stderr.decode(errors="replace").strip())
+        return result.stdout.decode("utf-8")
+
+    def schema_sizes(self):
+        """Size of every user database in bytes"""
+        raise NotImplementedError
+
+    def list_databases(self):
+        return sorted(self.schema_sizes())
+
+    def backup_path(self, backup_dir, name, codec):
+        """Path of a backup named `name` inside `backup_dir`"""
+        raise NotImplementedError
+
+    def backup(self, database, path, compression, storage=None, throttle=None):
+        """Back up `database` to `path` and copy it to the `storage` targets
+
+        `throttle` supplies the process priority and rate limits of the
+        config. Returns (stored bytes, raw bytes or None, checksums), where
+        checksums maps the name of every file written to its SHA-256.
+        """
+        raise NotImplementedError
+
+    def restore(self, path, database, jobs=None, source_database=None, table_filter=None):
+        """Restore a backup of `source_database` made by `backup()` into `database`
+
+        With `table_filter`, only the tables (or collections) it selects are
+        restored.
+        """
+        raise NotImplementedError
+
+
+@lru_cache(maxsize=None)
+def pg_dump_major_version():
+    """Major version of the installed pg_dump, 0 if it can't be run"""
+    try:
+        output = subprocess.run(["pg_dump", "--version"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout.decode()
+    except OSError:
+        return 0
+    match = re.search(r"(\d+)", output)
+    return int(match.group(1)) if match else 0
+
+
+class PostgreSQLEngine(BackupEngine):
+    """pg_dump directory format dumped and restored with N parallel jobs
+
+    Directory format writes one compressed file per table, which is what lets
+    both pg_dump and pg_restore work on several tables at once. pg_dump
+    writes those files itself, so they are never encrypted.
+    """
+
+    name = "postgresql"
+    backup_format = "pgdump"
+    system_databases = ("postgres", "template0", "template1")
+
+    def _env(self):
+        env = dict(os.environ, PGPASSWORD=str(self.db_config["password"]))
+        if self.connect_timeout:
+            env["PGCONNECT_TIMEOUT"] = str(int(self.connect_timeout))
+        return env
+
+    def _client_args(self):
+        return [
+            "-h", self.db_config["host"],
+            "-p", str(self.db_config["port"]),
+            "-U", self.db_config["username"]
+        ]
+
+    def _query(self, sql, database="postgres"):
+        output = self._run(["psql", *self._client_args(), "-d", database, "-At", "-F", "\t", "-c", sql],
+                           self._env())
+        return [line.split("\t") for line in output.splitlines() if line]
+
+    def schema_sizes(self):
+        rows = self._query(
+            "SELECT datname, pg_database_size(datname) FROM pg_database "
+            "WHERE datallowconn AND NOT datistemplate"
+        )
+        return {name: int(size) for name, size in rows if name not in self.system_databases}
+
+    def backup_path(self, backup_dir, name, codec):
+        return Path(backup_dir) / f"{name}.pgdump"
+
+    def _compress_option(self, compression):
+        codec = compression.get("codec", "gzip")
+        level = compression.get("level") or CODECS.get(codec, CODECS["gzip"])["default_level"]
+        if codec != "gzip" and pg_dump_major_version() >= 16:
+            # pg_dump 16 compresses directory format with lz4 and zstd too
+            return f"--compress={codec}:{level}"
+        return f"--compress={min(int(level), 9)}"
+
+    def backup(self, database, path, compression, storage=None, throttle=None):
+        # pg_dump reads and compresses by itself, so only its priority can be set
+        prefix = throttle.prefix if throttle else []
+        self._run(prefix + [
+            "pg_dump",
+            *self._client_args(),
+            "--format=directory",
+            f"--jobs={self.threads}",
+            self._compress_option(compression),
+            f"--file={path}",
+            database
+        ], self._env(), self.dump_timeout)
+        if storage:
+            # pg_dump writes the directory itself, so it is uploaded once complete
+            storage.upload(path)
+        files = list(Path(path).iterdir())
+        return sum(f.stat().st_size for f in files), None, {f.name: file_checksum(f) for f in files}
+
+    def _backup_tables(self, path):
+        """Names of the tables in a directory format backup, from its table of contents"""
+        output = self._run(["pg_restore", "--list", str(path)])
+        tables = []
+        for line in output.splitlines():
+            # "<id>; <oid> <oid> TABLE <schema> <name> <owner>", as opposed to "TABLE DATA ..."
+            fields = line.split()
+            if not line.startswith(";") and len(fields) == 7 and fields[3] == "TABLE":
+                tables.append(fields[5])
+        return tables
+
+    def restore(self, path, database, jobs=None, source_database=None, table_filter=None):
+        tables = []
+        if table_filter:
+            tables = [name for name in self._backup_tables(path)
+                      if table_filter.matches(source_database or database, name)]
+            if not tables:
+                raise EngineError("No table in the backup matches the table filters")
+        literal = "'" + database.replace("'", "''") + "'"
+        if not self._query(f"SELECT 1 FROM pg_database WHERE datname = {literal}"):
+            self._run(["createdb", *self._client_args(), database], self._env())
+        self._run([
+            "pg_restore",
+            *self._client_args(),
+            f"--jobs={jobs or self.threads}",
+            "--clean",
+            "--if-exists",
+            "--no-owner",
+            f"--dbname={database}",
+            *[f"--table={name}" for name in tables],
+            str(path)
+        ], self._env())
+
+
+class MongoDBEngine(BackupEngine):
+    """mongodump archives streamed through cybexdump's compressor
+
+    Collections are dumped in parallel into a single archive on stdout, which
+    is compressed as it streams, so no uncompressed copy ever touches disk.
+    """
+
+    name = "mongodb"
+    backup_format = "archive"
+    system_databases = ("admin", "config", "local")
+
+    def _uri(self):
+        user = quote(str(self.db_config.get("username") or ""), safe="")
+        password = quote(str(self.db_config.get("password") or ""), safe="")
+        credentials = f"{user}:{password}@" if user else ""
+        auth_source = self.db_config.get("auth_source", "admin")
+        options = f"?authSource={auth_source}"
+        if self.connect_timeout:
+            milliseconds = int(self.connect_timeout * 1000)
+            options += f"&connectTimeoutMS={milliseconds}&serverSelectionTimeoutMS={milliseconds}"
+        return f"mongodb://{credentials}{self.db_config['host']}:{self.db_config['port']}/{options}"
+
+    def schema_sizes(self):
+        output = self._run([
+            "mongosh", self._uri(), "--quiet", "--eval",
+            "db.adminCommand({listDatabases: 1}).databases"
+            ".forEach(d => print(d.name + '\\t' + d.sizeOnDisk))"
+        ])
+        sizes = {}
+        for line in output.splitlines():
+            name, _, size = line.partition("\t")
+            if size and name not in self.system_databases:
+                sizes[name] = int(float(size))
+        return sizes
+
+    def backup_path(self, backup_dir, name, codec):
+        return Path(backup_dir) / f"{name}.archive{codec_extension(codec)}"
+
+    def backup(self, database, path, compression, storage=None, throttle=None):
+        cmd = [
+            "mongodump",
+            f"--uri={self._uri()}",
+            f"--db={database}",
+            f"--numParallelCollections={self.threads}",
+            "--archive",
+            "--quiet"
+        ]
+        prefix = throttle.prefix if throttle else []
+        dump = subprocess.Popen(prefix + cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        source = throttle.reader(dump.stdout) if throttle else dump.stdout
+        timeout = ProcessTimeout(dump, self.dump_timeout)
+        try:
+            with timeout, open_output(path, storage) as f:
+                digest = HashingWriter(throttle.writer(f) if throttle else f)
+                with encrypting(digest, self.encryption) as sealed, CompressedWriter(
+                    sealed,
+                    compression.get("codec", "gzip"),
+                    compression.get("level"),
+                    compression.get("threads"),
+                    prefix
+                ) as writer:
+                    while True:
+                        data = source.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        writer.write(data)
+        finally:
+            dump.stdout.close()
+            stderr = dump.stderr.read()
+            dump.wait()
+        if timeout.expired:
+            raise EngineError(f"mongodump timed out after {self.dump_timeout}s")
+        if dump.returncode != 0:
+            raise EngineError(stderr.decode(errors="replace").strip())
+        return writer.compressed_bytes, writer.raw_bytes, {Path(path).name: digest.hexdigest()}
+
+    def restore(self, path, database, jobs=None, source_database=None, table_filter=None):
+        cmd = [
+            "mongorestore",
+            f"--uri={self._uri()}",
+            f"--numParallelCollections={jobs or self.threads}",
+            "--drop",
+            "--archive",
+            "--quiet"
+        ]
+        if source_database and source_database != database:
+            cmd += [f"--nsFrom={source_database}.*", f"--nsTo={database}.*"]
+        if table_filter:
+            # mongorestore namespace patterns only know the * wildcard
+            cmd += [f"--nsInclude={schema}.{table}" for schema, table in table_filter.include]
+            cmd += [f"--nsExclude={schema}.{table}" for schema, table in table_filter.exclude]
+        codec = codec_for_file(path)
+        try:
+            with open_input(path) as f:
+                if not codec:
+                    loaded = subprocess.run(cmd, stdin=f, stderr=subprocess.PIPE)
+                else:
+                    decompress = subprocess.Popen(decompress_command(codec), stdin=f, stdout=subprocess.PIPE)
+                    try:
+                        loaded = subprocess.run(cmd, stdin=decompress.stdout, stderr=subprocess.PIPE)
+                    finally:
+                        decompress.stdout.close()
+                        decompress.wait()
+                    if decompress.returncode != 0:
+                        raise EngineError(f"Decompressing {path} failed")
+        except EncryptionError as e:
+            raise EngineError(str(e))
+        if loaded.returncode != 0:
+            raise EngineError(loaded.stderr.decode(errors="replace").strip())
+
+
+ENGINES = {
+    "postgresql": PostgreSQLEngine,
+    "mongodb": MongoDBEngine
+}
+
+
+def get_engine(db_config):
+    """Engine for a non-MySQL database config"""
+    if db_config["type"] not in ENGINES:
+        raise EngineError(f"Unsupported database type: {db_config['type']}")
+    return ENGINES[db_config["type"]](db_config)
@@ -0,0 +1,109 @@
+import shutil
+import socket
+import threading
+from pathlib import Path
+
+# Seconds to wait for a database server to accept a connection, unless configured
+DEFAULT_CONNECT_TIMEOUT = 10
+# Configs planned at once; planning is mostly waiting on servers
+PLAN_THREADS = 16
+
+
+def fleet_settings(config, db_config):
+    """Connect and dump timeouts of a database config, falling back to the "fleet" section
+
+    A dump timeout of None or 0 lets dumps run as long as they take.
+    """
+    fleet = config.get("fleet", {})
+    return {
+        "connect_timeout": db_config.get("connect_timeout") or fleet.get("connect_timeout")
+        or DEFAULT_CONNECT_TIMEOUT,
+        "dump_timeout": db_config.get("dump_timeout") or fleet.get("dump_timeout") or None
+    }
+
+
+def probe(host, port, timeout):
+    """Why nothing accepts TCP connections on host:port within `timeout` seconds, None if something does"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return None
+    except socket.timeout:
+        return f"{host}:{port} unreachable (no answer within {timeout}s)"
+    except OSError as e:
+        return f"{host}:{port} unreachable ({e.strerror or str(e)})"
+
+
+class ProcessTimeout:
+    """Context manager killing a process still running `seconds` after it was entered
+
+    `expired` tells afterwards whether it was killed. With no `seconds`,
+    it does nothing.
+    """
+
+    def __init__(self, proc, seconds):
+        self.proc = proc
+        self.seconds = seconds
+        self.expired = False
+        self._timer = None
+
+    def _kill(self):
+        if self.proc.poll() is None:
+            self.expired = True
+            self.proc.kill()
+
+    def __enter__(self):
+        if self.seconds:
+            self._timer = threading.Timer(self.seconds, self._kill)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._timer:
+            self._timer.cancel()
+
+
+class VolumePlacer:
+    """Spreads the backup directories of database configs over the "volumes" of the fleet section
+
+    A config keeps the volume it was placed on: its "volume" setting, else
+    the volume that already has its directory. Only a new backup places a
+    config that is on no volume yet: it goes to the volume with the most free
+    space left once the backups planned on it so far are counted, and its
+    directory is created there right away.
+    """
+
+    def __init__(self, volumes):
+        self.volumes = [Path(volume) for volume in volumes]
+        self._planned = {}
+        self._lock = threading.Lock()
+
+    def _free(self, volume):
+        try:
+            return shutil.disk_usage(volume).free - self._planned.get(volume, 0)
+        except OSError:
+            # A volume that isn't mounted gets nothing new
+            return -1
+
+    def directory(self, db_config, place=False):
+        """Backup directory of a config; with `place`, one not on any volume yet is placed on one"""
+        name = str(db_config["id"])
+        if db_config.get("volume"):
+            return Path(db_config["volume"]) / name
+        with self._lock:
+            for volume in self.volumes:
+                if (volume / name).is_dir():
+                    return volume / name
+            if not place:
+                # Nothing of the config is anywhere; a path where nothing is, without choosing a volume
+                return self.volumes[0] / name
+            volume = max(self.volumes, key=self._free)
+            (volume / name).mkdir(parents=True, exist_ok=True)
+            return volume / name
+
+    def reserve(self, directory, size):
+        """Count `size` planned bytes against the volume holding `directory`"""
+        with self._lock:
+            for volume in self.volumes:
+                if Path(directory).parent == volume:
+                    self._planned[volume] = self._planned.get(volume, 0) + size
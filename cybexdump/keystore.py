@@ -0,0 +1,202 @@
+import base64
+import fcntl
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# The passphrase of the keystore, or a file holding it, for unattended runs
+PASSPHRASE_ENV = "CYBEXDUMP_PASSPHRASE"
+PASSPHRASE_FILE_ENV = "CYBEXDUMP_PASSPHRASE_FILE"
+KEYSTORE_FORMAT = 1
+# scrypt cost: about a tenth of a second, paid once per process
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+_ASSOCIATED_DATA = b"cybexdump keystore"
+
+# Opened keystores of this process: path -> (passphrase, secrets)
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+class KeystoreError(Exception):
+    pass
+
+
+def _crypto():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    except ImportError:
+        raise KeystoreError("The keystore needs cryptography, install it with: pip install cybexdump[crypto]")
+    return AESGCM, Scrypt
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+class Keystore:
+    """Credentials and backup encryption keys, encrypted with a passphrase
+
+    The keystore is a JSON file next to config.json holding one AES-256-GCM
+    encrypted object of named secrets, with its key derived from the
+    passphrase by scrypt. It is decrypted once per process for reading, and
+    read back under a lock file by every update. The passphrase comes from $CYBEXDUMP_PASSPHRASE, the file named by
+    $CYBEXDUMP_PASSPHRASE_FILE, or a prompt when running in a terminal.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or Path.home() / ".cybexdump" / "keystore.json")
+
+    def exists(self):
+        return self.path.exists()
+
+    def _passphrase(self):
+        if os.environ.get(PASSPHRASE_ENV):
+            return os.environ[PASSPHRASE_ENV]
+        if os.environ.get(PASSPHRASE_FILE_ENV):
+            try:
+                return Path(os.environ[PASSPHRASE_FILE_ENV]).read_text().rstrip("\n")
+            except OSError as e:
+                raise KeystoreError(f"Cannot read the keystore passphrase: {str(e)}")
+        if not sys.stdin.isatty():
+            raise KeystoreError(f"The keystore {self.path} is locked; set {PASSPHRASE_ENV} or {PASSPHRASE_FILE_ENV}")
+        from rich.prompt import Prompt
+        return Prompt.ask("Keystore passphrase", password=True)
+
+    def _key(self, passphrase, salt):
+        _, Scrypt = _crypto()
+        return Scrypt(salt=salt, length=32, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P).derive(passphrase.encode())
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            raise KeystoreError(f"No keystore at {self.path}, create one with: cybexdump keystore init")
+        except ValueError as e:
+            raise KeystoreError(f"{self.path} is not valid JSON: {str(e)}")
+        if stored.get("format") != KEYSTORE_FORMAT:
+            raise KeystoreError(f"Unsupported keystore format in {self.path}")
+        return stored
+
+    def _decrypt(self, stored, passphrase):
+        AESGCM, _ = _crypto()
+        kdf = stored["kdf"]
+        key = self._key(passphrase, base64.b64decode(kdf["salt"]))
+        try:
+            plaintext = AESGCM(key).decrypt(base64.b64decode(stored["nonce"]),
+                                            base64.b64decode(stored["ciphertext"]), _ASSOCIATED_DATA)
+        except Exception:
+            raise KeystoreError(f"Wrong passphrase for {self.path}, or the keystore is damaged")
+        return json.loads(plaintext)
+
+    def _open(self):
+        """(passphrase, secrets), decrypting the keystore the first time"""
+        with _opened_lock:
+            if self.path in _opened:
+                return _opened[self.path]
+            stored = self._load()
+            passphrase = self._passphrase()
+            _opened[self.path] = (passphrase, self._decrypt(stored, passphrase))
+            return _opened[self.path]
+
+    @contextmanager
+    def _locked(self):
+        """Lock file held while the keystore is read and rewritten, by any process"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f".{self.path.name}.lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, passphrase, secrets):
+        AESGCM, _ = _crypto()
+        salt, nonce = os.urandom(16), os.urandom(12)
+        ciphertext = AESGCM(self._key(passphrase, salt)).encrypt(nonce, json.dumps(secrets).encode(),
+                                                                 _ASSOCIATED_DATA)
+        stored = {
+            "format": KEYSTORE_FORMAT,
+            "kdf": {"name": "scrypt", "salt": _b64(salt), "n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P},
+            "nonce": _b64(nonce),
+            "ciphertext": _b64(ciphertext)
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        try:
+            fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(stored, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.path)
+        finally:
+            if temp_file.exists():
+                temp_file.unlink()
+        _opened[self.path] = (passphrase, secrets)
+
+    def create(self, passphrase):
+        """Create an empty keystore, with a new backup encryption key"""
+        with self._locked():
+            if self.exists():
+                raise KeystoreError(f"{self.path} already exists")
+            with _opened_lock:
+                self._write(passphrase, {})
+        self.new_backup_key()
+
+    def get(self, name):
+        secrets = self._open()[1]
+        if name not in secrets:
+            raise KeystoreError(f"Secret '{name}' is not in the keystore {self.path}")
+        return secrets[name]
+
+    def secrets(self):
+        """Copy of all named secrets"""
+        return dict(self._open()[1])
+
+    def _modify(self, change):
+        """Merge `change(secrets)` into the keystore and re-encrypt it
+
+        The secrets are read back from the file under the lock, so concurrent
+        updates from other processes are kept rather than overwritten.
+        """
+        passphrase = self._open()[0]
+        with self._locked():
+            secrets = self._decrypt(self._load(), passphrase)
+            secrets = dict(secrets, **change(secrets))
+            with _opened_lock:
+                self._write(passphrase, secrets)
+
+    def update(self, values):
+        """Store several secrets at once, re-encrypting the keystore"""
+        self._modify(lambda secrets: values)
+
+    def backup_key(self, key_id=None):
+        """(key id, key) of the backup encryption key in use, or of the one with `key_id`"""
+        secrets = self._open()[1]
+        keys = secrets.get("backup_keys", {})
+        key_id = key_id or secrets.get("backup_key_id")
+        if key_id not in keys:
+            raise KeystoreError(f"Backup key {key_id} is not in the keystore {self.path}")
+        return key_id, base64.b64decode(keys[key_id])
+
+    def add_backup_key(self, key, current=True):
+        """Store a backup encryption key, by default as the one new backups use; returns its id"""
+        from .encryption import key_id_of
+        key_id = key_id_of(key)
+
+        def change(secrets):
+            values = {"backup_keys": dict(secrets.get("backup_keys", {}), **{key_id: _b64(key)})}
+            if current or not secrets.get("backup_key_id"):
+                values["backup_key_id"] = key_id
+            return values
+
+        self._modify(change)
+        return key_id
+
+    def new_backup_key(self):
+        """Start encrypting new backups with a fresh key; older keys stay for restores"""
+        return self.add_backup_key(os.urandom(32))
@@ -0,0 +1,265 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from .config_manager import ConfigManager
+
+RUN_LOG_FILE = "runs.jsonl"
+STATE_FILE = "metrics.json"
+# The run log is rotated to runs.jsonl.1 once it grows past this
+RUN_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_PORT = 9101
+
+# name: (type, help) of everything exported to Prometheus
+METRICS = {
+    "cybexdump_runs_total": ("counter", "Runs by operation and status"),
+    "cybexdump_run_last_timestamp_seconds": ("gauge", "When the last run of an operation finished"),
+    "cybexdump_run_last_duration_seconds": ("gauge", "Wall time of the last run of an operation"),
+    "cybexdump_run_last_stage_seconds": ("gauge", "Time the last run of an operation spent per stage"),
+    "cybexdump_run_stage_seconds_total": ("counter", "Time spent per operation and stage"),
+    "cybexdump_backup_last_status": ("gauge", "1 if the last backup of a schema succeeded, else 0"),
+    "cybexdump_backup_last_success_timestamp_seconds": ("gauge", "When the last successful backup of a schema finished"),
+    "cybexdump_backup_last_duration_seconds": ("gauge", "Wall time of the last backup of a schema"),
+    "cybexdump_backup_last_size_bytes": ("gauge", "Stored size of the last backup of a schema"),
+    "cybexdump_backup_last_raw_bytes": ("gauge", "Uncompressed size of the last backup of a schema"),
+    "cybexdump_backup_last_throughput_bytes_per_second": ("gauge", "Uncompressed bytes per second of the last backup of a schema"),
+    "cybexdump_backup_last_compression_ratio": ("gauge", "Uncompressed over stored size of the last backup of a schema"),
+    "cybexdump_backup_last_stage_seconds": ("gauge", "Time the last backup of a schema waited on the dump (read) and on compression and uploads (write)"),
+    "cybexdump_backups_total": ("counter", "Schema backups by status"),
+    "cybexdump_backup_bytes_total": ("counter", "Stored bytes written by schema backups"),
+    "cybexdump_restore_last_duration_seconds": ("gauge", "Wall time of the last restore of a schema"),
+    "cybexdump_restore_last_status": ("gauge", "1 if the last restore of a schema succeeded, else 0"),
+    "cybexdump_schedule_last_delay_seconds": ("gauge", "How long after its scheduled slot a job last started"),
+    "cybexdump_schedule_skipped_total": ("counter", "Scheduled runs skipped because the previous run was still going"),
+    "cybexdump_verify_last_failed_backups": ("gauge", "Backups that failed the last verification run"),
+    "cybexdump_verified_backups_total": ("counter", "Backups verified by kind and status")
+}
+
+
+class RunMetrics:
+    """Timings and results of one operation: a backup run, a restore, a scheduled job
+
+    Stages are timed with `stage()`, which may be used from several threads;
+    time spent in the same stage adds up. finish() appends the run to the
+    JSON run log and folds it into the Prometheus metrics.
+    """
+
+    def __init__(self, operation, labels=None):
+        self.operation = operation
+        self.labels = labels or {}
+        self.started = datetime.now()
+        self.stages = {}
+        self.results = []
+        self.status = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.monotonic() - started)
+
+    def add_result(self, result):
+        with self._lock:
+            self.results.append(result)
+
+    def finish(self, status=None, config=None):
+        """Record the run; status defaults to failed if any result failed"""
+        if status is None:
+            failed = any(result.get("status") != "success" for result in self.results)
+            status = "failed" if failed else "success"
+        self.status = status
+        entry = {
+            "operation": self.operation,
+            "labels": self.labels,
+            "started": self.started.isoformat(),
+            "finished": datetime.now().isoformat(),
+            "seconds": round(time.monotonic() - self._started, 3),
+            "status": status,
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "results": self.results
+        }
+        record_run(entry, config)
+        return entry
+
+
+def _sample_key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def _fold(state, entry):
+    """Update gauges and counters in `state` from a finished run"""
+    def gauge(name, labels, value):
+        state[_sample_key(name, labels)] = value
+
+    def counter(name, labels, value=1):
+        key = _sample_key(name, labels)
+        state[key] = state.get(key, 0) + value
+
+    operation = {"operation": entry["operation"]}
+    counter("cybexdump_runs_total", dict(operation, status=entry["status"]))
+    gauge("cybexdump_run_last_timestamp_seconds", operation,
+          datetime.fromisoformat(entry["finished"]).timestamp())
+    gauge("cybexdump_run_last_duration_seconds", operation, entry["seconds"])
+    for stage, seconds in entry["stages"].items():
+        gauge("cybexdump_run_last_stage_seconds", dict(operation, stage=stage), seconds)
+        counter("cybexdump_run_stage_seconds_total", dict(operation, stage=stage), seconds)
+
+    if entry["operation"] == "verify":
+        gauge("cybexdump_verify_last_failed_backups", {},
+              sum(1 for result in entry["results"] if result["status"] != "success"))
+    for result in entry["results"]:
+        ok = result.get("status") == "success"
+        if entry["operation"] == "backup":
+            labels = {"database_id": str(result["database_id"]), "host": result["host"],
+                      "schema": result["schema"]}
+            gauge("cybexdump_backup_last_status", labels, 1 if ok else 0)
+            gauge("cybexdump_backup_last_duration_seconds", labels, result["seconds"])
+            counter("cybexdump_backups_total", dict(labels, status=result["status"]))
+            if not ok:
+                continue
+            gauge("cybexdump_backup_last_success_timestamp_seconds", labels,
+                  datetime.fromisoformat(result["finished"]).timestamp())
+            gauge("cybexdump_backup_last_size_bytes", labels, result["bytes"])
+            gauge("cybexdump_backup_last_raw_bytes", labels, result["raw_bytes"])
+            counter("cybexdump_backup_bytes_total", labels, result["bytes"])
+            if result["seconds"]:
+                gauge("cybexdump_backup_last_throughput_bytes_per_second", labels,
+                      (result["raw_bytes"] or result["bytes"]) / result["seconds"])
+            if result["bytes"] and result["raw_bytes"]:
+                gauge("cybexdump_backup_last_compression_ratio", labels, result["raw_bytes"] / result["bytes"])
+            for stage, seconds in result.get("stages", {}).items():
+                gauge("cybexdump_backup_last_stage_seconds", dict(labels, stage=stage), seconds)
+        elif entry["operation"] == "restore" and result["database_id"] is not None:
+            labels = {"database_id": str(result["database_id"]), "schema": result["schema"] or ""}
+            gauge("cybexdump_restore_last_duration_seconds", labels, result["seconds"])
+            gauge("cybexdump_restore_last_status", labels, 1 if ok else 0)
+        elif entry["operation"] == "schedule":
+            labels = {"database_id": str(result["database_id"]), "kind": result["kind"]}
+            if result.get("skipped"):
+                counter("cybexdump_schedule_skipped_total", labels)
+            else:
+                gauge("cybexdump_schedule_last_delay_seconds", labels, result["delay"])
+        elif entry["operation"] == "verify":
+            labels = {"kind": result["kind"] or "missing"}
+            counter("cybexdump_verified_backups_total", dict(labels, status=result["status"]))
+
+
+def render(state):
+    """Prometheus text exposition format of the metrics state"""
+    samples = {}
+    for key, value in state.items():
+        name, labels = json.loads(key)
+        samples.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        if name not in samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in sorted(samples[name]):
+            text = ",".join(
+                '{}="{}"'.format(label, str(label_value).replace("\\", "\\\\").replace('"', '\\"'))
+                for label, label_value in labels
+            )
+            value = repr(float(value)) if isinstance(value, float) else str(value)
+            lines.append(f"{name}{{{text}}} {value}" if text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _metrics_dir():
+    return ConfigManager().config_dir
+
+
+def load_state():
+    state_file = _metrics_dir() / STATE_FILE
+    if not state_file.exists():
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def _write_atomic(path, text):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f".{path.name}.tmp")
+    with open(temp, 'w') as f:
+        f.write(text)
+    os.replace(temp, path)
+
+
+def record_run(entry, config=None):
+    """Append a run to the JSON run log and update the metrics state and textfile
+
+    Processes started by cron and the daemon record runs concurrently, so
+    the update is done under a lock file.
+    """
+    if config is None:
+        config = ConfigManager().load_config()
+    metrics_config = config.get("metrics", {})
+    metrics_dir = _metrics_dir()
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    with open(metrics_dir / "metrics.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if metrics_config.get("run_log", True):
+            run_log = metrics_dir / RUN_LOG_FILE
+            if run_log.exists() and run_log.stat().st_size > RUN_LOG_MAX_BYTES:
+                os.replace(run_log, run_log.with_name(RUN_LOG_FILE + ".1"))
+            with open(run_log, 'a') as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+        state = load_state()
+        _fold(state, entry)
+        _write_atomic(metrics_dir / STATE_FILE, json.dumps(state))
+        if metrics_config.get("textfile"):
+            # node_exporter's textfile collector reads whole files, so replace it atomically
+            _write_atomic(Path(metrics_config["textfile"]).expanduser(), render(state))
+
+
+def recent_runs(limit=20, operation=None):
+    """Newest runs from the JSON run log"""
+    run_log = _metrics_dir() / RUN_LOG_FILE
+    if not run_log.exists():
+        return []
+    with open(run_log) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if operation:
+        entries = [entry for entry in entries if entry["operation"] == operation]
+    return entries[::-1][:limit]
+
+
+def serve(port=DEFAULT_PORT, address=""):
+    """Serve the metrics on /metrics until interrupted"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render(load_state()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
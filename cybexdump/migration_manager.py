@@ -13,8 +13,12 @@ class MigrationManager:
         self.config_manager = ConfigManager()
         
     def backup_configuration(self, backup_path=None):
-        """Backup entire configuration including settings and credentials"""
-        config = self.config_manager.load_config()
+        """Backup entire configuration including settings and credentials
+        
+        Credentials moved to the keystore stay references in the copy, so it
+        needs the keystore and its passphrase to be restored.
+        """
+        config = self.config_manager.load_stored_config()
         if not config:
             console.print("[yellow]No configuration found to backup[/yellow]")
             return False
@@ -31,6 +35,9 @@ class MigrationManager:
                 json.dump(config, f, indent=4)
                 
             console.print(f"[green]Configuration successfully backed up to: {backup_path}[/green]")
+            if self.config_manager.keystore.exists():
+                console.print(f"[yellow]Keep {self.config_manager.keystore.path} and its passphrase "
+                              f"with this backup: its credentials and backup keys are not in it[/yellow]")
             return True
         except Exception as e:
             console.print(f"[red]Failed to backup configuration: {str(e)}[/red]")
@@ -0,0 +1,558 @@
+import json
+import math
+import os
+import queue
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from pathlib import Path
+import mysql.connector
+from rich.console import Console
+from .binlog_manager import read_server_position
+from .connection_manager import ConnectionManager
+from .replica import replica_position
+from .compression import DEFAULT_CODEC, CompressedWriter, HashingWriter, codec_extension, file_checksum
+from .encryption import CIPHER, encrypting, encryption_enabled
+from .storage import open_output
+from .throttle import Throttle
+
+console = Console()
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT = "cybexdump-native"
+# Progress of an unfinished dump; replaced by the manifest once it completes
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_FORMAT = "cybexdump-native-checkpoint"
+DEFAULT_THREADS = 4
+DEFAULT_CHUNK_ROWS = 500000
+STATEMENT_SIZE = 1024 * 1024
+FETCH_ROWS = 1000
+
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+
+# Session settings written at the top of every data file so a restore
+# interprets the values exactly as they were read.
+FILE_HEADER = (
+    "/*!40101 SET NAMES utf8mb4 */;\n"
+    "SET time_zone='+00:00';\n"
+)
+
+_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "'": "\\'",
+    "\0": "\\0",
+    "\n": "\\n",
+    "\r": "\\r",
+    "\x1a": "\\Z"
+})
+
+
+def quote_identifier(name):
+    """Quote a MySQL identifier"""
+    return "`" + name.replace("`", "``") + "`"
+
+
+def sql_literal(value):
+    """Render a Python value returned by mysql.connector as a SQL literal"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, Decimal)):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (bytes, bytearray)):
+        return "X'" + bytes(value).hex() + "'" if value else "''"
+    if isinstance(value, datetime):
+        return "'" + value.isoformat(" ") + "'"
+    if isinstance(value, (date, dt_time)):
+        return "'" + value.isoformat() + "'"
+    if isinstance(value, timedelta):
+        micros = value // timedelta(microseconds=1)
+        sign = "-" if micros < 0 else ""
+        seconds, micros = divmod(abs(micros), 1000000)
+        text = f"{sign}{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+        if micros:
+            text += f".{micros:06d}"
+        return "'" + text + "'"
+    if isinstance(value, (set, frozenset)):
+        value = ",".join(sorted(value))
+    return "'" + str(value).translate(_ESCAPES) + "'"
+
+
+class NativeDumpError(Exception):
+    pass
+
+
+class NativeDumper:
+    """Table-level parallel dump of one MySQL schema
+
+    N connections share a single consistent snapshot: the snapshot
+    transactions are all opened while FLUSH TABLES WITH READ LOCK is held, and
+    the lock is released as soon as they exist. Large tables with a single
+    integer primary key are split into key-range chunks. Every table schema
+    and data chunk is written to its own compressed file and described in
+    manifest.json.
+
+    With `tables`, only those tables and views are dumped. `content` is
+    "schema" for the table definitions without rows, "data" for the rows
+    without routines, triggers, events or views, else "full".
+    """
+
+    def __init__(self, db_config, schema, output_dir, threads=None, chunk_rows=None, compression=None,
+                 storage=None, throttle=None, tables=None, content=None):
+        self.db_config = db_config
+        self.schema = schema
+        self.output_dir = Path(output_dir)
+        self.threads = max(1, int(threads or db_config.get("threads") or DEFAULT_THREADS))
+        self.chunk_rows = int(chunk_rows or db_config.get("chunk_rows") or DEFAULT_CHUNK_ROWS)
+        self.compression = compression or {}
+        # Every file is also streamed to the storage targets as it is written
+        self.storage = storage
+        # Rate limits and process priority, shared with the config's other dumps
+        self.throttle = throttle or Throttle(db_config)
+        self.codec = self.compression.get("codec", DEFAULT_CODEC)
+        # Set by BackupManager from the config and its "encryption" section
+        self.encryption = db_config.get("encryption")
+        self.extension = codec_extension(self.codec)
+        self.tables = set(tables) if tables is not None else None
+        self.content = content or "full"
+        # Seconds the chunks may take before the run stops, keeping its checkpoint
+        self.dump_timeout = db_config.get("dump_timeout")
+        # Tables and views of the schema left out by `tables`
+        self.ignored = []
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.binlog = None
+        # SHA-256 of every file written, by file name
+        self.checksums = {}
+        self.connections = ConnectionManager(db_config)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Check out a pooled connection; it goes back to the pool with release()"""
+        conn = self.connections.pool.acquire(self.schema)
+        cursor = conn.cursor()
+        cursor.execute("SET SESSION time_zone = '+00:00'")
+        cursor.close()
+        return conn
+
+    def _open_snapshot_connections(self):
+        """Open worker connections that all see the same snapshot"""
+        lock_conn = self._connect()
+        lock_cursor = lock_conn.cursor()
+        try:
+            lock_cursor.execute("FLUSH TABLES WITH READ LOCK")
+            locked = True
+        except mysql.connector.Error:
+            # Without RELOAD privilege the snapshots cannot be synchronised,
+            # so fall back to a single consistent connection.
+            locked = False
+            self.threads = 1
+
+        if locked:
+            # Nothing can commit while the lock is held, so these coordinates
+            # match the snapshot exactly. On a replica, they are those of its
+            # source, whose binlogs are the ones archived.
+            try:
+                if self.db_config.get("replica_of"):
+                    self.binlog = replica_position(lock_cursor)
+                else:
+                    self.binlog = read_server_position(lock_cursor)
+            except mysql.connector.Error as e:
+                console.print(f"[yellow]Cannot read the binlog position of {self.schema}, the backup has no "
+                              f"binlog coordinates: {str(e)}[/yellow]")
+
+        connections = []
+        try:
+            for _ in range(self.threads):
+                conn = self._connect()
+                cursor = conn.cursor()
+                cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                cursor.close()
+                connections.append(conn)
+        except Exception:
+            for conn in connections:
+                self.connections.pool.release(conn)
+            raise
+        finally:
+            if locked:
+                lock_cursor.execute("UNLOCK TABLES")
+            lock_cursor.close()
+            self.connections.pool.release(lock_conn)
+        return connections
+
+    @contextmanager
+    def _compressed_file(self, path):
+        """Compressed, and encrypted if configured, writer for a new file of the backup"""
+        with open_output(path, self.storage) as f:
+            digest = HashingWriter(self.throttle.writer(f))
+            with encrypting(digest, self.encryption) as sealed, CompressedWriter(
+                sealed,
+                self.codec,
+                self.compression.get("level"),
+                self.compression.get("threads"),
+                self.throttle.prefix
+            ) as writer:
+                yield writer
+        with self._lock:
+            self.checksums[Path(path).name] = digest.hexdigest()
+
+    def _write_file(self, name, text):
+        """Write a compressed text file into the backup directory"""
+        path = self.output_dir / f"{name}{self.extension}"
+        with self._compressed_file(path) as writer:
+            writer.write(text.encode("utf-8"))
+        self._count(writer)
+        return path.name
+
+    def _count(self, writer):
+        with self._lock:
+            self.raw_bytes += writer.raw_bytes
+            self.compressed_bytes += writer.compressed_bytes
+
+    def _list_tables(self, cursor):
+        cursor.execute(
+            "SELECT TABLE_NAME, TABLE_TYPE, COALESCE(TABLE_ROWS, 0), COALESCE(DATA_LENGTH, 0) "
+            "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s",
+            (self.schema,)
+        )
+        return cursor.fetchall()
+
+    def _dump_columns(self, cursor, table):
+        """Columns to select, leaving out generated columns"""
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND EXTRA NOT LIKE %s "
+            "ORDER BY ORDINAL_POSITION",
+            (self.schema, table, "%GENERATED%")
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _chunk_ranges(self, cursor, table, estimated_rows):
+        """Split a table into primary-key ranges, or one unbounded chunk"""
+        if estimated_rows <= self.chunk_rows:
+            return None, [None]
+
+        cursor.execute(
+            "SELECT k.COLUMN_NAME, c.DATA_TYPE "
+            "FROM information_schema.KEY_COLUMN_USAGE k "
+            "JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = k.TABLE_SCHEMA "
+            "AND c.TABLE_NAME = k.TABLE_NAME AND c.COLUMN_NAME = k.COLUMN_NAME "
+            "WHERE k.TABLE_SCHEMA = %s AND k.TABLE_NAME = %s AND k.CONSTRAINT_NAME = 'PRIMARY'",
+            (self.schema, table)
+        )
+        key_columns = cursor.fetchall()
+        if len(key_columns) != 1 or key_columns[0][1] not in INTEGER_TYPES:
+            return None, [None]
+
+        key = key_columns[0][0]
+        cursor.execute(f"SELECT MIN({quote_identifier(key)}), MAX({quote_identifier(key)}) "
+                       f"FROM {quote_identifier(table)}")
+        low, high = cursor.fetchone()
+        if low is None:
+            return None, [None]
+
+        chunks = max(1, math.ceil(estimated_rows / self.chunk_rows))
+        step = max(1, math.ceil((high - low + 1) / chunks))
+        ranges = [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+        return key, ranges
+
+    def _plan(self, cursor):
+        """Write schema files and return the data chunks to export, largest first"""
+        tables = {}
+        views = []
+        work = []
+
+        for name, table_type, estimated_rows, data_length in self._list_tables(cursor):
+            if self.tables is not None and name not in self.tables:
+                self.ignored.append(name)
+                continue
+            if table_type == "VIEW":
+                if self.content == "data":
+                    continue
+                cursor.execute(f"SHOW CREATE VIEW {quote_identifier(name)}")
+                views.append(cursor.fetchone()[1] + ";\n")
+                continue
+
+            cursor.execute(f"SHOW CREATE TABLE {quote_identifier(name)}")
+            create = cursor.fetchone()[1]
+            schema_file = self._write_file(
+                f"{self.schema}.{name}-schema.sql",
+                FILE_HEADER + f"DROP TABLE IF EXISTS {quote_identifier(name)};\n{create};\n"
+            )
+            columns = self._dump_columns(cursor, name)
+            key, ranges = self._chunk_ranges(cursor, name, estimated_rows)
+            tables[name] = {"schema_file": schema_file, "rows": 0, "key": key, "chunks": []}
+            if self.content == "schema":
+                continue
+
+            chunk_size = data_length / len(ranges)
+            for index, bounds in enumerate(ranges, 1):
+                work.append({
+                    "table": name,
+                    "index": index,
+                    "columns": columns,
+                    "key": key,
+                    "bounds": bounds,
+                    "size": chunk_size
+                })
+
+        work.sort(key=lambda item: item["size"], reverse=True)
+        return tables, views, work
+
+    def _write_rows(self, cursor, item, writer):
+        """Write the rows of one table chunk to `writer` as batched INSERT statements
+
+        Returns the number of rows. The output only depends on the rows, so
+        dumping a restored copy gives the same bytes as the original dump.
+        """
+        table = quote_identifier(item["table"])
+        columns = ", ".join(quote_identifier(column) for column in item["columns"])
+        query = f"SELECT {columns} FROM {table}"
+        params = ()
+        if item["bounds"] is not None:
+            key = quote_identifier(item["key"])
+            query += f" WHERE {key} BETWEEN %s AND %s"
+            params = tuple(item["bounds"])
+
+        prefix = f"INSERT INTO {table} ({columns}) VALUES\n"
+        rows = 0
+        cursor.execute(query, params)
+        statement = []
+        statement_size = 0
+        while True:
+            batch = cursor.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            for row in batch:
+                values = "(" + ",".join(sql_literal(value) for value in row) + ")"
+                statement.append(values)
+                statement_size += len(values)
+                rows += 1
+                if statement_size >= STATEMENT_SIZE:
+                    self.throttle.read.consume(statement_size)
+                    writer.write((prefix + ",\n".join(statement) + ";\n").encode("utf-8"))
+                    statement = []
+                    statement_size = 0
+        if statement:
+            self.throttle.read.consume(statement_size)
+            writer.write((prefix + ",\n".join(statement) + ";\n").encode("utf-8"))
+        return rows
+
+    def _dump_chunk(self, conn, item):
+        """Export one table chunk into its own compressed file"""
+        name = self._chunk_file(item)
+        cursor = conn.cursor()
+        with self._compressed_file(self.output_dir / name) as writer:
+            writer.write(FILE_HEADER.encode("utf-8"))
+            # Checksum of the rows alone, compared by `verify --sample` against a restored copy
+            rows_digest = HashingWriter(writer)
+            rows = self._write_rows(cursor, item, rows_digest)
+        cursor.close()
+        self._count(writer)
+        return {"file": name, "rows": rows, "bytes": writer.compressed_bytes, "raw_bytes": writer.raw_bytes,
+                "rows_checksum": rows_digest.hexdigest()}
+
+    def rows_checksum(self, conn, table, key=None, bounds=None):
+        """(rows, SHA-256) of a table chunk as _dump_chunk() would write it, read through `conn`
+
+        `conn` must use the +00:00 session time zone the dump was taken in.
+        """
+        cursor = conn.cursor()
+        item = {"table": table, "columns": self._dump_columns(cursor, table), "key": key, "bounds": bounds}
+        digest = HashingWriter()
+        rows = self._write_rows(cursor, item, digest)
+        cursor.close()
+        return rows, digest.hexdigest()
+
+    def _chunk_file(self, item):
+        return f"{self.schema}.{item['table']}.{item['index']:05d}.sql{self.extension}"
+
+    def _dump_post_schema(self):
+        """Routines, events and triggers, which must be created after the data is loaded"""
+        cmd = [
+            "mysqldump",
+            f"-h{self.db_config['host']}",
+            f"-P{self.db_config['port']}",
+            f"-u{self.db_config['username']}",
+            f"-p{self.db_config['password']}",
+            "--no-data",
+            "--no-create-info",
+            "--skip-opt",
+            "--routines",
+            "--triggers",
+            "--events",
+            self.schema
+        ]
+        # Triggers of tables left out would fail to restore
+        cmd[-1:-1] = [f"--ignore-table={self.schema}.{name}" for name in self.ignored]
+        dump = subprocess.run(self.throttle.command(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if dump.returncode != 0:
+            raise NativeDumpError(dump.stderr.decode(errors="replace").strip())
+        return self._write_file(f"{self.schema}-post-schema.sql", dump.stdout.decode("utf-8"))
+
+    def _save_checkpoint(self, checkpoint):
+        temp = self.output_dir / f"{CHECKPOINT_FILE}.tmp"
+        with open(temp, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp, self.output_dir / CHECKPOINT_FILE)
+
+    def _load_checkpoint(self):
+        """Checkpoint left in the output directory by a failed run, or None
+
+        Finished chunks whose file no longer matches its checksum are dropped,
+        so they are dumped again. If a schema file doesn't match, nothing of
+        the earlier run is reused.
+        """
+        path = self.output_dir / CHECKPOINT_FILE
+        if not path.exists():
+            return None
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("format") != CHECKPOINT_FORMAT or checkpoint["codec"] != self.codec:
+            return None
+        if checkpoint.get("content", "full") != self.content:
+            return None
+
+        def intact(name):
+            file = self.output_dir / name
+            return file.exists() and file_checksum(file) == checkpoint["checksums"].get(name)
+
+        if not all(intact(name) for name in checkpoint["plan_files"]):
+            return None
+        checkpoint["done"] = {name: chunk for name, chunk in checkpoint["done"].items() if intact(name)}
+        checkpoint["checksums"] = {name: checkpoint["checksums"][name]
+                                   for name in checkpoint["plan_files"] + list(checkpoint["done"])}
+        return checkpoint
+
+    def _add_chunk(self, tables, checkpoint, chunk):
+        """Add a finished chunk to its table and to the checkpoint"""
+        table = tables[chunk["table"]]
+        table["rows"] += chunk["rows"]
+        table["chunks"].append({key: value for key, value in chunk.items() if key != "table"})
+        checkpoint["done"][chunk["file"]] = chunk
+        checkpoint["checksums"][chunk["file"]] = self.checksums[chunk["file"]]
+
+    def run(self, resume=False):
+        """Dump the schema and return its manifest
+
+        Progress is checkpointed after every chunk. With `resume`, the
+        checkpoint of a failed run into the same directory is picked up and
+        only chunks it lacks, or whose files fail their checksum, are dumped.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        checkpoint = self._load_checkpoint() if resume else None
+        # Chunks of an earlier run were read in another snapshot
+        resumed = bool(checkpoint and checkpoint["done"])
+        connections = self._open_snapshot_connections()
+        errors = []
+        try:
+            if checkpoint:
+                create_database = checkpoint["create_database"]
+                tables, views = json.loads(json.dumps(checkpoint["tables"])), checkpoint["views"]
+                self.ignored = checkpoint.get("ignored", [])
+                self.checksums.update(checkpoint["checksums"])
+                for chunk in checkpoint["done"].values():
+                    self._add_chunk(tables, checkpoint, chunk)
+                    self.compressed_bytes += chunk["bytes"]
+                    self.raw_bytes += chunk.get("raw_bytes", 0)
+                work = [item for item in checkpoint["work"] if self._chunk_file(item) not in checkpoint["done"]]
+                console.print(f"[yellow]Resuming {self.schema}: {len(checkpoint['done'])} chunks already "
+                              f"done, {len(work)} to go[/yellow]")
+            else:
+                cursor = connections[0].cursor()
+                cursor.execute("SHOW CREATE DATABASE " + quote_identifier(self.schema))
+                create_database = cursor.fetchone()[1]
+                tables, views, work = self._plan(cursor)
+                cursor.close()
+                checkpoint = {
+                    "format": CHECKPOINT_FORMAT,
+                    "schema": self.schema,
+                    "codec": self.codec,
+                    "content": self.content,
+                    "create_database": create_database,
+                    "tables": json.loads(json.dumps(tables)),
+                    "views": views,
+                    "ignored": self.ignored,
+                    "work": work,
+                    "plan_files": list(self.checksums),
+                    "checksums": dict(self.checksums),
+                    "done": {}
+                }
+                self._save_checkpoint(checkpoint)
+
+            pending = queue.Queue()
+            for item in work:
+                pending.put(item)
+            deadline = time.monotonic() + self.dump_timeout if self.dump_timeout else None
+
+            def worker(conn):
+                while not errors:
+                    if deadline and time.monotonic() > deadline:
+                        errors.append(f"timed out after {self.dump_timeout}s, resume to dump the remaining chunks")
+                        return
+                    try:
+                        item = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        chunk = self._dump_chunk(conn, item)
+                    except Exception as e:
+                        errors.append(f"{item['table']} chunk {item['index']}: {str(e)}")
+                        return
+                    with self._lock:
+                        self._add_chunk(tables, checkpoint, dict(
+                            chunk, table=item["table"], index=item["index"], bounds=item["bounds"]
+                        ))
+                        self._save_checkpoint(checkpoint)
+
+            workers = [threading.Thread(target=worker, args=(conn,)) for conn in connections]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        finally:
+            for conn in connections:
+                # Resetting the session ends the snapshot transaction
+                self.connections.pool.release(conn)
+
+        if errors:
+            raise NativeDumpError("; ".join(errors))
+
+        for table in tables.values():
+            table["chunks"].sort(key=lambda chunk: chunk["index"])
+
+        if resumed:
+            console.print(f"[yellow]{self.schema} was dumped from two snapshots; the backup has no "
+                          f"binlog position and cannot be rolled forward with --until[/yellow]")
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": 1,
+            "schema": self.schema,
+            "created": datetime.now().isoformat(),
+            "codec": self.codec,
+            "create_database": self._write_file(
+                f"{self.schema}-schema-create.sql", create_database + ";\n"
+            ),
+            "tables": tables,
+            "views": self._write_file(f"{self.schema}-views.sql", "".join(views)) if views else None,
+            "post_schema": self._dump_post_schema() if self.content != "data" else None,
+            "content": self.content,
+            "binlog": None if resumed else self.binlog,
+            "resumed": resumed,
+            "encryption": {"cipher": CIPHER} if encryption_enabled(self.encryption) else None,
+            "checksums": self.checksums
+        }
+        with open(self.output_dir / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        (self.output_dir / CHECKPOINT_FILE).unlink()
+        if self.storage:
+            # Written last, so a target only has a complete backup once this is there
+            self.storage.upload(self.output_dir / MANIFEST_FILE)
+        return manifest
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import mysql.connector
+from rich.console import Console
+from .compression import CHUNK_SIZE, decompress_command, file_checksum
+from .encryption import EncryptionError, open_input
+from .config_manager import ConfigManager
+from .connection_manager import ConnectionManager
+from .native_dump import MANIFEST_FILE, MANIFEST_FORMAT, DEFAULT_THREADS, quote_identifier
+
+console = Console()
+
+DEFERRED_KEY_PREFIXES = ("KEY ", "UNIQUE KEY ", "FULLTEXT KEY ", "SPATIAL KEY ")
+
+# Progress of unfinished restores, one file per backup and target schema
+CHECKPOINT_DIR = "restores"
+
+# Applied to every loader session: constraint checks are deferred until the
+# indexes and foreign keys are added back after the data load.
+LOADER_INIT_COMMAND = "SET SESSION foreign_key_checks=0, unique_checks=0"
+
+
+class NativeRestoreError(Exception):
+    pass
+
+
+def split_create_table(create):
+    """Split a SHOW CREATE TABLE statement into a lean CREATE and deferred parts
+
+    Secondary indexes and foreign keys are removed from the CREATE statement and
+    returned separately so they can be built once, after the rows are loaded.
+    Keys covering the AUTO_INCREMENT column stay, as MySQL requires one.
+    """
+    lines = create.splitlines()
+    # Partition clauses can follow the closing parenthesis on further lines
+    close = max(i for i, line in enumerate(lines) if line.startswith(")"))
+    head, body, tail = lines[0], lines[1:close], "\n".join(lines[close:])
+    auto_increment = None
+    for line in body:
+        match = re.match(r"\s*(`(?:[^`]|``)+`) .*\bAUTO_INCREMENT\b", line)
+        if match:
+            auto_increment = match.group(1)
+
+    kept, indexes, foreign_keys = [], [], []
+    for line in body:
+        definition = line.strip().rstrip(",")
+        if definition.startswith(DEFERRED_KEY_PREFIXES) and not (
+            auto_increment and auto_increment in definition
+        ):
+            indexes.append(definition)
+        elif definition.startswith("CONSTRAINT ") and " FOREIGN KEY " in definition:
+            foreign_keys.append(definition)
+        else:
+            kept.append("  " + definition)
+
+    return "\n".join([head, ",\n".join(kept), tail]), indexes, foreign_keys
+
+
+def deferred_alters(table, definitions):
+    """ALTER TABLE statements adding deferred definitions back to a table
+
+    Everything goes into one ALTER, except FULLTEXT indexes: InnoDB builds
+    only one of those per ALTER (error 1795), so each gets its own.
+    """
+    fulltext = [d for d in definitions if d.startswith("FULLTEXT KEY ")]
+    others = [d for d in definitions if not d.startswith("FULLTEXT KEY ")]
+    groups = ([others] if others else []) + [[d] for d in fulltext]
+    return [f"ALTER TABLE {quote_identifier(table)} " + ", ".join(f"ADD {d}" for d in group) for group in groups]
+
+
+def wait_all(futures):
+    """Wait for `futures` in order; at the first failure, cancel those not started yet and raise it
+
+    Leaving a ThreadPoolExecutor block on an exception would otherwise run
+    every queued task first, e.g. keep loading tables into a failed restore.
+    """
+    try:
+        for future in futures:
+            future.result()
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+class NativeRestorer:
+    """Parallel restore of a native (per-table, chunked) backup
+
+    Data chunks are decompressed as a stream straight into `mysql` client
+    processes, `threads` at a time, largest tables first. Tables are created
+    without their secondary indexes and foreign keys; those are added back in
+    one ALTER per table once all rows are in (one per FULLTEXT index).
+
+    Every finished step is checkpointed under ~/.cybexdump/restores. With
+    `resume`, a failed restore of the same backup into the same schema
+    continues from there: chunks loaded from files that still match their
+    checksum are skipped, and rows of the chunks in between are deleted by
+    key range before those chunks are loaded again.
+
+    With `tables`, only those tables are restored, without views, routines
+    or triggers. A data-only backup is loaded into the tables as they are,
+    which must already exist.
+    """
+
+    def __init__(self, db_config, backup_dir, threads=None, target_schema=None, resume=False, tables=None):
+        self.db_config = db_config
+        self.backup_dir = Path(backup_dir)
+        with open(self.backup_dir / MANIFEST_FILE) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != MANIFEST_FORMAT:
+            raise NativeRestoreError(f"Unsupported backup format in {self.backup_dir}")
+        self.schema = target_schema or self.manifest["schema"]
+        self.threads = max(1, int(threads or db_config.get("threads") or DEFAULT_THREADS))
+        self.codec = self.manifest["codec"]
+        self.tables = {name: table for name, table in self.manifest["tables"].items()
+                       if tables is None or name in tables}
+        missing = set(tables or ()) - set(self.tables)
+        if missing:
+            raise NativeRestoreError(f"Tables not in the backup: {', '.join(sorted(missing))}")
+        self.connections = ConnectionManager(db_config)
+        self.resume = resume
+        key = f"{db_config['host']}:{db_config['port']}/{self.schema}|{self.backup_dir.resolve()}"
+        if tables is not None:
+            key += "|" + ",".join(sorted(self.tables))
+        self.checkpoint_file = (ConfigManager().config_dir / CHECKPOINT_DIR /
+                                f"{hashlib.sha1(key.encode()).hexdigest()}.json")
+        self._state = None
+        self._lock = threading.Lock()
+        self._progress = {}
+
+    def _connect(self, database=None):
+        """Context manager checking out a pooled connection"""
+        return self.connections.connection(database)
+
+    def _read_file(self, name):
+        """Decompress a small backup file into text"""
+        try:
+            with open_input(self.backup_dir / name) as f:
+                output = subprocess.run(decompress_command(self.codec), stdin=f,
+                                        stdout=subprocess.PIPE, check=True).stdout
+        except EncryptionError as e:
+            raise NativeRestoreError(str(e))
+        return output.decode("utf-8")
+
+    def _execute(self, conn, statements):
+        cursor = conn.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    def _load_file(self, name):
+        """Stream one compressed SQL file into a mysql client, returning raw bytes loaded"""
+        cmd = [
+            "mysql",
+            f"-h{self.db_config['host']}",
+            f"-P{self.db_config['port']}",
+            f"-u{self.db_config['username']}",
+            f"-p{self.db_config['password']}",
+            f"--init-command={LOADER_INIT_COMMAND}",
+            self.schema
+        ]
+        loaded = 0
+        try:
+            with open_input(self.backup_dir / name) as f:
+                decompress = subprocess.Popen(decompress_command(self.codec), stdin=f, stdout=subprocess.PIPE)
+                loader = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                try:
+                    while True:
+                        data = decompress.stdout.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        loader.stdin.write(data)
+                        loaded += len(data)
+                    loader.stdin.close()
+                except BrokenPipeError:
+                    pass
+                finally:
+                    decompress.stdout.close()
+                    decompress.wait()
+                    stderr = loader.stderr.read()
+                    loader.wait()
+        except EncryptionError as e:
+            raise NativeRestoreError(str(e))
+        if loader.returncode != 0:
+            raise NativeRestoreError(f"{name}: {stderr.decode(errors='replace').strip()}")
+        if decompress.returncode != 0:
+            raise NativeRestoreError(f"{name}: decompression failed")
+        return loaded
+
+    def _table_definitions(self):
+        """Lean CREATE statement, deferred indexes and deferred foreign keys of every table"""
+        definitions = {}
+        for name, table in self.tables.items():
+            text = self._read_file(table["schema_file"])
+            create = text[text.index("CREATE TABLE"):].rstrip().rstrip(";")
+            definitions[name] = split_create_table(create)
+        return definitions
+
+    def _create_tables(self, conn, definitions):
+        """Create every table without secondary indexes or foreign keys"""
+        for name, (lean_create, _, _) in definitions.items():
+            self._execute(conn, [
+                "SET SESSION foreign_key_checks=0",
+                f"DROP TABLE IF EXISTS {quote_identifier(name)}",
+                lean_create
+            ])
+
+    def _checksum(self, name):
+        """Checksum of a backup file, taken from the manifest when it has one"""
+        return self.manifest.get("checksums", {}).get(name) or file_checksum(self.backup_dir / name)
+
+    def _load_state(self):
+        """Checkpoint of an earlier attempt at this restore, or None"""
+        if not self.checkpoint_file.exists():
+            return None
+        with open(self.checkpoint_file) as f:
+            state = json.load(f)
+        # Chunks loaded from a file that has changed since count as not loaded
+        state["loaded"] = {name: checksum for name, checksum in state["loaded"].items()
+                           if (self.backup_dir / name).exists()
+                           and file_checksum(self.backup_dir / name) == checksum}
+        return state
+
+    def _save_state(self):
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.checkpoint_file.with_suffix(".tmp")
+        with open(temp, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(temp, self.checkpoint_file)
+
+    def _mark_done(self, step, name):
+        with self._lock:
+            self._state[step].append(name)
+            self._save_state()
+
+    def _clear_chunk(self, table, chunk):
+        """Delete rows a failed attempt may have loaded from a chunk"""
+        key = self.manifest["tables"][table].get("key")
+        with self._connect(self.schema) as conn:
+            if chunk.get("bounds") is not None and key:
+                cursor = conn.cursor()
+                cursor.execute(f"DELETE FROM {quote_identifier(table)} WHERE {quote_identifier(key)} "
+                               f"BETWEEN %s AND %s", tuple(chunk["bounds"]))
+                cursor.close()
+            else:
+                self._execute(conn, [f"TRUNCATE TABLE {quote_identifier(table)}"])
+
+    def _load_chunk(self, table, chunk, resumed=False):
+        if resumed:
+            self._clear_chunk(table, chunk)
+        loaded = self._load_file(chunk["file"])
+        checksum = self._checksum(chunk["file"])
+        with self._lock:
+            self._state["loaded"][chunk["file"]] = checksum
+            self._save_state()
+            progress = self._progress[table]
+            progress["bytes"] += loaded
+            progress["chunks_left"] -= 1
+            if progress["chunks_left"] == 0:
+                elapsed = time.monotonic() - progress["started"]
+                console.print(
+                    f"[green]Loaded {table}[/green]: {progress['rows']} rows, "
+                    f"{progress['bytes'] / 1024 / 1024:.1f} MB in {elapsed:.1f}s "
+                    f"({progress['bytes'] / 1024 / 1024 / max(elapsed, 0.001):.1f} MB/s)"
+                )
+
+    def _add_deferred(self, table, definitions, step):
+        """Add the deferred indexes or foreign keys of one table, in as few ALTERs as MySQL allows"""
+        if not definitions or table in self._state[step]:
+            return
+        with self._connect(self.schema) as conn:
+            started = time.monotonic()
+            self._execute(conn, ["SET SESSION foreign_key_checks=0"])
+            for i, statement in enumerate(deferred_alters(table, definitions)):
+                # A resumed restore must not add the indexes of finished ALTERs again
+                if f"{table}#{i}" not in self._state[step]:
+                    self._execute(conn, [statement])
+                    self._mark_done(step, f"{table}#{i}")
+            console.print(f"[blue]Built {len(definitions)} deferred definitions on {table} "
+                          f"in {time.monotonic() - started:.1f}s[/blue]")
+        self._mark_done(step, table)
+
+    def _create_views(self, views):
+        """Create views, retrying those that depend on views not created yet"""
+        with self._connect(self.schema) as conn:
+            while views:
+                failed = []
+                for view in views:
+                    try:
+                        self._execute(conn, [view])
+                    except mysql.connector.Error as e:
+                        failed.append(view)
+                        error = e
+                if len(failed) == len(views):
+                    raise NativeRestoreError(f"Could not create views: {str(error)}")
+                views = failed
+
+    def run(self):
+        """Restore the backup and return the total raw bytes loaded"""
+        started = time.monotonic()
+        original = self.manifest["schema"]
+
+        self._state = self._load_state() if self.resume else None
+        resumed = self._state is not None
+        if not resumed:
+            self._state = {"loaded": {}, "indexes": [], "foreign_keys": [], "steps": []}
+        data_only = self.manifest.get("content") == "data"
+        definitions = {} if data_only else self._table_definitions()
+        if "tables" not in self._state["steps"] and not data_only:
+            create_database = self._read_file(self.manifest["create_database"]).strip().rstrip(";")
+            create_database = re.sub(r"^CREATE DATABASE (/\*!32312 IF NOT EXISTS\*/ )?`(?:[^`]|``)+`",
+                                     "CREATE DATABASE IF NOT EXISTS " + quote_identifier(self.schema),
+                                     create_database)
+            with self._connect() as conn:
+                self._execute(conn, [create_database, "USE " + quote_identifier(self.schema)])
+                self._create_tables(conn, definitions)
+            # Nothing can be half loaded in freshly created tables
+            resumed = False
+            self._state["loaded"] = {}
+            self._mark_done("steps", "tables")
+
+        work = []
+        for name, table in self.tables.items():
+            chunks = [chunk for chunk in table["chunks"] if chunk["file"] not in self._state["loaded"]]
+            self._progress[name] = {
+                "rows": table["rows"],
+                "bytes": 0,
+                "chunks_left": len(chunks),
+                "started": None
+            }
+            for chunk in chunks:
+                work.append((name, chunk))
+        work.sort(key=lambda item: item[1]["bytes"], reverse=True)
+        if resumed:
+            console.print(f"[yellow]Resuming restore into {self.schema}: {len(self._state['loaded'])} "
+                          f"chunks already loaded, {len(work)} to go[/yellow]")
+
+        def load(item):
+            with self._lock:
+                if self._progress[item[0]]["started"] is None:
+                    self._progress[item[0]]["started"] = time.monotonic()
+            self._load_chunk(*item, resumed=resumed)
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            wait_all([executor.submit(load, item) for item in work])
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            wait_all([executor.submit(self._add_deferred, name, indexes, "indexes")
+                      for name, (_, indexes, _) in definitions.items()])
+        # Foreign keys of a partial restore could point at tables that aren't there
+        whole = len(self.tables) == len(self.manifest["tables"])
+        for name, (_, _, foreign_keys) in definitions.items():
+            self._add_deferred(name, foreign_keys if whole else [], "foreign_keys")
+
+        if whole and self.manifest.get("views") and "views" not in self._state["steps"]:
+            views = self._read_file(self.manifest["views"])
+            if self.schema != original:
+                views = views.replace(quote_identifier(original) + ".", quote_identifier(self.schema) + ".")
+            self._create_views([view for view in views.split(";\n") if view.strip()])
+            self._mark_done("steps", "views")
+        if whole and self.manifest.get("post_schema"):
+            self._load_file(self.manifest["post_schema"])
+        self.checkpoint_file.unlink()
+
+        total = sum(progress["bytes"] for progress in self._progress.values())
+        elapsed = time.monotonic() - started
+        console.print(f"[green]Restored {len(self.tables)} tables into {self.schema}: "
+                      f"{total / 1024 / 1024:.1f} MB in {elapsed:.1f}s "
+                      f"({total / 1024 / 1024 / max(elapsed, 0.001):.1f} MB/s)[/green]")
+        return total
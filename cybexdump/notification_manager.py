@@ -1,20 +1,50 @@
 from pathlib import Path
+import json
+import queue
 import smtplib
+import threading
+import urllib.request
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from .config_manager import ConfigManager
 
+WEBHOOK_TIMEOUT = 10
+SMTP_TIMEOUT = 30
+# Longest flush() waits for queued messages, so a stuck delivery can't hang a run
+FLUSH_TIMEOUT = 300
+
 class NotificationManager:
+    """Backup notifications by email and HTTP webhooks, delivered from a background thread
+    
+    send_backup_notification() only queues the message. A worker thread
+    delivers everything queued over one SMTP session, which is closed once
+    the queue runs dry. With "digest": true, results are collected instead
+    and flush() sends them as a single message. flush() also waits for the
+    queue to drain, so one-shot callers flush before they exit.
+    """
+    
     def __init__(self):
         self.config_manager = ConfigManager()
         self.config = self.config_manager.load_config()
         self.notification_config = self.config.get("notification", {})
+        self._queue = queue.Queue()
+        self._worker = None
+        self._digest = []
+        self._lock = threading.Lock()
+        self._smtp = None
         
     def send_backup_notification(self, success, database_name, error_message=None):
         """Send backup status notification"""
         if not self.notification_config.get("enabled"):
             return
             
+        result = {"database": database_name, "status": "success" if success else "failed",
+                  "error": error_message}
+        if self.notification_config.get("digest"):
+            with self._lock:
+                self._digest.append(result)
+            return
+            
         subject = f"Backup {'Success' if success else 'Failed'} - {database_name}"
         
         if success:
@@ -22,28 +52,120 @@ class NotificationManager:
         else:
             body = f"Database backup failed for {database_name}\nError: {error_message}"
             
-        self._send_email(subject, body)
+        self._enqueue(subject, body, [result])
+        
+    def _digest_message(self, results):
+        """Subject and body of one message covering many results, failures first"""
+        failed = [result for result in results if result["status"] != "success"]
+        succeeded = [result for result in results if result["status"] == "success"]
+        subject = f"Backup Digest - {len(succeeded)} succeeded, {len(failed)} failed"
+        lines = [f"FAILED  {result['database']}\n        Error: {result['error']}" for result in failed]
+        lines += [f"OK      {result['database']}" for result in succeeded]
+        return subject, "\n".join(lines)
+        
+    def flush(self, wait=True):
+        """Send the pending digest, then with `wait`, block until everything queued is delivered"""
+        with self._lock:
+            results, self._digest = self._digest, []
+        if results:
+            self._enqueue(*self._digest_message(results), results)
+        if wait and self._worker:
+            done = threading.Event()
+            self._queue.put(done)
+            if not done.wait(FLUSH_TIMEOUT):
+                print(f"Notifications still not delivered after {FLUSH_TIMEOUT} seconds, giving up waiting")
+            
+    def _enqueue(self, subject, body, results):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._deliver, daemon=True)
+                self._worker.start()
+        self._queue.put((subject, body, results))
+        
+    def _deliver(self):
+        """Worker thread: send queued messages, keeping the SMTP session open between them"""
+        while True:
+            item = self._queue.get()
+            if isinstance(item, threading.Event):
+                # flush() is waiting: everything before it has been sent
+                self._close_smtp()
+                item.set()
+                continue
+            subject, body, results = item
+            try:
+                if self.notification_config.get("email"):
+                    self._send_email(subject, body)
+                for webhook in self.notification_config.get("webhooks", []):
+                    self._send_webhook(webhook, subject, body, results)
+            except Exception as e:
+                # The worker must outlive any message, or flush() would wait for it forever
+                self._close_smtp()
+                print(f"Failed to send notification '{subject}': {str(e)}")
+            if self._queue.empty():
+                self._close_smtp()
+                
+    def _open_smtp(self):
+        server = smtplib.SMTP(
+            self.notification_config["smtp_server"],
+            self.notification_config.get("smtp_port", 587),
+            timeout=SMTP_TIMEOUT
+        )
+        if self.notification_config.get("smtp_starttls", True):
+            server.starttls()
+        if self.notification_config.get("smtp_password"):
+            server.login(
+                self.notification_config.get("smtp_username"),
+                self.notification_config["smtp_password"]
+            )
+        return server
+        
+    def _close_smtp(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            self._smtp.close()
+        except OSError:
+            pass
+        self._smtp = None
         
     def _send_email(self, subject, body):
-        """Send email using configured SMTP settings"""
+        """Send email using configured SMTP settings, over the open session if there is one"""
         msg = MIMEMultipart()
-        msg["From"] = self.notification_config["smtp_username"]
+        msg["From"] = self.notification_config.get("smtp_username")
         msg["To"] = self.notification_config["email"]
         msg["Subject"] = subject
         
         msg.attach(MIMEText(body, "plain"))
         
+        # A session left open may have been dropped by the server, so retry once on a new one
+        for attempt in range(2):
+            try:
+                if self._smtp is None:
+                    self._smtp = self._open_smtp()
+                self._smtp.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected as e:
+                self._smtp = None
+                error = e
+            except Exception as e:
+                self._close_smtp()
+                error = e
+                break
+        print(f"Failed to send notification email: {str(error)}")
+        
+    def _send_webhook(self, webhook, subject, body, results):
+        """POST a message to a webhook, as Slack-compatible {"text": ...} or as JSON with the results"""
+        if webhook.get("format") == "slack":
+            payload = {"text": f"*{subject}*\n{body}"}
+        else:
+            payload = {"subject": subject, "text": body, "results": results}
+        headers = dict(webhook.get("headers", {}), **{"Content-Type": "application/json"})
+        request = urllib.request.Request(webhook["url"], data=json.dumps(payload).encode("utf-8"),
+                                         headers=headers, method="POST")
         try:
-            server = smtplib.SMTP(
-                self.notification_config["smtp_server"],
-                self.notification_config["smtp_port"]
-            )
-            server.starttls()
-            server.login(
-                self.notification_config["smtp_username"],
-                self.notification_config["smtp_password"]
-            )
-            server.send_message(msg)
-            server.quit()
+            with urllib.request.urlopen(request, timeout=webhook.get("timeout", WEBHOOK_TIMEOUT)) as response:
+                response.read()
         except Exception as e:
-            print(f"Failed to send notification email: {str(e)}")
+            print(f"Failed to send notification to {webhook['url']}: {str(e)}")
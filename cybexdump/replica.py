@@ -0,0 +1,156 @@
+import threading
+import mysql.connector
+from .connection_manager import ConnectionManager
+
+# Seconds a replica may be behind its source and still be backed up, unless configured
+DEFAULT_MAX_LAG = 300
+
+# SHOW SLAVE STATUS column names, before MySQL 8.0.22 renamed them
+_OLD_NAMES = {
+    "Slave_IO_Running": "Replica_IO_Running",
+    "Slave_SQL_Running": "Replica_SQL_Running",
+    "Seconds_Behind_Master": "Seconds_Behind_Source",
+    "Relay_Master_Log_File": "Relay_Source_Log_File",
+    "Exec_Master_Log_Pos": "Exec_Source_Log_Pos"
+}
+
+# Replicas whose SQL thread this process has stopped: "host:port" -> [pauses, source position]
+_paused = {}
+_paused_lock = threading.Lock()
+
+
+class ReplicaError(Exception):
+    pass
+
+
+def _execute(cursor, statement, old_statement):
+    try:
+        cursor.execute(statement)
+    except mysql.connector.Error:
+        # Before MySQL 8.0.22
+        cursor.execute(old_statement)
+
+
+def replica_status(cursor):
+    """SHOW REPLICA STATUS as a dict with the current column names, None if the server is no replica"""
+    _execute(cursor, "SHOW REPLICA STATUS", "SHOW SLAVE STATUS")
+    row = cursor.fetchone()
+    names = [column[0] for column in cursor.description or []]
+    # Further rows are further sources of a multi-source replica
+    cursor.fetchall()
+    if not row:
+        return None
+    return {_OLD_NAMES.get(name, name): value for name, value in zip(names, row)}
+
+
+def replica_position(cursor):
+    """Binlog coordinates of the source up to which a replica has applied changes, None if it is no replica
+
+    These are the coordinates to replay the source's archived binlogs from
+    when a backup was taken on the replica.
+    """
+    status = replica_status(cursor)
+    if not status or not status.get("Relay_Source_Log_File"):
+        return None
+    gtid_set = status.get("Executed_Gtid_Set")
+    return {
+        "file": status["Relay_Source_Log_File"],
+        "position": int(status["Exec_Source_Log_Pos"]),
+        "gtid_set": gtid_set.replace("\n", "") if gtid_set else None
+    }
+
+
+class ReplicaSelector:
+    """Picks the replica of a MySQL database config to back up from
+
+    The config's "replicas" section lists the replica endpoints, with the
+    `max_lag` in seconds a replica may have. The replica with the least lag
+    whose IO and SQL threads are running is chosen. With `consistent`, its
+    SQL thread is stopped until resume() so every schema is dumped at the
+    same point of the source's history. Pauses are counted per replica, so
+    backups of several configs running at once from the same replica only
+    start its SQL thread again once the last of them resumes it.
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.settings = db_config.get("replicas") or {}
+        self.max_lag = self.settings.get("max_lag", DEFAULT_MAX_LAG)
+
+    def _endpoint_config(self, endpoint):
+        """The database config with a replica endpoint in place of the primary"""
+        return dict(
+            self.db_config,
+            host=endpoint["host"],
+            port=endpoint.get("port", self.db_config["port"]),
+            username=endpoint.get("username", self.db_config["username"]),
+            password=endpoint.get("password", self.db_config["password"]),
+            replica_of=f"{self.db_config['host']}:{self.db_config['port']}"
+        )
+
+    def _lag(self, server_config):
+        """Replication lag of a replica in seconds; raises ReplicaError when it doesn't qualify"""
+        try:
+            with ConnectionManager(server_config).connection() as conn:
+                cursor = conn.cursor()
+                status = replica_status(cursor)
+                cursor.close()
+        except mysql.connector.Error as e:
+            raise ReplicaError(str(e))
+        if not status:
+            raise ReplicaError("not a replica")
+        if status.get("Replica_IO_Running") != "Yes" or status.get("Replica_SQL_Running") != "Yes":
+            raise ReplicaError("replication is not running")
+        lag = status.get("Seconds_Behind_Source")
+        if lag is None:
+            raise ReplicaError("replication lag unknown")
+        if lag > self.max_lag:
+            raise ReplicaError(f"{lag}s behind its source, more than {self.max_lag}s")
+        return lag
+
+    def choose(self):
+        """(config of the least lagging replica or None, its lag, problems of the others by endpoint)"""
+        best, best_lag, problems = None, None, {}
+        for endpoint in self.settings.get("endpoints", []):
+            server_config = self._endpoint_config(endpoint)
+            name = f"{server_config['host']}:{server_config['port']}"
+            try:
+                lag = self._lag(server_config)
+            except ReplicaError as e:
+                problems[name] = str(e)
+                continue
+            if best is None or lag < best_lag:
+                best, best_lag = server_config, lag
+        return best, best_lag, problems
+
+    def _sql_thread(self, server_config, action):
+        try:
+            with ConnectionManager(server_config).connection() as conn:
+                cursor = conn.cursor()
+                _execute(cursor, f"{action} REPLICA SQL_THREAD", f"{action} SLAVE SQL_THREAD")
+                position = replica_position(cursor) if action == "STOP" else None
+                cursor.close()
+        except mysql.connector.Error as e:
+            raise ReplicaError(str(e))
+        return position
+
+    def pause(self, server_config):
+        """Stop the SQL thread of a replica; returns the source coordinates it stopped at"""
+        name = f"{server_config['host']}:{server_config['port']}"
+        with _paused_lock:
+            if name not in _paused:
+                _paused[name] = [0, self._sql_thread(server_config, "STOP")]
+            _paused[name][0] += 1
+            return _paused[name][1]
+
+    def resume(self, server_config):
+        """Start the SQL thread of a replica again, unless another backup still has it paused"""
+        name = f"{server_config['host']}:{server_config['port']}"
+        with _paused_lock:
+            if name not in _paused:
+                return
+            _paused[name][0] -= 1
+            if _paused[name][0]:
+                return
+            del _paused[name]
+            self._sql_thread(server_config, "START")
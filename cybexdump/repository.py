@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+REPOSITORY_DIR = "repository"
+REPOSITORY_FORMAT = "cybexdump-repository"
+MIN_CHUNK_SIZE = 448 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_LEVEL = 6
+# Chunks touched this recently are never garbage collected, which protects
+# chunks of a backup whose manifest has not been written yet.
+GC_GRACE_SECONDS = 6 * 3600
+
+# Content-defined boundaries are only placed between rows: at a line end or
+# at the "),(" between rows of an extended INSERT. Past MIN_CHUNK_SIZE, each
+# such candidate ends the chunk with a probability proportional to the length
+# of the row before it, decided by that row's CRC. A boundary therefore only
+# depends on the row in front of it, so an edit early in a dump leaves the
+# later chunk boundaries, and the chunks themselves, unchanged.
+_CANDIDATE = re.compile(rb"\n|\),\(")
+AVERAGE_EXTRA = 64 * 1024
+
+
+class RepositoryError(Exception):
+    pass
+
+
+class Chunker:
+    """Split a byte stream into content-defined chunks"""
+
+    def __init__(self, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+        self.min_size = min_size
+        self.max_size = max_size
+        self._buffer = bytearray()
+
+    def _boundary(self):
+        """Offset of the next content-defined boundary in the buffer, or None"""
+        buffer = self._buffer
+        previous = max(buffer.rfind(b"\n", 0, self.min_size) + 1,
+                       buffer.rfind(b"),(", 0, self.min_size) + 3)
+        for match in _CANDIDATE.finditer(buffer, self.min_size, self.max_size):
+            end = match.end()
+            size = end - previous
+            if size >= AVERAGE_EXTRA or zlib.crc32(buffer[previous:end]) < (size << 32) // AVERAGE_EXTRA:
+                return end
+            previous = end
+        return None
+
+    def _cut(self, final):
+        while len(self._buffer) > self.min_size or (final and self._buffer):
+            cut = self._boundary()
+            if cut is None:
+                if len(self._buffer) >= self.max_size:
+                    cut = self.max_size
+                elif final:
+                    cut = len(self._buffer)
+                else:
+                    return
+            chunk = bytes(self._buffer[:cut])
+            del self._buffer[:cut]
+            yield chunk
+
+    def feed(self, data):
+        """Add data, yielding every chunk that is now complete"""
+        self._buffer += data
+        yield from self._cut(final=False)
+
+    def finish(self):
+        """Yield whatever is left as the final chunks"""
+        yield from self._cut(final=True)
+
+
+class BackupRepository:
+    """Deduplicated backup store under `<backup_location>/repository`
+
+    Dump streams are split into content-defined chunks, and each chunk is
+    stored once under `chunks/` by its SHA-256, zlib compressed. A backup is a
+    small JSON manifest under `manifests/<database id>/` listing its chunks, so
+    retention deletes manifests and garbage collection removes chunks that no
+    manifest references any more.
+    """
+
+    def __init__(self, backup_location):
+        self.root = Path(backup_location) / REPOSITORY_DIR
+        self.chunk_dir = self.root / "chunks"
+        self.manifest_dir = self.root / "manifests"
+
+    def _chunk_path(self, digest):
+        return self.chunk_dir / digest[:2] / digest
+
+    def manifest_path(self, database_id, name):
+        return self.manifest_dir / str(database_id) / f"{name}.json"
+
+    def _store_chunk(self, chunk, level):
+        """Store one chunk unless it already exists, returning (digest, stored bytes)"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest)
+        if path.exists():
+            # Refresh the mtime so a concurrent garbage collection keeps it
+            os.utime(path)
+            return digest, 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = zlib.compress(chunk, level)
+        temp = path.with_name(f"{digest}.{os.getpid()}.{id(chunk)}.tmp")
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        return digest, len(data)
+
+    def writer(self, database_id, name, level=None, threads=None):
+        """Writer that chunks, deduplicates and stores a dump stream"""
+        return RepositoryWriter(self, database_id, name, level, threads)
+
+    def read_chunks(self, manifest):
+        """Yield the original data of a backup, chunk by chunk"""
+        for digest in manifest["chunks"]:
+            path = self._chunk_path(digest)
+            if not path.exists():
+                raise RepositoryError(f"Missing chunk {digest}")
+            with open(path, 'rb') as f:
+                chunk = zlib.decompress(f.read())
+            if hashlib.sha256(chunk).hexdigest() != digest:
+                raise RepositoryError(f"Corrupt chunk {digest}")
+            yield chunk
+
+    def manifests(self, database_id=None):
+        """Paths of all manifests, or of one database configuration"""
+        base = self.manifest_dir / str(database_id) if database_id is not None else self.manifest_dir
+        if not base.exists():
+            return []
+        return sorted(base.rglob("*.json"))
+
+    def load_manifest(self, path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != REPOSITORY_FORMAT:
+            raise RepositoryError(f"{path} is not a repository manifest")
+        return manifest
+
+    def gc(self):
+        """Delete chunks no manifest references, returning (chunks, bytes) freed"""
+        referenced = set()
+        for path in self.manifests():
+            referenced.update(self.load_manifest(path)["chunks"])
+
+        cutoff = time.time() - GC_GRACE_SECONDS
+        freed_chunks = freed_bytes = 0
+        if not self.chunk_dir.exists():
+            return 0, 0
+        for path in self.chunk_dir.glob("*/*"):
+            if path.name in referenced:
+                continue
+            stat = path.stat()
+            if stat.st_mtime < cutoff:
+                path.unlink()
+                freed_chunks += 1
+                freed_bytes += stat.st_size
+        return freed_chunks, freed_bytes
+
+
+class RepositoryWriter:
+    """File-like writer storing a stream in a BackupRepository
+
+    Chunks are compressed and stored by a small thread pool; zlib releases the
+    GIL, so compression runs on several cores while the dump keeps streaming.
+    """
+
+    def __init__(self, repository, database_id, name, level=None, threads=None):
+        self.repository = repository
+        self.path = repository.manifest_path(database_id, name)
+        self.level = int(level or DEFAULT_LEVEL)
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.metadata = {}
+        self._chunker = Chunker()
+        self._threads = max(1, int(threads or os.cpu_count() or 1))
+        self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._pending = []
+        self._chunks = []
+
+    def _submit(self, chunk):
+        self._pending.append(self._executor.submit(self.repository._store_chunk, chunk, self.level))
+        # Bound memory: wait for the oldest chunk once enough are in flight
+        while len(self._pending) > self._threads * 2:
+            self._collect(self._pending.pop(0))
+
+    def _collect(self, future):
+        digest, stored = future.result()
+        self._chunks.append(digest)
+        self.compressed_bytes += stored
+
+    def write(self, data):
+        self.raw_bytes += len(data)
+        for chunk in self._chunker.feed(data):
+            self._submit(chunk)
+        return len(data)
+
+    def close(self):
+        """Store the remaining chunks and write the manifest"""
+        for chunk in self._chunker.finish():
+            self._submit(chunk)
+        for future in self._pending:
+            self._collect(future)
+        self._pending = []
+        self._executor.shutdown()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        manifest = dict(self.metadata, format=REPOSITORY_FORMAT, size=self.raw_bytes, chunks=self._chunks)
+        manifest.setdefault("created", datetime.now().isoformat())
+        temp = self.path.with_suffix(".tmp")
+        with open(temp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp, self.path)
+        return manifest
+
+    def abort(self):
+        """Discard the backup; stored chunks are left for garbage collection"""
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+# Grandfather-father-son tiers, each keeping the newest backup of its last N periods
+TIERS = {
+    "hourly": lambda created: created.strftime("%Y-%m-%d %H"),
+    "daily": lambda created: created.date(),
+    "weekly": lambda created: created.isocalendar()[:2],
+    "monthly": lambda created: (created.year, created.month)
+}
+
+
+def _series(entry):
+    tables = entry.get("tables")
+    return entry["schema_name"], entry.get("content") or "full", tuple(tables) if tables is not None else None
+
+
+class RetentionPolicy:
+    """Which backups of a database config to keep
+
+    Every backup of the last `days` days is kept, and with N set for a tier,
+    the newest backup of each of the N most recent hours, days, ISO weeks or
+    months that have one, so a missed day does not shorten the history.
+    Every schema is its own series, and so are its schema-only, data-only
+    and table-filtered backups, so a partial dump never takes the place of
+    a full backup in a tier. Whatever the policy, the newest backup of each
+    schema, and its newest full backup, are always kept.
+    """
+
+    def __init__(self, days=0, hourly=0, daily=0, weekly=0, monthly=0):
+        self.days = days or 0
+        self.counts = {"hourly": hourly or 0, "daily": daily or 0, "weekly": weekly or 0, "monthly": monthly or 0}
+
+    @classmethod
+    def from_config(cls, db_config):
+        """Policy of a config's "schedule.retention_days" and "retention" section"""
+        tiers = db_config.get("retention") or {}
+        return cls(db_config["schedule"].get("retention_days"), **{tier: tiers.get(tier) for tier in TIERS})
+
+    def describe(self):
+        parts = [f"{self.days} days"] if self.days else []
+        parts += [f"{count} {tier}" for tier, count in self.counts.items() if count]
+        return ", ".join(parts) or "nothing"
+
+    def apply(self, entries, now=None):
+        """Split catalog entries into (kept, expired) in one pass, newest first
+
+        Kept entries get a "kept_by" list naming the rules that keep them.
+        """
+        cutoff = (now or datetime.now()) - timedelta(days=self.days)
+        # Per schema and tier: the periods that already have their backup
+        seen = {}
+        # Schemas whose newest backup, and newest full backup, were already met
+        newest = set()
+        kept, expired = [], []
+        for entry in sorted(entries, key=lambda entry: entry["created"], reverse=True):
+            created = datetime.fromisoformat(entry["created"])
+            reasons = ["days"] if self.days and created >= cutoff else []
+            series = _series(entry)
+            marks = {(series[0], "any")} | ({(series[0], "full")} if series[1:] == ("full", None) else set())
+            if not marks <= newest:
+                newest |= marks
+                reasons.append("newest")
+            for tier, count in self.counts.items():
+                if not count:
+                    continue
+                periods = seen.setdefault((series, tier), set())
+                period = TIERS[tier](created)
+                if period not in periods and len(periods) < count:
+                    periods.add(period)
+                    reasons.append(tier)
+            if reasons:
+                kept.append(dict(entry, kept_by=reasons))
+            else:
+                expired.append(entry)
+        return kept, expired
@@ -1,65 +1,294 @@
-from crontab import CronTab
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-import schedule
+import fcntl
+import json
+import os
+import random
 import time
 from pathlib import Path
+from rich.console import Console
 from .config_manager import ConfigManager
 from .backup_manager import BackupManager
+from .cron_expression import CronExpression, schedule_expression
+from .metrics import RunMetrics
+from .notification_manager import NotificationManager
+
+console = Console()
+
+# Seconds a scheduled run may be delayed by, so configs sharing a time don't all start at once
+DEFAULT_JITTER = 300
+# ... but never by more than this part of the time to the job's following run, so frequent
+# jobs neither skip a slot nor run twice in one
+JITTER_FRACTION = 0.25
+# Longest the daemon sleeps before re-checking due jobs
+POLL_SECONDS = 30
+# When each job was last dispatched, shared by the daemon and the supervisor
+DISPATCH_STATE_FILE = "dispatch.json"
+LOCK_DIR = "locks"
+SUPERVISOR_COMMAND = "cybexdump dispatch"
+
+
+def binlog_expression(db_config):
+    """Cron expression for binlog archiving: its own "cron" entry, else hourly at the backup minute"""
+    incremental = db_config.get("incremental", {})
+    if incremental.get("cron"):
+        return CronExpression(incremental["cron"])
+    minute = int(db_config["schedule"].get("time", "00:00").split(":")[1])
+    return CronExpression(f"{minute} * * * *")
+
+
+def next_due(cron, now, jitter):
+    """Next run of `cron` after `now`, delayed by a random part of `jitter` seconds
+
+    The delay is capped at JITTER_FRACTION of the time from that run to the
+    one after it, so a "*/5" job with the default jitter starts within 75
+    seconds of its slot.
+    """
+    fire = cron.next_run(now)
+    interval = (cron.next_run(fire) - fire).total_seconds()
+    return fire + timedelta(seconds=random.uniform(0, min(jitter, interval * JITTER_FRACTION)))
+
 
 class BackupScheduler:
     def __init__(self):
         self.config_manager = ConfigManager()
         self.backup_manager = BackupManager()
+        # Shared by the jobs of a cycle, created once jobs are run
+        self.notifications = None
+        
+    def setup_default_schedule(self, supervisor=None):
+        """Setup default schedule using crontab
+        
+        In supervisor mode a single entry runs `cybexdump dispatch` every
+        minute, which starts whatever is due from one process. Otherwise each
+        database config gets its own entries.
+        """
+        from crontab import CronTab
         
-    def setup_default_schedule(self):
-        """Setup default schedule using crontab"""
         config = self.config_manager.load_config()
+        if supervisor is None:
+            supervisor = config.get("daemon", {}).get("supervisor", False)
         cron = CronTab(user=True)
         
         # Remove existing cybexdump jobs
         cron.remove_all(comment='cybexdump')
         
-        for db_config in config.get("databases", []):
-            frequency = db_config["schedule"]["frequency"]
-            time_parts = db_config["schedule"]["time"].split(":")
-            hour, minute = map(int, time_parts)
+        if supervisor:
+            job = cron.new(command=SUPERVISOR_COMMAND, comment='cybexdump')
+            job.setall("* * * * *")
+            cron.write()
+            return
             
+        for db_config in config.get("databases", []):
             job = cron.new(command=f'cybexdump backup --database-id {db_config["id"]}',
                           comment='cybexdump')
-                          
-            if frequency == "hourly":
-                job.hour.every(1)
-            elif frequency == "daily":
-                job.hour.on(hour)
-                job.minute.on(minute)
-            elif frequency == "weekly":
-                job.dow.on(0)  # Sunday
-                job.hour.on(hour)
-                job.minute.on(minute)
+            job.setall(str(schedule_expression(db_config["schedule"])))
+            
+            if db_config.get("incremental", {}).get("enabled"):
+                job = cron.new(command=f'cybexdump backup --incremental --database-id {db_config["id"]}',
+                              comment='cybexdump')
+                job.setall(str(binlog_expression(db_config)))
                 
         cron.write()
         
-    def run_continuous(self):
-        """Run backup scheduler in continuous mode"""
+    def _jobs(self, config):
+        """One backup job per database config, plus one binlog job where incremental is on"""
+        jobs = []
+        for db_config in config.get("databases", []):
+            database_id = db_config["id"]
+            host = f"{db_config['host']}:{db_config['port']}"
+            jobs.append({
+                "key": (database_id, "backup"),
+                "host": host,
+                "cron": schedule_expression(db_config["schedule"]),
+                "run": lambda database_id=database_id: self.backup_manager.perform_backups(
+                    [database_id], notifications=self.notifications
+                )
+            })
+            
+            if db_config.get("incremental", {}).get("enabled"):
+                jobs.append({
+                    "key": (database_id, "binlogs"),
+                    "host": host,
+                    "cron": binlog_expression(db_config),
+                    "run": lambda database_id=database_id: self.backup_manager.archive_binlogs([database_id])
+                })
+        return jobs
+        
+    def _take_due(self, jobs, now):
+        """Jobs whose latest scheduled slot has not been dispatched yet, marked as dispatched
+        
+        Without a dispatch record, a backup counts as done if the catalog has
+        one taken since its last slot. The state file is locked, so concurrent
+        supervisors never start the same slot twice.
+        """
+        state_file = self.config_manager.config_dir / DISPATCH_STATE_FILE
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(state_file.with_suffix(".lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = {}
+            if state_file.exists():
+                with open(state_file) as f:
+                    state = json.load(f)
+                    
+            due = []
+            for job in jobs:
+                database_id, kind = job["key"]
+                key = f"{database_id}:{kind}"
+                last = state.get(key)
+                if last is None and kind == "backup":
+                    latest = self.backup_manager.catalog.latest(database_id=database_id, complete=False)
+                    last = latest["created"] if latest else None
+                if last is None or datetime.fromisoformat(last) < job["cron"].last_run(now):
+                    due.append(job)
+                    state[key] = now.isoformat()
+                    
+            with open(state_file, 'w') as f:
+                json.dump(state, f, indent=4)
+        return due
+        
+    def _run_job(self, job):
+        """Run a job unless another process is already running it
+        
+        Each run is recorded with how long after its scheduled slot it started.
+        """
+        database_id, kind = job["key"]
+        now = datetime.now()
+        run = RunMetrics("schedule", {"database_id": database_id, "kind": kind})
+        result = {"database_id": database_id, "kind": kind, "skipped": False,
+                  "delay": round((now - job["cron"].last_run(now)).total_seconds(), 3)}
+        lock_file = self.config_manager.config_dir / LOCK_DIR / f"{database_id}-{kind}.lock"
+        lock_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_file, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                console.print(f"[yellow]Skipping {kind} of configuration {database_id}, "
+                              f"previous run still in progress[/yellow]")
+                self._record_skip(job)
+                return None
+            run.add_result(result)
+            try:
+                with run.stage("run"):
+                    outcome = job["run"]()
+            except Exception:
+                run.finish("failed")
+                raise
+            failed = isinstance(outcome, list) and any(item["status"] != "success" for item in outcome)
+            run.finish("failed" if failed else "success")
+            return outcome
+            
+    def _record_skip(self, job):
+        database_id, kind = job["key"]
+        run = RunMetrics("schedule", {"database_id": database_id, "kind": kind})
+        run.add_result({"database_id": database_id, "kind": kind, "skipped": True})
+        run.finish("skipped")
+        
+    def _start_queued(self, executor, queue, running, host_running, host_jobs, global_jobs):
+        """Hand queued jobs to the pool while their host and the pool have free slots"""
+        for job in list(queue):
+            if len(running) >= global_jobs:
+                break
+            if host_running.get(job["host"], 0) >= host_jobs:
+                continue
+            queue.remove(job)
+            host_running[job["host"]] = host_running.get(job["host"], 0) + 1
+            running[executor.submit(self._run_job, job)] = job
+            
+    def _finish(self, done, running, host_running):
+        for future in done:
+            job = running.pop(future)
+            host_running[job["host"]] -= 1
+            if future.exception():
+                console.print(f"[red]Scheduled {job['key'][1]} of configuration {job['key'][0]} "
+                              f"failed: {str(future.exception())}[/red]")
+                              
+    def _limits(self, config, jobs, global_jobs):
+        daemon_config = config.get("daemon", {})
+        return (jobs or daemon_config.get("host_jobs") or 1,
+                global_jobs or daemon_config.get("max_jobs") or os.cpu_count() or 1)
+                
+    def dispatch(self, jobs=None, global_jobs=None):
+        """Run every job that is due and return the number started
+        
+        The supervisor cron entry calls this every minute, so all configs are
+        served by one process under the same per-host and global limits.
+        """
         config = self.config_manager.load_config()
+        host_jobs, global_jobs = self._limits(config, jobs, global_jobs)
+        queue = self._take_due(self._jobs(config), datetime.now())
+        started = len(queue)
+        self.notifications = NotificationManager()
         
-        for db_config in config.get("databases", []):
-            frequency = db_config["schedule"]["frequency"]
-            time_str = db_config["schedule"]["time"]
+        running = {}
+        host_running = {}
+        with ThreadPoolExecutor(max_workers=global_jobs) as executor:
+            while queue or running:
+                self._start_queued(executor, queue, running, host_running, host_jobs, global_jobs)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                self._finish(done, running, host_running)
+        # Everything dispatched this minute is one cycle, and one digest
+        self.notifications.flush()
+        return started
+        
+    def run_continuous(self, jobs=None, global_jobs=None, jitter=None, catch_up=True):
+        """Run backup scheduler in continuous mode
+        
+        Due jobs are queued and handed to a thread pool, with at most `jobs`
+        running per host and `global_jobs` overall. A job that comes due while
+        its previous run is still going is skipped until its next slot. Each
+        run starts up to `jitter` seconds late, see next_due().
+        """
+        config = self.config_manager.load_config()
+        host_jobs, global_jobs = self._limits(config, jobs, global_jobs)
+        if jitter is None:
+            jitter = config.get("daemon", {}).get("jitter_seconds", DEFAULT_JITTER)
             
-            if frequency == "hourly":
-                schedule.every().hour.at(time_str).do(
-                    self.backup_manager.perform_backup, db_config["id"]
-                )
-            elif frequency == "daily":
-                schedule.every().day.at(time_str).do(
-                    self.backup_manager.perform_backup, db_config["id"]
-                )
-            elif frequency == "weekly":
-                schedule.every().sunday.at(time_str).do(
-                    self.backup_manager.perform_backup, db_config["id"]
-                )
+        entries = self._jobs(config)
+        if not entries:
+            console.print("[yellow]No databases configured for backup[/yellow]")
+            return
+            
+        now = datetime.now()
+        missed = self._take_due(entries, now) if catch_up else []
+        for job in entries:
+            if job in missed:
+                console.print(f"[yellow]{job['key'][1].capitalize()} of configuration {job['key'][0]} "
+                              f"missed its {job['cron'].last_run(now):%Y-%m-%d %H:%M} run, catching up[/yellow]")
+                job["due"] = now + timedelta(seconds=random.uniform(0, min(jitter, POLL_SECONDS)))
+            else:
+                job["due"] = next_due(job["cron"], now, jitter)
+        console.print(f"[green]Scheduler started with {len(entries)} jobs, {host_jobs} per host, "
+                      f"{global_jobs} overall[/green]")
+        self.notifications = NotificationManager()
+                      
+        queue = []
+        running = {}
+        host_running = {}
+        with ThreadPoolExecutor(max_workers=global_jobs) as executor:
+            while True:
+                now = datetime.now()
+                busy = {job["key"] for job in queue} | {job["key"] for job in running.values()}
+                for job in entries:
+                    if job["due"] > now:
+                        continue
+                    if job["key"] in busy:
+                        console.print(f"[yellow]Skipping {job['key'][1]} of configuration {job['key'][0]}, "
+                                      f"previous run still in progress[/yellow]")
+                        self._record_skip(job)
+                    elif job in missed or self._take_due([job], now):
+                        queue.append(job)
+                    job["due"] = next_due(job["cron"], now, jitter)
+                missed = []
                 
-        while True:
-            schedule.run_pending()
-            time.sleep(60)
+                self._start_queued(executor, queue, running, host_running, host_jobs, global_jobs)
+                timeout = min([POLL_SECONDS] + [(job["due"] - now).total_seconds() for job in entries])
+                if running:
+                    done, _ = wait(running, timeout=max(timeout, 1), return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(max(timeout, 1))
+                    done = set()
+                self._finish(done, running, host_running)
+                if done and not queue and not running:
+                    # A cycle ends when the last of its jobs is done; send its digest
+                    self.notifications.flush(wait=False)
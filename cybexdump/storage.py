@@ -0,0 +1,536 @@
+import os
+import posixpath
+import shutil
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from .compression import copy_stream
+
+DEFAULT_UPLOAD_THREADS = 4
+# S3 parts must be at least 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# The part size doubles every this many parts, so a stream of any size stays
+# under S3's limit of 10,000 parts per object
+PARTS_PER_SIZE = 1000
+PARTIAL_SUFFIX = ".part"
+
+
+class StorageError(Exception):
+    pass
+
+
+@contextmanager
+def _storage_errors(name):
+    """Report errors of the client libraries as StorageError"""
+    try:
+        yield
+    except StorageError:
+        raise
+    except Exception as e:
+        raise StorageError(f"{name}: {str(e)}") from e
+
+
+class TeeWriter:
+    """File-like writer copying everything written to several writers"""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def write(self, data):
+        for writer in self.writers:
+            writer.write(data)
+        return len(data)
+
+
+class StorageTarget:
+    """A place backups are copied to, addressed by '/'-separated keys
+
+    A key names a file, or a directory when other keys start with it plus a
+    '/'. Subclasses implement open_writer, list_keys, _get and delete.
+    """
+
+    def __init__(self, target_config):
+        self.config = target_config
+        self.name = target_config.get("name") or target_config["type"]
+        self.upload_threads = max(1, int(target_config.get("upload_threads") or DEFAULT_UPLOAD_THREADS))
+
+    def open_writer(self, key):
+        """Writer for the file `key`; it only appears once the writer is closed, abort() discards it"""
+        raise NotImplementedError
+
+    def list_keys(self, key):
+        """`key` itself if it is a file, else every file below it"""
+        raise NotImplementedError
+
+    def _get(self, key, path):
+        raise NotImplementedError
+
+    def upload_file(self, path, key):
+        writer = self.open_writer(key)
+        try:
+            with open(path, 'rb') as f:
+                copy_stream(f, writer)
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
+
+    def download(self, key, path):
+        """Copy the file or directory `key` to `path`, returning False if it doesn't exist"""
+        keys = self.list_keys(key)
+        for found in keys:
+            dest = Path(path) if found == key else Path(path) / found[len(key) + 1:]
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            self._get(found, dest)
+        return bool(keys)
+
+    def delete(self, key):
+        """Remove the file or directory `key`"""
+        raise NotImplementedError
+
+
+class _LocalWriter:
+    def __init__(self, path):
+        self.path = path
+        self._partial = path.with_name(path.name + PARTIAL_SUFFIX)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._partial, 'wb')
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        self._file.close()
+        if self._partial.exists():
+            self._partial.unlink()
+
+
+class LocalTarget(StorageTarget):
+    """Another directory, typically a mounted NAS or external disk"""
+
+    def __init__(self, target_config):
+        super().__init__(target_config)
+        self.root = Path(target_config["path"]).expanduser()
+
+    def _path(self, key):
+        return self.root / key
+
+    def open_writer(self, key):
+        return _LocalWriter(self._path(key))
+
+    def list_keys(self, key):
+        path = self._path(key)
+        if path.is_file():
+            return [key]
+        if not path.is_dir():
+            return []
+        return sorted(f"{key}/{f.relative_to(path).as_posix()}" for f in path.rglob("*") if f.is_file())
+
+    def _get(self, key, path):
+        shutil.copyfile(self._path(key), path)
+
+    def delete(self, key):
+        path = self._path(key)
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+
+class _SFTPWriter:
+    def __init__(self, target, path):
+        self.path = path
+        self._partial = path + PARTIAL_SUFFIX
+        self._target = target
+        self._client = target._connect()
+        try:
+            with _storage_errors(target.name):
+                self._sftp = self._client.open_sftp()
+                target._makedirs(self._sftp, posixpath.dirname(path))
+                self._file = self._sftp.open(self._partial, 'wb')
+                # Don't wait for each write to be acknowledged
+                self._file.set_pipelined(True)
+        except StorageError:
+            self._client.close()
+            raise
+
+    def write(self, data):
+        with _storage_errors(self._target.name):
+            self._file.write(data)
+        return len(data)
+
+    def close(self):
+        try:
+            with _storage_errors(self._target.name):
+                self._file.close()
+                self._sftp.posix_rename(self._partial, self.path)
+        finally:
+            self._client.close()
+
+    def abort(self):
+        try:
+            self._file.close()
+            self._sftp.remove(self._partial)
+        except Exception:
+            pass
+        finally:
+            self._client.close()
+
+
+class SFTPTarget(StorageTarget):
+    """A directory on an SSH server; needs paramiko"""
+
+    def __init__(self, target_config):
+        super().__init__(target_config)
+        self.root = target_config.get("path", ".")
+
+    def _connect(self):
+        try:
+            import paramiko
+        except ImportError:
+            raise StorageError("SFTP storage needs paramiko, install it with: pip install cybexdump[sftp]")
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        if self.config.get("accept_unknown_host"):
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with _storage_errors(self.name):
+            client.connect(
+                self.config["host"],
+                port=int(self.config.get("port", 22)),
+                username=self.config.get("username"),
+                password=self.config.get("password"),
+                key_filename=self.config.get("key_file")
+            )
+        return client
+
+    @contextmanager
+    def _sftp(self):
+        client = self._connect()
+        try:
+            with _storage_errors(self.name):
+                yield client.open_sftp()
+        finally:
+            client.close()
+
+    def _path(self, key):
+        return posixpath.join(self.root, key)
+
+    def _makedirs(self, sftp, path):
+        if not path or path in ("/", "."):
+            return
+        try:
+            sftp.stat(path)
+        except IOError:
+            self._makedirs(sftp, posixpath.dirname(path))
+            sftp.mkdir(path)
+
+    def open_writer(self, key):
+        return _SFTPWriter(self, self._path(key))
+
+    def _walk(self, sftp, path, key):
+        try:
+            attributes = sftp.stat(path)
+        except IOError:
+            return []
+        if not stat.S_ISDIR(attributes.st_mode):
+            return [key]
+        keys = []
+        for entry in sftp.listdir_attr(path):
+            keys += self._walk(sftp, posixpath.join(path, entry.filename), f"{key}/{entry.filename}")
+        return keys
+
+    def list_keys(self, key):
+        with self._sftp() as sftp:
+            return sorted(self._walk(sftp, self._path(key), key))
+
+    def _get(self, key, path):
+        with self._sftp() as sftp:
+            sftp.get(self._path(key), str(path))
+
+    def _delete(self, sftp, path):
+        try:
+            attributes = sftp.stat(path)
+        except IOError:
+            return
+        if stat.S_ISDIR(attributes.st_mode):
+            for entry in sftp.listdir_attr(path):
+                self._delete(sftp, posixpath.join(path, entry.filename))
+            sftp.rmdir(path)
+        else:
+            sftp.remove(path)
+
+    def delete(self, key):
+        with self._sftp() as sftp:
+            self._delete(sftp, self._path(key))
+
+
+class MultipartWriter:
+    """File-like writer uploading a stream to S3 as it is produced
+
+    Every full part is handed to a pool of `threads` uploaders while the
+    caller keeps writing. At most `threads` parts are held in memory, so a
+    slow link slows the dump down instead of buffering it. Streams smaller
+    than one part are sent with a single PUT.
+    """
+
+    def __init__(self, target, key, part_size, threads):
+        self.target = target
+        self.key = key
+        self.part_size = part_size
+        self._threads = threads
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._parts = []
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def _client(self):
+        return self.target._client()
+
+    def _send(self, body):
+        if self._upload_id is None:
+            with _storage_errors(self.target.name):
+                self._upload_id = self._client().create_multipart_upload(
+                    Bucket=self.target.bucket, Key=self.key
+                )["UploadId"]
+            self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._slots.acquire()
+        failed = [part for part in self._parts if part.done() and part.exception()]
+        if failed:
+            self._slots.release()
+            raise failed[0].exception()
+        number = len(self._parts) + 1
+        self._parts.append(self._executor.submit(self._upload_part, number, body))
+        if number % PARTS_PER_SIZE == 0:
+            self.part_size *= 2
+
+    def _upload_part(self, number, body):
+        try:
+            with _storage_errors(self.target.name):
+                response = self._client().upload_part(
+                    Bucket=self.target.bucket, Key=self.key, UploadId=self._upload_id,
+                    PartNumber=number, Body=body
+                )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            self._slots.release()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._send(part)
+        return len(data)
+
+    def close(self):
+        """Upload what is left and complete the object"""
+        if self._upload_id is None:
+            with _storage_errors(self.target.name):
+                self._client().put_object(Bucket=self.target.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        try:
+            if self._buffer:
+                self._send(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [part.result() for part in self._parts]
+            self._executor.shutdown()
+            with _storage_errors(self.target.name):
+                self._client().complete_multipart_upload(
+                    Bucket=self.target.bucket, Key=self.key, UploadId=self._upload_id,
+                    MultipartUpload={"Parts": parts}
+                )
+        except StorageError:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Drop the upload and the parts already sent"""
+        if self._upload_id is None:
+            return
+        self._executor.shutdown()
+        try:
+            self._client().abort_multipart_upload(Bucket=self.target.bucket, Key=self.key,
+                                                  UploadId=self._upload_id)
+        except Exception:
+            pass
+
+
+class S3Target(StorageTarget):
+    """A bucket on S3 or an S3 compatible store such as MinIO; needs boto3"""
+
+    def __init__(self, target_config):
+        super().__init__(target_config)
+        self.bucket = target_config["bucket"]
+        self.prefix = target_config.get("prefix", "").strip("/")
+        self.part_size = max(MIN_PART_SIZE, int(target_config.get("part_size_mb", 0) * 1024 * 1024)
+                             or DEFAULT_PART_SIZE)
+        self._s3 = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        # boto3 clients are thread safe, one is shared by all uploads to the target
+        with self._lock:
+            if self._s3 is None:
+                try:
+                    import boto3
+                except ImportError:
+                    raise StorageError("S3 storage needs boto3, install it with: pip install cybexdump[s3]")
+                self._s3 = boto3.client(
+                    "s3",
+                    endpoint_url=self.config.get("endpoint_url"),
+                    region_name=self.config.get("region"),
+                    aws_access_key_id=self.config.get("access_key"),
+                    aws_secret_access_key=self.config.get("secret_key")
+                )
+        return self._s3
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def open_writer(self, key):
+        return MultipartWriter(self, self._key(key), self.part_size, self.upload_threads)
+
+    def list_keys(self, key):
+        keys = []
+        with _storage_errors(self.name):
+            paginator = self._client().get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(key)):
+                for item in page.get("Contents", []):
+                    found = item["Key"][len(self._key("")):] if self.prefix else item["Key"]
+                    if found == key or found.startswith(key + "/"):
+                        keys.append(found)
+        return sorted(keys)
+
+    def _get(self, key, path):
+        with _storage_errors(self.name):
+            self._client().download_file(self.bucket, self._key(key), str(path))
+
+    def delete(self, key):
+        keys = self.list_keys(key)
+        with _storage_errors(self.name):
+            # DeleteObjects takes at most 1000 keys per request
+            for start in range(0, len(keys), 1000):
+                self._client().delete_objects(Bucket=self.bucket, Delete={
+                    "Objects": [{"Key": self._key(found)} for found in keys[start:start + 1000]],
+                    "Quiet": True
+                })
+
+
+TARGETS = {
+    "local": LocalTarget,
+    "sftp": SFTPTarget,
+    "s3": S3Target
+}
+
+
+def storage_targets(config):
+    """Storage targets of the "storage" config section, by name"""
+    targets = {}
+    for target_config in config.get("storage", []):
+        if target_config.get("type") not in TARGETS:
+            raise StorageError(f"Unsupported storage type: {target_config.get('type')}")
+        target = TARGETS[target_config["type"]](target_config)
+        targets[target.name] = target
+    return targets
+
+
+class BackupStorage:
+    """The local backup directory and the targets its backups are copied to
+
+    Files written through open() go to the local file and to every target at
+    the same time, so an off-site copy needs no second pass over the backup
+    and no staging space. Keys are `prefix`, the database config's id, and
+    the path relative to `root`, the config's backup directory, so they don't
+    depend on which fleet volume holds that directory.
+    """
+
+    def __init__(self, root, targets=(), prefix=None):
+        self.root = Path(root).resolve()
+        self.targets = list(targets)
+        self.prefix = prefix
+
+    def key(self, path):
+        path = Path(path).resolve()
+        try:
+            key = path.relative_to(self.root).as_posix()
+        except ValueError:
+            # A backup written outside the backup directory, e.g. with --output
+            key = path.name
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @contextmanager
+    def open(self, path):
+        """Binary writer for a new local backup file that is also streamed to every target"""
+        writers = []
+        try:
+            for target in self.targets:
+                writers.append(target.open_writer(self.key(path)))
+            with open(path, 'wb') as f:
+                yield TeeWriter(f, *writers)
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+        for index, writer in enumerate(writers):
+            try:
+                writer.close()
+            except Exception:
+                for unfinished in writers[index + 1:]:
+                    unfinished.abort()
+                raise
+
+    def upload(self, path):
+        """Copy a finished local file or directory to every target, several files at a time"""
+        path = Path(path)
+        files = sorted(f for f in path.rglob("*") if f.is_file()) if path.is_dir() else [path]
+        for target in self.targets:
+            with ThreadPoolExecutor(max_workers=target.upload_threads) as executor:
+                uploads = [executor.submit(target.upload_file, f, self.key(f)) for f in files]
+                for upload in uploads:
+                    upload.result()
+
+    def delete(self, path):
+        for target in self.targets:
+            target.delete(self.key(path))
+
+    def fetch(self, path):
+        """Download a backup missing locally from the first target holding it, returning its name"""
+        for target in self.targets:
+            if target.download(self.key(path), path):
+                return target.name
+        return None
+
+
+def open_output(path, storage=None):
+    """Binary writer for a new backup file, streamed to the storage targets when given"""
+    if storage is None:
+        return open(path, 'wb')
+    return storage.open(path)
+
+
+def backup_storage(config, db_config, targets=None, backup_dir=None):
+    """BackupStorage of a database config: the targets named in its "storage" list, default all
+
+    `backup_dir` is where the config's backups are, by default the config's
+    directory in the backup location.
+    """
+    if targets is None:
+        targets = storage_targets(config)
+    names = db_config.get("storage")
+    if names is None:
+        selected = list(targets.values())
+    else:
+        missing = [name for name in names if name not in targets]
+        if missing:
+            raise StorageError(f"Unknown storage target: {', '.join(missing)}")
+        selected = [targets[name] for name in names]
+    root = backup_dir or Path(config.get("backup_location") or ".") / str(db_config["id"])
+    return BackupStorage(root, selected, str(db_config["id"]))
@@ -0,0 +1,40 @@
+from fnmatch import fnmatchcase
+
+# What a MySQL backup holds: tables and data, only the table definitions, or only the rows
+CONTENTS = ("full", "schema", "data")
+
+
+class TableFilter:
+    """Include and exclude patterns selecting the tables of a backup or restore
+
+    A pattern is `schema.table`, or just `table` for that table in every
+    schema, with shell wildcards in both parts, e.g. "shop.order_*" or
+    "*.audit_log". A table is selected when it matches an include pattern,
+    or there are none, and matches no exclude pattern.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = [self._split(pattern) for pattern in include or []]
+        self.exclude = [self._split(pattern) for pattern in exclude or []]
+
+    @classmethod
+    def from_config(cls, db_config, overrides=None):
+        """Filter of a database config's "tables" section, with `overrides` replacing its lists"""
+        settings = dict(db_config.get("tables") or {})
+        settings.update({key: value for key, value in (overrides or {}).items() if value})
+        return cls(settings.get("include"), settings.get("exclude"))
+
+    def _split(self, pattern):
+        schema, _, table = pattern.partition(".")
+        return (schema, table) if table else ("*", schema)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def _hit(self, patterns, schema, table):
+        return any(fnmatchcase(schema, s) and fnmatchcase(table, t) for s, t in patterns)
+
+    def matches(self, schema, table):
+        if self.include and not self._hit(self.include, schema, table):
+            return False
+        return not self._hit(self.exclude, schema, table)
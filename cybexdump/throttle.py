@@ -0,0 +1,207 @@
+import shutil
+import threading
+import time
+import mysql.connector
+from rich.console import Console
+from .connection_manager import ConnectionManager
+
+console = Console()
+
+# Reads and writes may run ahead of the rate by this much before they wait
+BURST_SECONDS = 0.5
+DEFAULT_ADAPTIVE_INTERVAL = 5
+DEFAULT_ADAPTIVE_MIN_MBPS = 1
+# How the read rate moves while the server is over / back under the load threshold
+SLOWDOWN_FACTOR = 0.5
+RECOVERY_FACTOR = 1.5
+
+IONICE_CLASSES = {"realtime": "1", "best-effort": "2", "idle": "3"}
+
+
+def _bytes_per_second(mbps):
+    return float(mbps) * 1024 * 1024 if mbps else None
+
+
+class RateLimiter:
+    """Thread-safe byte rate limit shared by every stream of a database config
+
+    Each consume() books its bytes on a virtual timeline running at `rate`
+    and sleeps until the booking is less than BURST_SECONDS ahead of now.
+    A rate of None means unlimited; it can be changed while streams run.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.total = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            self.total += amount
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self._next = max(self._next, now) + amount / self.rate
+            wait = self._next - now - BURST_SECONDS
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThrottledReader:
+    """Binary stream whose reads are held to a RateLimiter
+
+    Reading a dump tool's stdout slowly makes the tool, and the server
+    feeding it, slow down as well.
+    """
+
+    def __init__(self, source, limiter):
+        self.source = source
+        self.limiter = limiter
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.limiter.consume(len(data))
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class ThrottledWriter:
+    """File-like writer whose writes are held to a RateLimiter"""
+
+    def __init__(self, dest, limiter):
+        self.dest = dest
+        self.limiter = limiter
+
+    def write(self, data):
+        self.limiter.consume(len(data))
+        return self.dest.write(data)
+
+
+def priority_prefix(throttle_config):
+    """`nice` and `ionice` arguments to start a dump or compression process with
+
+    Either is skipped when its binary is not installed.
+    """
+    prefix = []
+    if throttle_config.get("nice") is not None and shutil.which("nice"):
+        prefix += ["nice", "-n", str(int(throttle_config["nice"]))]
+    ionice_class = throttle_config.get("ionice_class")
+    if ionice_class and shutil.which("ionice"):
+        prefix += ["ionice", "-c", IONICE_CLASSES.get(ionice_class, str(ionice_class))]
+        if throttle_config.get("ionice_level") is not None and ionice_class != "idle":
+            prefix += ["-n", str(int(throttle_config["ionice_level"]))]
+    return prefix
+
+
+class LoadMonitor:
+    """Lowers a config's read rate while its MySQL server is busy
+
+    Threads_running from SHOW GLOBAL STATUS is polled every `interval`
+    seconds. Above `threads_running`, the read rate is halved, down to
+    `min_read_mbps`; once the server is back under the threshold it is
+    raised again step by step until it reaches the configured rate.
+    Threads_running includes the backup's own dump connections.
+    """
+
+    def __init__(self, db_config, limiter, adaptive_config):
+        self.db_config = db_config
+        self.limiter = limiter
+        self.base_rate = limiter.rate
+        self.threshold = int(adaptive_config["threads_running"])
+        self.interval = float(adaptive_config.get("interval", DEFAULT_ADAPTIVE_INTERVAL))
+        self.floor = _bytes_per_second(adaptive_config.get("min_read_mbps", DEFAULT_ADAPTIVE_MIN_MBPS))
+        self._ceiling = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _threads_running(self):
+        with ConnectionManager(self.db_config).connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            row = cursor.fetchone()
+            cursor.close()
+        return int(row[1])
+
+    def adjust(self, threads_running, observed):
+        """Move the read rate one step given the server load and the observed read rate"""
+        host = f"{self.db_config['host']}:{self.db_config['port']}"
+        if threads_running > self.threshold:
+            if self._ceiling is None:
+                self._ceiling = self.base_rate or max(observed, self.floor)
+                console.print(f"[yellow]{host} has {threads_running} threads running, "
+                              f"slowing backups down[/yellow]")
+            current = self.limiter.rate or self._ceiling
+            self.limiter.rate = max(self.floor, current * SLOWDOWN_FACTOR)
+        elif self._ceiling is not None:
+            rate = self.limiter.rate * RECOVERY_FACTOR
+            if rate >= self._ceiling:
+                rate = self.base_rate
+                self._ceiling = None
+                console.print(f"[green]{host} load is back to normal, backups at full speed[/green]")
+            self.limiter.rate = rate
+
+    def _run(self):
+        last_total = self.limiter.total
+        last_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            observed = (self.limiter.total - last_total) / max(now - last_time, 0.001)
+            last_total, last_time = self.limiter.total, now
+            try:
+                threads_running = self._threads_running()
+            except mysql.connector.Error:
+                continue
+            self.adjust(threads_running, observed)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.limiter.rate = self.base_rate
+
+
+class Throttle:
+    """Resource limits of one database config, shared by all of its concurrent dumps
+
+    Built from the config's "throttle" section. Without one, every method is
+    a no-op and streams are passed through untouched.
+    """
+
+    def __init__(self, db_config):
+        throttle_config = db_config.get("throttle", {})
+        self.read = RateLimiter(_bytes_per_second(throttle_config.get("read_mbps")))
+        self.write = RateLimiter(_bytes_per_second(throttle_config.get("write_mbps")))
+        self.compression_threads = throttle_config.get("compression_threads")
+        self.prefix = priority_prefix(throttle_config)
+        self.monitor = None
+        if throttle_config.get("adaptive") and db_config.get("type") == "mysql":
+            self.monitor = LoadMonitor(db_config, self.read, throttle_config["adaptive"])
+
+    def command(self, cmd):
+        """`cmd` run at the configured CPU and I/O priority"""
+        return self.prefix + list(cmd)
+
+    def reader(self, source):
+        if self.read.rate or self.monitor:
+            return ThrottledReader(source, self.read)
+        return source
+
+    def writer(self, dest):
+        if self.write.rate:
+            return ThrottledWriter(dest, self.write)
+        return dest
+
+    def start(self):
+        if self.monitor:
+            self.monitor.start()
+
+    def stop(self):
+        if self.monitor:
+            self.monitor.stop()
@@ -0,0 +1,262 @@
+import hashlib
+import random
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import mysql.connector
+from rich.console import Console
+from .compression import CHUNK_SIZE, CompressionError, codec_for_file, decompress_command
+from .connection_manager import ConnectionManager
+from .encryption import DecryptingReader, EncryptionError, is_encrypted
+from .native_dump import MANIFEST_FILE, MANIFEST_FORMAT, NativeDumper, NativeDumpError, quote_identifier
+from .native_restore import NativeRestorer, NativeRestoreError
+from .repository import REPOSITORY_FORMAT, BackupRepository, RepositoryError
+
+console = Console()
+
+# mysqldump ends every complete dump with this comment
+DUMP_TRAILER = b"-- Dump completed"
+TAIL_BYTES = 4096
+DEFAULT_JOBS = 4
+SCRATCH_PREFIX = "cybexdump_verify_"
+
+
+def _read_tail(stream, tail):
+    """Read a stream to its end, keeping its last TAIL_BYTES in tail[0]"""
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        tail[0] = (tail[0] + data)[-TAIL_BYTES:]
+
+
+class _HashingReader:
+    """Reader passing on data from `source` after adding it to `digest`"""
+
+    def __init__(self, source, digest):
+        self.source = source
+        self.digest = digest
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.digest.update(data)
+        return data
+
+
+def check_file(path, expected=None, codec=None, trailer=False, quick=False):
+    """Problems found in one backup file, read in a single pass
+
+    The file's SHA-256 is compared with `expected`. Unless `quick`, an
+    encrypted file is decrypted, which authenticates every chunk, a
+    compressed file is also decompressed to make sure the stream is intact,
+    and with `trailer` the data must end with mysqldump's completion comment.
+    """
+    problems = []
+    digest = hashlib.sha256()
+    tail = [b""]
+    decompress = drain = None
+    if codec and not quick:
+        decompress = subprocess.Popen(decompress_command(codec), stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        drain = threading.Thread(target=_read_tail, args=(decompress.stdout, tail), daemon=True)
+        drain.start()
+    source = None
+    try:
+        with open(path, 'rb') as f:
+            source = _HashingReader(f, digest)
+            if not quick and is_encrypted(path):
+                source = DecryptingReader(source, name=Path(path).name)
+            while True:
+                data = source.read(CHUNK_SIZE)
+                if not data:
+                    break
+                if decompress:
+                    decompress.stdin.write(data)
+                elif not codec:
+                    tail[0] = (tail[0] + data)[-TAIL_BYTES:]
+    except BrokenPipeError:
+        pass
+    except EncryptionError as e:
+        problems.append(str(e))
+    finally:
+        if isinstance(source, DecryptingReader):
+            source.close()
+        if decompress:
+            try:
+                decompress.stdin.close()
+            except BrokenPipeError:
+                pass
+            decompress.wait()
+            drain.join()
+
+    if expected and digest.hexdigest() != expected:
+        problems.append(f"{Path(path).name}: checksum mismatch")
+    if decompress and decompress.returncode != 0:
+        problems.append(f"{Path(path).name}: corrupt {codec} stream")
+    elif trailer and (decompress or not codec) and DUMP_TRAILER not in tail[0]:
+        problems.append(f"{Path(path).name}: incomplete dump, no '{DUMP_TRAILER.decode()}' at the end")
+    return problems
+
+
+class BackupVerifier:
+    """Checks that backups are complete and can be restored
+
+    The files of all backups are checked together over `jobs` threads, each
+    in one pass: its SHA-256 is compared with the one recorded when it was
+    written, and compressed streams are decompressed to the end. With
+    `sample`, that many random tables of every native MySQL backup are also
+    restored into a scratch schema on the `scratch` server, and their row
+    counts and row checksums compared with the manifest.
+    """
+
+    def __init__(self, jobs=None, quick=False, sample=0, scratch=None):
+        self.jobs = max(1, int(jobs or DEFAULT_JOBS))
+        self.quick = quick
+        self.sample = sample
+        self.scratch = dict(scratch, type="mysql") if scratch else None
+
+    def _plan(self, path, metadata):
+        """Kind of a backup and the file checks it needs, as (kind, checks, problems)"""
+        path = Path(path)
+        if not path.exists():
+            return None, [], ["backup not found"]
+        if path.is_dir():
+            if (path / MANIFEST_FILE).exists():
+                manifest = metadata
+                if manifest.get("format") != MANIFEST_FORMAT:
+                    return None, [], ["unsupported manifest"]
+                names = [manifest["create_database"], manifest.get("views"), manifest.get("post_schema")]
+                for table in manifest["tables"].values():
+                    names.append(table["schema_file"])
+                    names += [chunk["file"] for chunk in table["chunks"]]
+                checksums, codec, kind = manifest.get("checksums", {}), manifest["codec"], "native"
+            else:
+                # pg_dump directories: pg_restore reads the compressed files itself
+                checksums, codec, kind = metadata.get("checksums", {}), None, metadata.get("format", "directory")
+                names = sorted(checksums) or [f.name for f in path.iterdir()]
+                if kind == "pgdump":
+                    names.append("toc.dat")
+            problems = [f"{name}: missing" for name in dict.fromkeys(names) if name and not (path / name).exists()]
+            checks = [(path / name, checksums.get(name), codec, False)
+                      for name in dict.fromkeys(names) if name and (path / name).exists()]
+            if not checksums:
+                problems.append("no checksums recorded, only checked the files are readable")
+            return kind, checks, problems
+        if metadata.get("format") == REPOSITORY_FORMAT:
+            return "repository", [], []
+
+        expected = metadata.get("checksums", {}).get(path.name)
+        # Only mysqldump files carry a completion trailer; engine backups record their format
+        trailer = "format" not in metadata
+        problems = [] if expected else ["no checksum recorded, only checked the file is readable"]
+        return metadata.get("format", "file"), [(path, expected, codec_for_file(path), trailer)], problems
+
+    def _check_repository(self, path):
+        """Read every chunk of a repository backup, which verifies each chunk's SHA-256"""
+        path = Path(path)
+        # <backup_location>/repository/manifests/<database id>/<name>.json
+        repository = BackupRepository(path.parents[3])
+        try:
+            manifest = repository.load_manifest(path)
+            last = b""
+            for chunk in repository.read_chunks(manifest):
+                last = chunk
+        except (RepositoryError, OSError) as e:
+            return [str(e)]
+        if DUMP_TRAILER not in last[-TAIL_BYTES:]:
+            return [f"incomplete dump, no '{DUMP_TRAILER.decode()}' at the end"]
+        return []
+
+    def _sample_restore(self, path, manifest):
+        """Restore random tables of a native backup into a scratch schema and compare them"""
+        tables = sorted(manifest["tables"])
+        tables = random.sample(tables, min(self.sample, len(tables)))
+        if not tables:
+            return [], []
+        schema = SCRATCH_PREFIX + uuid.uuid4().hex[:12]
+        restorer = NativeRestorer(self.scratch, path, target_schema=schema, tables=tables)
+        dumper = NativeDumper(self.scratch, schema, path)
+        connections = ConnectionManager(self.scratch)
+        problems = []
+        try:
+            restorer.run()
+            with connections.connection(schema) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SET SESSION time_zone = '+00:00'")
+                for name in tables:
+                    table = manifest["tables"][name]
+                    cursor.execute(f"SELECT COUNT(*) FROM {quote_identifier(name)}")
+                    rows = cursor.fetchone()[0]
+                    if rows != table["rows"]:
+                        problems.append(f"{name}: restored {rows} rows, backup has {table['rows']}")
+                        continue
+                    for chunk in table["chunks"]:
+                        if not chunk.get("rows_checksum"):
+                            continue
+                        _, checksum = dumper.rows_checksum(conn, name, table.get("key"), chunk.get("bounds"))
+                        if checksum != chunk["rows_checksum"]:
+                            problems.append(f"{name}: restored rows differ from {chunk['file']}")
+                cursor.close()
+        except (mysql.connector.Error, NativeRestoreError, NativeDumpError, CompressionError,
+                subprocess.CalledProcessError, OSError) as e:
+            problems.append(f"sample restore failed: {str(e)}")
+        finally:
+            try:
+                with connections.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(f"DROP DATABASE IF EXISTS {quote_identifier(schema)}")
+                    cursor.close()
+            except mysql.connector.Error as e:
+                console.print(f"[yellow]Could not drop scratch schema {schema}: {str(e)}[/yellow]")
+            if restorer.checkpoint_file.exists():
+                restorer.checkpoint_file.unlink()
+        return tables, problems
+
+    def verify(self, backups):
+        """Verify backups given as (path, metadata) pairs, returning one result per backup"""
+        results = []
+        checks = []
+        for path, metadata in backups:
+            kind, file_checks, problems = self._plan(path, metadata)
+            result = {"path": str(path), "kind": kind, "files": len(file_checks), "errors": [],
+                      "warnings": [], "sampled": [], "status": "failed", "seconds": 0.0}
+            # Missing checksums only limit how much could be checked
+            for problem in problems:
+                (result["warnings"] if "no checksum" in problem else result["errors"]).append(problem)
+            results.append(result)
+            if kind == "repository":
+                result["files"] = 1
+                checks.append((result, None))
+            checks += [(result, check) for check in file_checks]
+
+        def run(item):
+            result, check = item
+            started = time.monotonic()
+            try:
+                if check is None:
+                    problems = self._check_repository(result["path"])
+                else:
+                    path, expected, codec, trailer = check
+                    problems = check_file(path, expected, codec, trailer, self.quick)
+            except (CompressionError, OSError) as e:
+                problems = [str(e)]
+            return result, problems, time.monotonic() - started
+
+        # Largest files first, so one big file doesn't start last and hold up the run
+        checks.sort(key=lambda item: item[1][0].stat().st_size if item[1] else 0, reverse=True)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result, problems, seconds in executor.map(run, checks):
+                result["errors"] += problems
+                result["seconds"] += seconds
+
+        for (path, metadata), result in zip(backups, results):
+            if self.sample and result["kind"] == "native" and not result["errors"]:
+                started = time.monotonic()
+                result["sampled"], problems = self._sample_restore(path, metadata)
+                result["errors"] += problems
+                result["seconds"] += time.monotonic() - started
+            result["status"] = "failed" if result["errors"] else "success"
+        return results
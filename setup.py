@@ -9,10 +9,15 @@ setup(
         "Click",
         "mysql-connector-python",
         "rich",
-        "schedule",
         "python-crontab",  # installs as 'crontab'
         "python-dotenv",
     ],
+    extras_require={
+        "s3": ["boto3"],
+        "sftp": ["paramiko"],
+        "crypto": ["cryptography"],
+        "dev": ["pytest"],
+    },
     entry_points={
         "console_scripts": [
             "cybexdump=cybexdump.cli:main",
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from cybexdump.catalog_manager import CatalogManager, is_complete
+
+
+@pytest.fixture
+def catalog(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    return CatalogManager(tmp_path / "catalog.db")
+
+
+def _backup(created, **entry):
+    return dict({"database_id": 1, "schema_name": "shop", "format": "file", "path": f"/backups/{created}.sql.gz",
+                 "created": created}, **entry)
+
+
+def test_latest_skips_partial_backups(catalog):
+    catalog.record_backup(_backup("2025-01-01T00:00:00"))
+    catalog.record_backup(_backup("2025-01-02T00:00:00", content="schema"))
+    catalog.record_backup(_backup("2025-01-03T00:00:00", content="data"))
+    catalog.record_backup(_backup("2025-01-04T00:00:00", tables=["orders"]))
+
+    assert catalog.latest("shop")["created"] == "2025-01-01T00:00:00"
+    newest = catalog.latest("shop", complete=False)
+    assert newest["created"] == "2025-01-04T00:00:00"
+    assert (newest["content"], newest["tables"]) == ("full", ["orders"])
+    assert not is_complete(newest)
+    assert [entry["created"] for entry in catalog.list_backups(complete=True)] == ["2025-01-01T00:00:00"]
+
+
+def test_catalog_from_before_content_was_recorded(catalog):
+    conn = sqlite3.connect(str(catalog.catalog_file))
+    conn.executescript("""
+        CREATE TABLE backups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, database_id INTEGER NOT NULL, host TEXT,
+            schema_name TEXT NOT NULL, format TEXT NOT NULL, path TEXT NOT NULL UNIQUE,
+            created TEXT NOT NULL, finished TEXT, seconds REAL, raw_bytes INTEGER, bytes INTEGER,
+            checksum TEXT, codec TEXT, binlog_file TEXT, binlog_position INTEGER, gtid_set TEXT
+        );
+        INSERT INTO backups (database_id, schema_name, format, path, created)
+        VALUES (1, 'shop', 'file', '/backups/old.sql.gz', '2024-12-31T00:00:00');
+    """)
+    conn.close()
+
+    old = catalog.latest("shop")
+    assert old["path"] == "/backups/old.sql.gz" and is_complete(old)
+    catalog.record_backup(_backup("2025-01-01T00:00:00", content="schema"))
+    assert catalog.latest("shop")["path"] == "/backups/old.sql.gz"
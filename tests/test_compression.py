@@ -0,0 +1,70 @@
+import errno
+import gzip
+import io
+import os
+import subprocess
+
+import pytest
+
+from cybexdump.compression import CompressedWriter
+from cybexdump.dump_index import IndexedWriter
+
+DATA = os.urandom(1024 * 1024)
+
+
+class FullDisk:
+    def write(self, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+
+def _fails_with(*script):
+    # Runs `script` in place of the compressor; its arguments are appended but ignored
+    return ["sh", "-c", "; ".join(script), "sh"]
+
+
+def test_output_is_compressed(tmp_path):
+    dest = io.BytesIO()
+    with CompressedWriter(dest, "gzip") as writer:
+        writer.write(DATA)
+
+    assert gzip.decompress(dest.getvalue()) == DATA
+    assert (writer.raw_bytes, writer.compressed_bytes) == (len(DATA), len(dest.getvalue()))
+
+
+@pytest.mark.parametrize("writer_class", [CompressedWriter, IndexedWriter])
+def test_destination_error_is_raised_instead_of_broken_pipe(writer_class):
+    with pytest.raises(OSError) as raised:
+        with writer_class(FullDisk(), "gzip") as writer:
+            for _ in range(64):
+                writer.write(DATA)
+
+    assert raised.value.errno == errno.ENOSPC
+
+
+@pytest.mark.parametrize("writer_class", [CompressedWriter, IndexedWriter])
+def test_compressor_exit_status_and_stderr_are_raised(writer_class):
+    prefix = _fails_with("echo 'zstd: error 70 : Write error : cannot write block' >&2", "exit 70")
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        with writer_class(io.BytesIO(), "gzip", command_prefix=prefix) as writer:
+            for _ in range(64):
+                writer.write(DATA)
+
+    assert raised.value.returncode == 70
+    assert b"cannot write block" in raised.value.stderr
+    assert isinstance(raised.value.__cause__, BrokenPipeError)
+
+
+def test_compressor_failing_at_the_end_is_raised_on_close():
+    prefix = _fails_with("cat > /dev/null", "echo 'gzip: stdout: Input/output error' >&2", "exit 1")
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        with CompressedWriter(io.BytesIO(), "gzip", command_prefix=prefix) as writer:
+            writer.write(DATA)
+
+    assert raised.value.stderr == b"gzip: stdout: Input/output error"
+
+
+def test_other_errors_are_not_replaced():
+    with pytest.raises(KeyError):
+        with CompressedWriter(io.BytesIO(), "gzip") as writer:
+            writer.write(DATA)
+            raise KeyError("table")
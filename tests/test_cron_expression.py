@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pytest
+
+from cybexdump.cron_expression import CronExpression, CronExpressionError, schedule_expression
+
+# 2025-01-01 is a Wednesday
+
+NEXT_RUN = [
+    # Steps from a start value and over a range
+    ("5/15 * * * *", datetime(2025, 1, 1, 10, 0), datetime(2025, 1, 1, 10, 5)),
+    ("5/15 * * * *", datetime(2025, 1, 1, 10, 5), datetime(2025, 1, 1, 10, 20)),
+    ("5/15 * * * *", datetime(2025, 1, 1, 10, 50), datetime(2025, 1, 1, 11, 5)),
+    ("0 8-18/4 * * *", datetime(2025, 1, 1, 12, 30), datetime(2025, 1, 1, 16, 0)),
+    # */2 in day of month: odd days, restarting at 1 in every month
+    ("0 0 */2 * *", datetime(2025, 1, 2, 12, 0), datetime(2025, 1, 3, 0, 0)),
+    ("0 0 */2 * *", datetime(2025, 1, 31, 0, 0), datetime(2025, 2, 1, 0, 0)),
+    ("0 0 */2 * *", datetime(2025, 2, 27, 0, 0), datetime(2025, 3, 1, 0, 0)),
+    # Weekday and month names, and 7 for Sunday
+    ("30 9 * * mon-fri", datetime(2025, 1, 3, 10, 0), datetime(2025, 1, 6, 9, 30)),
+    ("0 12 * * sun", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 5, 12, 0)),
+    ("0 12 * * 7", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 5, 12, 0)),
+    ("0 12 * * 0", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 5, 12, 0)),
+    ("0 0 1 jun *", datetime(2025, 1, 1, 0, 0), datetime(2025, 6, 1, 0, 0)),
+    # Month and year rollover, and months without the day
+    ("0 0 1 * *", datetime(2025, 12, 15, 8, 0), datetime(2026, 1, 1, 0, 0)),
+    ("59 23 31 * *", datetime(2025, 4, 1, 0, 0), datetime(2025, 5, 31, 23, 59)),
+    ("0 0 29 2 *", datetime(2025, 1, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+    # Day of month and day of week both restricted: either one matches
+    ("0 0 13 * fri", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 3, 0, 0)),
+    ("0 0 13 * 5", datetime(2025, 1, 11, 0, 0), datetime(2025, 1, 13, 0, 0)),
+    # ... but a field starting with * restricts nothing for that rule, so both must match
+    ("0 0 */2 * 1", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 13, 0, 0)),
+    ("0 0 * * fri", datetime(2025, 1, 11, 0, 0), datetime(2025, 1, 17, 0, 0)),
+    # Macros
+    ("@weekly", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 5, 0, 0)),
+    ("@yearly", datetime(2025, 1, 1, 0, 0), datetime(2026, 1, 1, 0, 0)),
+]
+
+LAST_RUN = [
+    ("5/15 * * * *", datetime(2025, 1, 1, 10, 4), datetime(2025, 1, 1, 9, 50)),
+    ("5/15 * * * *", datetime(2025, 1, 1, 10, 5, 30), datetime(2025, 1, 1, 10, 5)),
+    ("0 0 */2 * *", datetime(2025, 3, 2, 12, 0), datetime(2025, 3, 1, 0, 0)),
+    ("0 0 */2 * *", datetime(2025, 3, 1, 0, 0), datetime(2025, 3, 1, 0, 0)),
+    ("30 9 * * mon-fri", datetime(2025, 1, 5, 12, 0), datetime(2025, 1, 3, 9, 30)),
+    ("0 0 * * 7", datetime(2025, 1, 4, 23, 59), datetime(2024, 12, 29, 0, 0)),
+    ("0 0 1 * *", datetime(2025, 3, 15, 12, 0), datetime(2025, 3, 1, 0, 0)),
+    ("0 0 1 * *", datetime(2025, 1, 1, 0, 0), datetime(2025, 1, 1, 0, 0)),
+    ("59 23 31 * *", datetime(2025, 5, 1, 0, 0), datetime(2025, 3, 31, 23, 59)),
+    ("0 0 29 2 *", datetime(2027, 6, 1, 0, 0), datetime(2024, 2, 29, 0, 0)),
+    ("0 0 13 * 5", datetime(2025, 1, 12, 0, 0), datetime(2025, 1, 10, 0, 0)),
+    ("0 0 13 * 5", datetime(2025, 1, 14, 0, 0), datetime(2025, 1, 13, 0, 0)),
+]
+
+
+@pytest.mark.parametrize("expression, moment, expected", NEXT_RUN)
+def test_next_run(expression, moment, expected):
+    assert CronExpression(expression).next_run(moment) == expected
+
+
+@pytest.mark.parametrize("expression, moment, expected", LAST_RUN)
+def test_last_run(expression, moment, expected):
+    assert CronExpression(expression).last_run(moment) == expected
+
+
+@pytest.mark.parametrize("expression", ["0 0 30 2 *", "0 0 31 4,6,9,11 *"])
+def test_expression_that_never_matches(expression):
+    with pytest.raises(CronExpressionError):
+        CronExpression(expression).next_run(datetime(2025, 1, 1))
+    with pytest.raises(CronExpressionError):
+        CronExpression(expression).last_run(datetime(2025, 1, 1))
+
+
+@pytest.mark.parametrize("expression", [
+    "* * * *",
+    "60 * * * *",
+    "* 24 * * *",
+    "* * 0 * *",
+    "* * * 13 *",
+    "* * * * 8",
+    "*/0 * * * *",
+    "5-1 * * * *",
+    "* * * * funday",
+])
+def test_invalid_expression(expression):
+    with pytest.raises(CronExpressionError):
+        CronExpression(expression)
+
+
+@pytest.mark.parametrize("schedule, expected", [
+    ({"frequency": "hourly", "time": "00:15"}, "15 * * * *"),
+    ({"frequency": "daily", "time": "02:30"}, "30 2 * * *"),
+    ({"frequency": "weekly", "time": "03:00"}, "0 3 * * 0"),
+    ({"cron": "*/5 * * * *", "frequency": "daily"}, "*/5 * * * *"),
+])
+def test_schedule_expression(schedule, expected):
+    assert str(schedule_expression(schedule)) == expected
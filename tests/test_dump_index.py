@@ -0,0 +1,51 @@
+import gzip
+
+from cybexdump.dump_index import IndexedWriter, read_sections
+
+
+def _dump(tables):
+    parts = [b"-- MySQL dump 10.13\n/*!40101 SET NAMES utf8mb4 */;\n"]
+    for name, rows in tables.items():
+        parts.append(b"\n--\n-- Table structure for table `%s`\n--\n\nCREATE TABLE `%s` (id int);\n" % (name, name))
+        parts.append(b"\n--\n-- Dumping data for table `%s`\n--\n\n" % name)
+        parts.append(b"INSERT INTO `%s` VALUES " % name + b",".join(b"(%d)" % i for i in range(rows)) + b";\n")
+    parts.append(b"/*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;\n/*!40101 SET SQL_MODE=@OLD_SQL_MODE */;\n")
+    return b"".join(parts)
+
+
+def _write(path, data, member_bytes):
+    with open(path, "wb") as f:
+        writer = IndexedWriter(f, "gzip", member_bytes=member_bytes)
+        for i in range(0, len(data), 4096):
+            writer.write(data[i:i + 4096])
+        writer.close()
+    return writer
+
+
+def test_indexed_file_decompresses_as_a_whole(tmp_path):
+    data = _dump({b"a": 5000, b"b": 20, b"c": 8000})
+    path = tmp_path / "dump.sql.gz"
+    writer = _write(path, data, member_bytes=16 * 1024)
+
+    assert gzip.decompress(path.read_bytes()) == data
+    assert writer.raw_bytes == len(data)
+    assert writer.compressed_bytes == path.stat().st_size
+    assert [(entry["type"], entry["name"]) for entry in writer.sections] == [
+        ("header", None), ("table", "a"), ("table", "b"), ("table", "c"), ("footer", None)
+    ]
+    # Large tables start new members, small ones share them
+    assert len({entry["offset"] for entry in writer.sections}) == 3
+
+
+def test_read_sections_returns_only_the_selected_table(tmp_path):
+    tables = {b"a": 5000, b"b": 20, b"c": 8000}
+    data = _dump(tables)
+    path = tmp_path / "dump.sql.gz"
+    writer = _write(path, data, member_bytes=16 * 1024)
+
+    selected = [entry for entry in writer.sections if entry["name"] == "c"]
+    table = b"".join(read_sections(path, "gzip", selected))
+
+    assert table.startswith(b"--\n-- Table structure for table `c`")
+    assert table.endswith(b"INSERT INTO `c` VALUES " + b",".join(b"(%d)" % i for i in range(8000)) + b";\n")
+    assert b"`a`" not in table and b"`b`" not in table
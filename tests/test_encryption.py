@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+from cybexdump import keystore
+from cybexdump.encryption import (CHUNK_SIZE, HEADER_SIZE, TAG_SIZE, DecryptingReader, EncryptingWriter,
+                                  EncryptionError, read_range)
+from cybexdump.keystore import Keystore, KeystoreError
+
+pytest.importorskip("cryptography")
+
+PASSPHRASE = "correct horse"
+# Two and a half chunks, so there is a full chunk in the middle and a short last one
+PLAINTEXT = os.urandom(2 * CHUNK_SIZE + CHUNK_SIZE // 2)
+
+
+@pytest.fixture(autouse=True)
+def home(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv(keystore.PASSPHRASE_ENV, PASSPHRASE)
+    monkeypatch.setattr(keystore, "_opened", {})
+    return tmp_path
+
+
+@pytest.fixture
+def encrypted(tmp_path):
+    store = Keystore()
+    store.create(PASSPHRASE)
+    path = tmp_path / "backup.sql.enc"
+    with open(path, 'wb') as dest, EncryptingWriter(dest, key=store.backup_key()[1]) as writer:
+        for start in range(0, len(PLAINTEXT), 300 * 1024):
+            writer.write(PLAINTEXT[start:start + 300 * 1024])
+    keystore._opened.clear()
+    return path
+
+
+def _decrypt(path):
+    with open(path, 'rb') as f:
+        reader = DecryptingReader(f, threads=2, name=str(path))
+        try:
+            return reader.read()
+        finally:
+            reader.close()
+
+
+def _chunks(path):
+    data = path.read_bytes()
+    body = data[HEADER_SIZE:]
+    size = CHUNK_SIZE + TAG_SIZE
+    return data[:HEADER_SIZE], [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def test_round_trip(encrypted):
+    header, chunks = _chunks(encrypted)
+    assert len(chunks) == 3
+    assert _decrypt(encrypted) == PLAINTEXT
+
+
+def test_truncated_last_chunk_fails(encrypted):
+    with open(encrypted, 'r+b') as f:
+        f.truncate(os.path.getsize(encrypted) - 100)
+    with pytest.raises(EncryptionError, match="chunk 2"):
+        _decrypt(encrypted)
+
+
+def test_file_cut_at_a_chunk_boundary_fails(encrypted):
+    header, chunks = _chunks(encrypted)
+    encrypted.write_bytes(header + b"".join(chunks[:2]))
+    with pytest.raises(EncryptionError, match="chunk 1"):
+        _decrypt(encrypted)
+
+
+def test_reordered_chunks_fail(encrypted):
+    header, chunks = _chunks(encrypted)
+    encrypted.write_bytes(header + chunks[1] + chunks[0] + chunks[2])
+    with pytest.raises(EncryptionError, match="chunk 0"):
+        _decrypt(encrypted)
+
+
+def test_wrong_passphrase_fails(encrypted, monkeypatch):
+    monkeypatch.setenv(keystore.PASSPHRASE_ENV, "wrong horse")
+    with pytest.raises(EncryptionError, match="Wrong passphrase"):
+        _decrypt(encrypted)
+    with pytest.raises(KeystoreError):
+        Keystore().secrets()
+
+
+@pytest.mark.parametrize("offset, length", [
+    (0, 10),
+    (CHUNK_SIZE - 5, 10),
+    (CHUNK_SIZE // 2, 2 * CHUNK_SIZE),
+    (2 * CHUNK_SIZE + 7, 10 * CHUNK_SIZE),
+])
+def test_read_range(encrypted, offset, length):
+    assert b"".join(read_range(encrypted, offset, length)) == PLAINTEXT[offset:offset + length]
+
+
+def test_read_range_of_unencrypted_file(tmp_path):
+    path = tmp_path / "backup.sql"
+    path.write_bytes(PLAINTEXT)
+    assert b"".join(read_range(path, CHUNK_SIZE - 5, 10)) == PLAINTEXT[CHUNK_SIZE - 5:CHUNK_SIZE + 5]
+
+
+def test_update_keeps_secrets_written_by_another_process():
+    Keystore().create(PASSPHRASE)
+    # This process opened the keystore before another one updated it
+    stale = dict(keystore._opened)
+    Keystore().update({"first": "1"})
+    keystore._opened.clear()
+    keystore._opened.update(stale)
+    Keystore().update({"second": "2"})
+
+    keystore._opened.clear()
+    secrets = Keystore().secrets()
+    assert (secrets["first"], secrets["second"]) == ("1", "2")
+    assert secrets["backup_key_id"] in secrets["backup_keys"]
@@ -0,0 +1,40 @@
+from cybexdump.fleet import VolumePlacer
+from cybexdump.storage import backup_storage
+
+
+def test_keys_of_configs_on_different_volumes_do_not_collide(tmp_path):
+    config = {"backup_location": str(tmp_path / "backups")}
+    first = backup_storage(config, {"id": 1}, {}, tmp_path / "vol1" / "1")
+    second = backup_storage(config, {"id": 2}, {}, tmp_path / "vol2" / "2")
+    name = "cybexdump_backup_app_20250101_000000.sql.gz"
+
+    assert first.key(tmp_path / "vol1" / "1" / name) == f"1/{name}"
+    assert second.key(tmp_path / "vol2" / "2" / name) == f"2/{name}"
+    # Chunk files of native backups keep their directory
+    assert first.key(tmp_path / "vol1" / "1" / "app" / "t.00001.sql.gz") == "1/app/t.00001.sql.gz"
+
+
+def test_keys_in_the_backup_location_are_unchanged(tmp_path):
+    config = {"backup_location": str(tmp_path)}
+    storage = backup_storage(config, {"id": 3}, {})
+
+    assert storage.key(tmp_path / "3" / "backup.sql.gz") == "3/backup.sql.gz"
+    assert storage.key(tmp_path / "3" / "binlogs" / "binlog.000001") == "3/binlogs/binlog.000001"
+    # --output files outside the config's directory
+    assert storage.key(tmp_path / "elsewhere" / "backup.sql.gz") == "3/backup.sql.gz"
+
+
+def test_only_placing_creates_a_directory(tmp_path):
+    volumes = [tmp_path / "vol1", tmp_path / "vol2"]
+    for volume in volumes:
+        volume.mkdir()
+    placer = VolumePlacer(volumes)
+
+    looked_up = placer.directory({"id": 7})
+    assert not looked_up.exists()
+    assert all(not any(volume.iterdir()) for volume in volumes)
+
+    placed = placer.directory({"id": 7}, place=True)
+    assert placed.is_dir()
+    assert placer.directory({"id": 7}) == placed
+    assert placer.directory({"id": 7, "volume": str(tmp_path / "vol2")}) == tmp_path / "vol2" / "7"
@@ -0,0 +1,90 @@
+import mysql.connector
+import pytest
+
+from cybexdump.native_dump import NativeDumper
+
+DB_CONFIG = {"host": "db", "port": 3306, "username": "u", "password": "p", "threads": 3}
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, statement):
+        self.conn.server.statements.append(statement)
+        if statement in self.conn.server.failing:
+            raise mysql.connector.Error(msg=f"{statement} denied")
+        if statement == "FLUSH TABLES WITH READ LOCK":
+            self.conn.server.lock_holder = self.conn
+        elif statement == "UNLOCK TABLES":
+            self.conn.server.lock_holder = None
+
+    def fetchone(self):
+        return ("binlog.000007", 4242, "", "", "uuid:1-10")
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakePool:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.statements = []
+        self.lock_holder = None
+        self.released = []
+
+    def acquire(self, database=None):
+        return FakeConnection(self)
+
+    def release(self, conn):
+        # A pooled connection must never go back holding the global read lock
+        assert self.lock_holder is not conn
+        self.released.append(conn)
+
+
+def _open(monkeypatch, tmp_path, failing=(), **config):
+    dumper = NativeDumper(dict(DB_CONFIG, **config), "shop", tmp_path)
+    pool = FakePool(failing)
+    monkeypatch.setattr(dumper.connections, "pool", pool)
+    return dumper, pool, dumper._open_snapshot_connections()
+
+
+def test_snapshot_connections_record_the_binlog_position(monkeypatch, tmp_path):
+    dumper, pool, connections = _open(monkeypatch, tmp_path)
+
+    assert len(connections) == 3
+    assert dumper.binlog == {"file": "binlog.000007", "position": 4242, "gtid_set": "uuid:1-10"}
+    assert pool.statements.count("UNLOCK TABLES") == 1
+
+
+@pytest.mark.parametrize("failing, config", [
+    ({"SHOW BINARY LOG STATUS", "SHOW MASTER STATUS"}, {}),
+    ({"SHOW REPLICA STATUS", "SHOW SLAVE STATUS"}, {"replica_of": "primary"}),
+])
+def test_unreadable_binlog_position_still_unlocks_tables(monkeypatch, tmp_path, failing, config):
+    dumper, pool, connections = _open(monkeypatch, tmp_path, failing, **config)
+
+    # The lock did succeed, so the snapshots are still synchronised
+    assert len(connections) == 3
+    assert dumper.binlog is None
+    assert pool.statements.count("UNLOCK TABLES") == 1
+    assert pool.lock_holder is None
+
+
+def test_without_reload_privilege_one_connection_is_used(monkeypatch, tmp_path):
+    dumper, pool, connections = _open(monkeypatch, tmp_path, {"FLUSH TABLES WITH READ LOCK"})
+
+    assert len(connections) == 1
+    assert dumper.binlog is None
+    assert "UNLOCK TABLES" not in pool.statements
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cybexdump.native_restore import deferred_alters, split_create_table, wait_all
+
+CREATE = """CREATE TABLE `posts` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `author_id` int NOT NULL,
+  `title` varchar(200) NOT NULL,
+  `body` text NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `author` (`author_id`),
+  FULLTEXT KEY `title_text` (`title`),
+  FULLTEXT KEY `body_text` (`body`),
+  CONSTRAINT `posts_author` FOREIGN KEY (`author_id`) REFERENCES `authors` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+
+
+def test_split_create_table_defers_secondary_keys_and_foreign_keys():
+    create, indexes, foreign_keys = split_create_table(CREATE)
+
+    assert "PRIMARY KEY (`id`)" in create
+    assert "KEY `author`" not in create and "FULLTEXT" not in create
+    assert create.endswith(") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4")
+    assert indexes == [
+        "KEY `author` (`author_id`)",
+        "FULLTEXT KEY `title_text` (`title`)",
+        "FULLTEXT KEY `body_text` (`body`)"
+    ]
+    assert foreign_keys == ["CONSTRAINT `posts_author` FOREIGN KEY (`author_id`) REFERENCES `authors` (`id`)"]
+
+
+def test_deferred_alters_adds_each_fulltext_index_on_its_own():
+    _, indexes, _ = split_create_table(CREATE)
+
+    assert deferred_alters("posts", indexes) == [
+        "ALTER TABLE `posts` ADD KEY `author` (`author_id`)",
+        "ALTER TABLE `posts` ADD FULLTEXT KEY `title_text` (`title`)",
+        "ALTER TABLE `posts` ADD FULLTEXT KEY `body_text` (`body`)"
+    ]
+
+
+def test_deferred_alters_keeps_other_definitions_in_one_alter():
+    definitions = ["KEY `a` (`a`)", "UNIQUE KEY `b` (`b`)"]
+
+    assert deferred_alters("t", definitions) == ["ALTER TABLE `t` ADD KEY `a` (`a`), ADD UNIQUE KEY `b` (`b`)"]
+
+
+def test_wait_all_cancels_queued_work_after_a_failure():
+    ran = []
+    proceed = threading.Event()
+
+    def load(i):
+        if i == 0:
+            raise RuntimeError("Lost connection to MySQL server")
+        proceed.wait(5)
+        ran.append(i)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    futures = [executor.submit(load, i) for i in range(20)]
+    with pytest.raises(RuntimeError):
+        wait_all(futures)
+    proceed.set()
+    executor.shutdown()
+
+    # Only the load already running when the first one failed gets to finish
+    assert ran in ([], [1])
+    assert all(future.cancelled() for future in futures[2:])
@@ -0,0 +1,63 @@
+import json
+import threading
+
+import pytest
+
+from cybexdump import notification_manager
+from cybexdump.config_manager import validate_config
+from cybexdump.notification_manager import NotificationManager
+
+WEBHOOK = {"url": "http://hooks.example.com/backup"}
+
+
+@pytest.fixture
+def notifications(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".cybexdump").mkdir()
+    (tmp_path / ".cybexdump" / "config.json").write_text(json.dumps({
+        "databases": [],
+        "notification": {"enabled": True, "webhooks": [WEBHOOK, dict(WEBHOOK, format="slack")]}
+    }))
+    return NotificationManager()
+
+
+def test_a_failing_message_does_not_stop_delivery(notifications, monkeypatch):
+    sent = []
+
+    def send_webhook(webhook, subject, body, results):
+        if "shop" in subject:
+            raise RuntimeError("unexpected")
+        sent.append((webhook.get("format"), subject))
+
+    monkeypatch.setattr(notifications, "_send_webhook", send_webhook)
+    notifications.send_backup_notification(False, "shop", "boom")
+    notifications.send_backup_notification(True, "blog")
+    notifications.flush()
+
+    assert sent == [(None, "Backup Success - blog"), ("slack", "Backup Success - blog")]
+    assert notifications._worker.is_alive()
+
+
+def test_flush_stops_waiting_for_a_stuck_delivery(notifications, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(notification_manager, "FLUSH_TIMEOUT", 0.1)
+    monkeypatch.setattr(notifications, "_send_webhook", lambda *args: release.wait(5))
+    notifications.send_backup_notification(True, "shop")
+    try:
+        notifications.flush()
+    finally:
+        release.set()
+
+
+@pytest.mark.parametrize("notification, missing", [
+    ({"enabled": True, "email": "ops@example.com", "smtp_server": "smtp"}, ["smtp_username"]),
+    ({"enabled": True, "email": "ops@example.com", "smtp_username": "", "smtp_server": ""},
+     ["smtp_server", "smtp_username"]),
+    ({"enabled": True, "email": "ops@example.com", "smtp_server": "smtp", "smtp_username": "backup@example.com"},
+     []),
+    ({"enabled": False, "email": "", "smtp_server": "", "smtp_username": ""}, []),
+])
+def test_email_notifications_need_a_server_and_sender(notification, missing):
+    errors = validate_config({"databases": [], "notification": notification})
+
+    assert errors == [f"notification.{key}: required for email notifications" for key in missing]
@@ -0,0 +1,46 @@
+from cybexdump.replica import ReplicaSelector
+
+REPLICA = {"host": "replica", "port": 3307}
+POSITION = {"file": "binlog.000042", "position": 1234, "gtid_set": None}
+
+
+def _selector(monkeypatch, calls):
+    def sql_thread(self, server_config, action):
+        calls.append((server_config["host"], server_config["port"], action))
+        return dict(POSITION) if action == "STOP" else None
+
+    monkeypatch.setattr(ReplicaSelector, "_sql_thread", sql_thread)
+    return ReplicaSelector({"host": "primary", "port": 3306, "username": "u", "password": "p"})
+
+
+def test_a_replica_paused_twice_restarts_after_the_last_resume(monkeypatch):
+    calls = []
+    first, second = _selector(monkeypatch, calls), _selector(monkeypatch, calls)
+
+    assert first.pause(REPLICA) == POSITION
+    # The second backup gets the position the replica already stopped at
+    assert second.pause(REPLICA) == POSITION
+    assert calls == [("replica", 3307, "STOP")]
+
+    first.resume(REPLICA)
+    assert calls == [("replica", 3307, "STOP")]
+    second.resume(REPLICA)
+    assert calls == [("replica", 3307, "STOP"), ("replica", 3307, "START")]
+
+
+def test_pauses_of_different_replicas_are_counted_apart(monkeypatch):
+    calls = []
+    selector = _selector(monkeypatch, calls)
+    other = {"host": "replica", "port": 3308}
+
+    selector.pause(REPLICA)
+    selector.pause(other)
+    selector.resume(other)
+    selector.resume(REPLICA)
+    # Resuming a replica that isn't paused does nothing
+    selector.resume(REPLICA)
+
+    assert calls == [
+        ("replica", 3307, "STOP"), ("replica", 3308, "STOP"),
+        ("replica", 3308, "START"), ("replica", 3307, "START")
+    ]
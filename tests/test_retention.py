@@ -0,0 +1,142 @@
+from datetime import datetime
+
+import pytest
+
+from cybexdump.config_manager import validate_config
+from cybexdump.retention import RetentionPolicy
+
+NOW = datetime(2025, 3, 15, 12, 0)
+
+
+def _entry(created, schema="shop", **entry):
+    return dict({"schema_name": schema, "created": created, "path": f"/backups/{schema}/{created}"}, **entry)
+
+
+def _kept(kept):
+    return {(entry["schema_name"], entry["created"], entry.get("content")): entry["kept_by"] for entry in kept}
+
+
+def test_partial_backups_do_not_take_the_slot_of_a_full_backup():
+    entries = [
+        _entry("2025-03-15T02:00:00"),
+        _entry("2025-03-15T10:00:00", content="schema"),
+        _entry("2025-03-15T11:00:00", tables=["orders"]),
+        _entry("2025-03-14T02:00:00"),
+    ]
+    kept, expired = RetentionPolicy(daily=1).apply(entries, NOW)
+
+    assert _kept(kept) == {
+        ("shop", "2025-03-15T02:00:00", None): ["newest", "daily"],
+        ("shop", "2025-03-15T10:00:00", "schema"): ["daily"],
+        ("shop", "2025-03-15T11:00:00", None): ["newest", "daily"],
+    }
+    assert [entry["created"] for entry in expired] == ["2025-03-14T02:00:00"]
+
+
+def test_days_keep_everything_since_the_cutoff():
+    entries = [_entry("2025-03-15T11:00:00"), _entry("2025-03-08T12:00:00"), _entry("2025-03-08T11:59:59")]
+    kept, expired = RetentionPolicy(days=7).apply(entries, NOW)
+
+    assert _kept(kept) == {
+        ("shop", "2025-03-15T11:00:00", None): ["days", "newest"],
+        ("shop", "2025-03-08T12:00:00", None): ["days"],
+    }
+    assert [entry["created"] for entry in expired] == ["2025-03-08T11:59:59"]
+
+
+def test_hourly_keeps_the_newest_of_each_hour():
+    entries = [_entry("2025-03-15T11:45:00"), _entry("2025-03-15T11:15:00"), _entry("2025-03-15T10:59:00"),
+               _entry("2025-03-15T09:00:00")]
+    kept, _ = RetentionPolicy(hourly=2).apply(entries, NOW)
+
+    assert sorted(entry["created"] for entry in kept) == ["2025-03-15T10:59:00", "2025-03-15T11:45:00"]
+
+
+def test_daily_counts_days_with_a_backup():
+    # No backup on the 13th: the 12th takes its place
+    entries = [_entry("2025-03-15T02:00:00"), _entry("2025-03-14T23:59:00"), _entry("2025-03-14T02:00:00"),
+               _entry("2025-03-12T02:00:00"), _entry("2025-03-11T02:00:00")]
+    kept, _ = RetentionPolicy(daily=3).apply(entries, NOW)
+
+    assert sorted(entry["created"] for entry in kept) == [
+        "2025-03-12T02:00:00", "2025-03-14T23:59:00", "2025-03-15T02:00:00"
+    ]
+
+
+def test_weekly_uses_iso_weeks():
+    # Mon 2025-03-10 starts a week; Sun 2025-03-09 ends the one before.
+    # Mon 2024-12-30 is in ISO week 1 of 2025, with Fri 2025-01-03.
+    entries = [_entry("2025-03-10T00:00:00"), _entry("2025-03-09T23:59:00"), _entry("2025-03-02T00:00:00"),
+               _entry("2025-01-03T00:00:00"), _entry("2024-12-30T00:00:00"), _entry("2024-12-29T00:00:00")]
+    kept, expired = RetentionPolicy(weekly=4).apply(entries, NOW)
+
+    assert sorted(entry["created"] for entry in kept) == [
+        "2025-01-03T00:00:00", "2025-03-02T00:00:00", "2025-03-09T23:59:00", "2025-03-10T00:00:00"
+    ]
+    assert sorted(entry["created"] for entry in expired) == ["2024-12-29T00:00:00", "2024-12-30T00:00:00"]
+
+
+def test_monthly_keeps_the_newest_of_each_month():
+    entries = [_entry("2025-03-01T00:00:00"), _entry("2025-02-28T23:59:00"), _entry("2025-02-01T00:00:00"),
+               _entry("2025-01-31T00:00:00"), _entry("2024-12-31T00:00:00")]
+    kept, expired = RetentionPolicy(monthly=3).apply(entries, NOW)
+
+    assert sorted(entry["created"] for entry in kept) == [
+        "2025-01-31T00:00:00", "2025-02-28T23:59:00", "2025-03-01T00:00:00"
+    ]
+    assert sorted(entry["created"] for entry in expired) == ["2024-12-31T00:00:00", "2025-02-01T00:00:00"]
+
+
+def test_tiers_count_periods_per_schema():
+    entries = [_entry("2025-03-15T02:00:00", "shop"), _entry("2025-03-14T02:00:00", "shop"),
+               _entry("2025-03-13T02:00:00", "blog"), _entry("2025-03-12T02:00:00", "blog"),
+               _entry("2025-03-11T02:00:00", "blog")]
+    kept, _ = RetentionPolicy(daily=2).apply(entries, NOW)
+
+    assert sorted((entry["schema_name"], entry["created"]) for entry in kept) == [
+        ("blog", "2025-03-12T02:00:00"), ("blog", "2025-03-13T02:00:00"),
+        ("shop", "2025-03-14T02:00:00"), ("shop", "2025-03-15T02:00:00"),
+    ]
+
+
+def test_rules_combine():
+    entries = [_entry("2025-03-15T02:00:00"), _entry("2025-03-14T13:00:00"), _entry("2025-02-10T02:00:00")]
+    kept, expired = RetentionPolicy(days=1, daily=1, monthly=2).apply(entries, NOW)
+
+    assert _kept(kept) == {
+        ("shop", "2025-03-15T02:00:00", None): ["days", "newest", "daily", "monthly"],
+        ("shop", "2025-03-14T13:00:00", None): ["days"],
+        ("shop", "2025-02-10T02:00:00", None): ["monthly"],
+    }
+    assert expired == []
+
+
+def test_newest_backup_of_each_schema_is_always_kept():
+    entries = [_entry("2025-03-15T03:00:00", content="schema"), _entry("2025-03-15T02:00:00"),
+               _entry("2025-03-14T02:00:00"), _entry("2025-01-01T00:00:00", "blog")]
+    kept, expired = RetentionPolicy().apply(entries, NOW)
+
+    # The newest backup, and the newest full one when the newest is partial
+    assert _kept(kept) == {
+        ("shop", "2025-03-15T03:00:00", "schema"): ["newest"],
+        ("shop", "2025-03-15T02:00:00", None): ["newest"],
+        ("blog", "2025-01-01T00:00:00", None): ["newest"],
+    }
+    assert [entry["created"] for entry in expired] == ["2025-03-14T02:00:00"]
+
+
+@pytest.mark.parametrize("schedule, retention, keeps_nothing", [
+    ({"retention_days": 7}, None, False),
+    ({"retention_days": 0}, None, True),
+    ({}, {}, False),
+    ({}, {"daily": 0, "weekly": 0}, True),
+    ({"retention_days": 0}, {"monthly": 12}, False),
+])
+def test_config_that_keeps_no_backups_is_rejected(schedule, retention, keeps_nothing):
+    db_config = {"id": 1, "type": "mongodb", "host": "db", "port": 27017, "databases": "all",
+                 "schedule": dict(schedule, frequency="daily", time="02:00")}
+    if retention is not None:
+        db_config["retention"] = retention
+    errors = validate_config({"databases": [db_config]})
+
+    assert any("keeps no backups" in error for error in errors) == keeps_nothing
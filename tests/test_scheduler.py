@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import pytest
+
+from cybexdump import scheduler
+from cybexdump.cron_expression import CronExpression
+from cybexdump.scheduler import next_due
+
+
+@pytest.mark.parametrize("expression, now, jitter, latest", [
+    # Capped at a quarter of the interval
+    ("* * * * *", datetime(2025, 1, 1, 10, 0, 30), 300, datetime(2025, 1, 1, 10, 1, 15)),
+    ("*/5 * * * *", datetime(2025, 1, 1, 10, 0), 300, datetime(2025, 1, 1, 10, 6, 15)),
+    # The interval after the next run, here the short gap from 9:00 to 9:10
+    ("0,10 9 * * *", datetime(2025, 1, 1, 8, 0), 300, datetime(2025, 1, 1, 9, 2, 30)),
+    # The jitter itself when it is the smaller
+    ("30 2 * * *", datetime(2025, 1, 1, 10, 0), 300, datetime(2025, 1, 2, 2, 35)),
+    ("*/5 * * * *", datetime(2025, 1, 1, 10, 0), 0, datetime(2025, 1, 1, 10, 5)),
+])
+def test_jitter_is_capped_by_the_interval(monkeypatch, expression, now, jitter, latest):
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: high)
+
+    assert next_due(CronExpression(expression), now, jitter) == latest
+
+
+def test_every_slot_of_a_frequent_job_runs_once():
+    cron = CronExpression("*/5 * * * *")
+    now = datetime(2025, 1, 1, 10, 0)
+    slots = []
+    for _ in range(200):
+        now = next_due(cron, now, 300)
+        slots.append(cron.last_run(now))
+
+    assert slots == sorted(set(slots))
+    assert all((later - earlier).total_seconds() == 300 for earlier, later in zip(slots, slots[1:]))